@@ -0,0 +1,389 @@
+"""
+Monthly range partitioning of access_requests, retention and archives.
+
+Once converted, access_requests is partitioned on created_at into one
+table per month (access_requests_YYYY_MM) plus a default partition that
+catches rows outside every range. The app keeps partitions created a few
+months ahead (maintain()), so inserts always land in a monthly table and
+queries bounded on created_at only touch the months they ask for.
+
+With a retention period set, partitions older than it are written to
+gzip-compressed CSV files (one per month) in the archive directory, then
+detached and dropped. The hourly rollup keeps their counts, so analytics
+are unaffected; the raw rows stay queryable through the archive tooling.
+
+Run from the backend directory:
+
+    python -m access_partitions convert              # one-off, locks the table while copying
+    python -m access_partitions maintain --retention-months 12
+    python -m access_partitions list
+    python -m access_partitions query --from 2023-01-01 --to 2023-03-31 --uid 04A1B2
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import re
+import sys
+from datetime import date, datetime
+
+from access_rollup import ACCESS_REQUEST_INDEXES
+
+PARENT = 'access_requests'
+DEFAULT_PARTITION = 'access_requests_default'
+LEGACY_TABLE = 'access_requests_unpartitioned'
+
+MAINTENANCE_LOCK = 7460114  # pg advisory lock key, one maintainer at a time
+
+PARTITION_NAME = re.compile(r'^access_requests_(\d{4})_(\d{2})$')
+ARCHIVE_NAME = re.compile(r'^access_requests_(\d{4})_(\d{2})\.csv\.gz$')
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"{PARENT}_{month:%Y_%m}"
+
+
+def is_partitioned(cursor):
+    cursor.execute("SELECT relkind = 'p' as partitioned FROM pg_class WHERE oid = to_regclass(%s)", (PARENT,))
+    row = cursor.fetchone()
+    return bool(row and row['partitioned'])
+
+
+def list_partitions(cursor):
+    """[(name, month, estimated rows, bytes)] for the monthly partitions, oldest first"""
+    cursor.execute("""
+        SELECT c.relname as name, c.reltuples::bigint as rows, pg_total_relation_size(c.oid) as bytes
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+    """, (PARENT,))
+    partitions = []
+    for row in cursor.fetchall():
+        match = PARTITION_NAME.match(row['name'])
+        if match:
+            month = date(int(match.group(1)), int(match.group(2)), 1)
+            partitions.append((row['name'], month, max(int(row['rows']), 0), int(row['bytes'])))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def create_partition(cursor, month):
+    """
+    Create and attach the partition for `month`, if missing.
+
+    Rows for that month already sitting in the default partition are moved
+    into the new table before it is attached. Returns True if created.
+    """
+    name = partition_name(month)
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL as exists", (name,))
+    if cursor.fetchone()['exists']:
+        return False
+
+    low, high = month, add_months(month, 1)
+    cursor.execute(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL as exists", (DEFAULT_PARTITION,))
+    if cursor.fetchone()['exists']:
+        cursor.execute(f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """, (low, high))
+    cursor.execute(f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", (low, high))
+    return True
+
+
+def ensure_partitions(cursor, today, months_ahead):
+    """Create partitions for the current month and `months_ahead` after it; returns the new names"""
+    created = []
+    current = month_start(today)
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if create_partition(cursor, month):
+            created.append(partition_name(month))
+    return created
+
+
+def archive_path(archive_dir, name):
+    return os.path.join(archive_dir, f"{name}.csv.gz")
+
+
+def archive_partition(conn, name, archive_dir):
+    """
+    Export one partition to a compressed CSV file, then detach and drop it.
+
+    The file is complete and fsynced before the partition is dropped, so a
+    failure in between only leaves an archive that the next run rewrites.
+    Returns (path, rows written).
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    path = archive_path(archive_dir, name)
+    temp_path = path + '.tmp'
+
+    cursor = conn.cursor()
+    with open(temp_path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as compressed:
+            cursor.copy_expert(f"COPY (SELECT * FROM {name} ORDER BY created_at, id) TO STDOUT WITH (FORMAT csv, HEADER)",
+                               compressed)
+        rows = cursor.rowcount
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(temp_path, path)
+
+    cursor.execute(f"ALTER TABLE {PARENT} DETACH PARTITION {name}")
+    cursor.execute(f"DROP TABLE {name}")
+    conn.commit()
+    cursor.close()
+    return path, rows
+
+
+def apply_retention(conn, today, retention_months, archive_dir):
+    """Archive and drop partitions that ended more than `retention_months` months ago"""
+    cutoff = add_months(month_start(today), -retention_months)
+    cursor = conn.cursor()
+    expired = [name for name, month, _, _ in list_partitions(cursor) if add_months(month, 1) <= cutoff]
+    conn.commit()
+    cursor.close()
+    return [archive_partition(conn, name, archive_dir) for name in expired]
+
+
+def maintain(conn, today=None, months_ahead=3, retention_months=0, archive_dir='access_archive'):
+    """
+    Create upcoming partitions and apply retention (0 keeps everything).
+
+    Returns:
+        dict: {'created': [names], 'archived': [(path, rows)]}, or None when
+        the table is not partitioned or another process holds the lock.
+    """
+    today = today or datetime.now().date()
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_try_advisory_lock(%s) as locked", (MAINTENANCE_LOCK,))
+    if not cursor.fetchone()['locked']:
+        conn.rollback()
+        return None
+
+    try:
+        if not is_partitioned(cursor):
+            conn.rollback()
+            return None
+        created = ensure_partitions(cursor, today, months_ahead)
+        conn.commit()
+        archived = apply_retention(conn, today, retention_months, archive_dir) if retention_months > 0 else []
+        return {'created': created, 'archived': archived}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (MAINTENANCE_LOCK,))
+        conn.commit()
+        cursor.close()
+
+
+def convert_to_partitioned(conn, months_ahead=3, drop_old=False):
+    """
+    Replace a plain access_requests table with a partitioned one.
+
+    Runs in a single transaction holding an exclusive lock on the table while
+    rows are copied, so schedule it for a quiet period. The old table is
+    kept as access_requests_unpartitioned unless `drop_old` is set.
+
+    Returns:
+        int: Rows copied, or None if the table was already partitioned.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"LOCK TABLE {PARENT} IN ACCESS EXCLUSIVE MODE")
+    if is_partitioned(cursor):
+        conn.rollback()
+        return None
+
+    cursor.execute("""
+        SELECT is_identity = 'YES' as identity FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND column_name = 'id'
+    """, (PARENT,))
+    identity = cursor.fetchone()['identity']
+
+    cursor.execute(f"ALTER TABLE {PARENT} RENAME TO {LEGACY_TABLE}")
+    # Free the index and primary key names for the new table
+    cursor.execute("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s",
+                   (LEGACY_TABLE,))
+    for row in cursor.fetchall():
+        cursor.execute(f"ALTER INDEX {row['indexname']} RENAME TO {row['indexname'][:50]}_unpartitioned")
+    cursor.execute(f"""
+        CREATE TABLE {PARENT} (LIKE {LEGACY_TABLE} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS)
+        PARTITION BY RANGE (created_at)
+    """)
+    cursor.execute(f"ALTER TABLE {PARENT} ADD PRIMARY KEY (id, created_at)")
+    if not identity:
+        # The serial sequence would otherwise be dropped along with the old table
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id') as sequence", (LEGACY_TABLE,))
+        sequence = cursor.fetchone()['sequence']
+        if sequence:
+            cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {PARENT}.id")
+    cursor.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {PARENT} DEFAULT")
+
+    cursor.execute(f"SELECT MIN(created_at) as first FROM {LEGACY_TABLE}")
+    first = cursor.fetchone()['first']
+    today = datetime.now().date()
+    month = month_start(first.date() if first else today)
+    while month <= month_start(today):
+        create_partition(cursor, month)
+        month = add_months(month, 1)
+    ensure_partitions(cursor, today, months_ahead)
+
+    cursor.execute(f"INSERT INTO {PARENT} SELECT * FROM {LEGACY_TABLE}")
+    copied = cursor.rowcount
+    cursor.execute(f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {PARENT}",
+                   (PARENT,))
+
+    # Partitioned indexes cascade to every partition, current and future
+    for _, statement in ACCESS_REQUEST_INDEXES:
+        cursor.execute(statement.replace(' CONCURRENTLY', ''))
+    if drop_old:
+        cursor.execute(f"DROP TABLE {LEGACY_TABLE}")
+    conn.commit()
+    cursor.close()
+    return copied
+
+
+def archive_files(archive_dir, start_day=None, end_day=None):
+    """[(month, path)] of archive files overlapping start_day..end_day, oldest first"""
+    if not os.path.isdir(archive_dir):
+        return []
+    files = []
+    for filename in os.listdir(archive_dir):
+        match = ARCHIVE_NAME.match(filename)
+        if not match:
+            continue
+        month = date(int(match.group(1)), int(match.group(2)), 1)
+        if start_day and add_months(month, 1) <= start_day:
+            continue
+        if end_day and month > end_day:
+            continue
+        files.append((month, os.path.join(archive_dir, filename)))
+    return sorted(files)
+
+
+def query_archives(archive_dir, start_day=None, end_day=None, uid=None, product_id=None, outcome=None):
+    """
+    Yield archived access_requests rows (as dicts of strings) matching the filters.
+
+    Only the archive files for the requested months are opened; days are
+    inclusive.
+    """
+    start = start_day.isoformat() if start_day else None
+    end = end_day.isoformat() if end_day else None
+    for _, path in archive_files(archive_dir, start_day, end_day):
+        with gzip.open(path, 'rt', newline='') as archive:
+            for row in csv.DictReader(archive):
+                day = row['created_at'][:10]
+                if start and day < start:
+                    continue
+                if end and day > end:
+                    continue
+                if uid and row['uid'] != uid:
+                    continue
+                if product_id and row['product_id'] != product_id:
+                    continue
+                if outcome is not None and row.get('outcome') != str(outcome):
+                    continue
+                yield row
+
+
+def main():
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    default_archive_dir = os.getenv("ACCESS_ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                         'access_archive'))
+    parse_day = lambda value: datetime.strptime(value, '%Y-%m-%d').date()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--archive-dir', default=default_archive_dir)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    convert = commands.add_parser('convert', help="Convert access_requests to monthly partitions")
+    convert.add_argument('--months-ahead', type=int, default=int(os.getenv("ACCESS_PARTITION_MONTHS_AHEAD", 3)))
+    convert.add_argument('--drop-old', action='store_true', help=f"Drop {LEGACY_TABLE} after copying")
+
+    maintain_parser = commands.add_parser('maintain', help="Create upcoming partitions and apply retention")
+    maintain_parser.add_argument('--months-ahead', type=int, default=int(os.getenv("ACCESS_PARTITION_MONTHS_AHEAD", 3)))
+    maintain_parser.add_argument('--retention-months', type=int, default=int(os.getenv("ACCESS_RETENTION_MONTHS", 0)),
+                                 help="Archive partitions older than this many months (0 keeps everything)")
+
+    commands.add_parser('list', help="Show partitions and archive files")
+
+    query = commands.add_parser('query', help="Read archived rows")
+    query.add_argument('--from', dest='start_day', type=parse_day)
+    query.add_argument('--to', dest='end_day', type=parse_day)
+    query.add_argument('--uid')
+    query.add_argument('--product-id')
+    query.add_argument('--outcome', type=int, choices=[0, 1, 2])
+    query.add_argument('--format', default='csv', choices=['csv', 'json'])
+    args = parser.parse_args()
+
+    if args.command == 'query':
+        rows = query_archives(args.archive_dir, args.start_day, args.end_day, args.uid, args.product_id, args.outcome)
+        writer = None
+        for row in rows:
+            if args.format == 'json':
+                print(json.dumps(row))
+                continue
+            if writer is None:
+                writer = csv.DictWriter(sys.stdout, fieldnames=list(row.keys()))
+                writer.writeheader()
+            writer.writerow(row)
+        return
+
+    conn = psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        port=os.getenv("DB_PORT"),
+        cursor_factory=RealDictCursor
+    )
+    try:
+        if args.command == 'convert':
+            started = datetime.now()
+            copied = convert_to_partitioned(conn, args.months_ahead, args.drop_old)
+            if copied is None:
+                print(f"{PARENT} is already partitioned")
+            else:
+                print(f"Copied {copied} rows into monthly partitions in {(datetime.now() - started).total_seconds():.1f}s")
+                if not args.drop_old:
+                    print(f"The old table is kept as {LEGACY_TABLE}; drop it once the new one is verified")
+        elif args.command == 'maintain':
+            result = maintain(conn, months_ahead=args.months_ahead, retention_months=args.retention_months,
+                              archive_dir=args.archive_dir)
+            if result is None:
+                print(f"Nothing to do: {PARENT} is not partitioned or maintenance is running elsewhere")
+            else:
+                for name in result['created']:
+                    print(f"Created partition {name}")
+                for path, rows in result['archived']:
+                    print(f"Archived {rows} rows to {path}")
+        else:
+            cursor = conn.cursor()
+            print(f"{PARENT} is {'partitioned' if is_partitioned(cursor) else 'not partitioned'}")
+            for name, month, rows, size in list_partitions(cursor):
+                print(f"  {name:<28} ~{rows:>10} rows {size / 1048576:>9.1f} MB")
+            for month, path in archive_files(args.archive_dir):
+                print(f"  archive {month:%Y-%m}  {path} ({os.path.getsize(path) / 1048576:.1f} MB)")
+            cursor.close()
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
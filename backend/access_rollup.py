@@ -0,0 +1,513 @@
+"""
+Access outcome codes and pre-aggregated access counts for analytics.
+
+access_requests.outcome holds the normalized result of each tap (see
+access_outcome()), so analytics filter on an indexed smallint instead of
+LIKE '%Granted%' over the raw status text.
+
+access_rollup holds one row per (day, hour, product_id, outcome) with the
+number of access_requests rows in that bucket, and access_uids the set of
+card UIDs ever seen. Both are maintained in the same statement that
+inserts the raw rows (insert_access_requests), so analytics read a few
+hundred rollup rows instead of scanning the event log.
+
+card_assignments holds the current state of each (uid, product_id) card
+pair: the same statement registers pairs seen in taps (inactive), and the
+assignment and card status routes set their active flag. The access
+snapshot reads it instead of grouping the event log; package types stay
+in card_packages.
+
+The column, indexes and tables are created by the schema migrations
+(schema.py), which also fill the rollup and card_assignments from the
+existing event log. History written by other tools is reloaded with the
+backfill command, run from the backend directory:
+
+    python -m access_rollup                       # rebuild every month still in access_requests
+    python -m access_rollup --since 2024-01-01    # rebuild from a day on
+    python -m access_rollup --outcomes            # only fill missing outcomes
+    python -m access_rollup --cards               # only add missing card_assignments
+"""
+import argparse
+import logging
+from datetime import datetime
+
+from psycopg2.extras import execute_values
+
+log = logging.getLogger(__name__)
+
+# Outcome codes
+OUTCOME_OTHER = 0
+OUTCOME_GRANTED = 1
+OUTCOME_DENIED = 2
+
+# SQL equivalent of access_outcome() over an access_status column, for backfills
+OUTCOME_SQL = "CASE WHEN {column} ILIKE '%%granted%%' THEN 1 WHEN {column} ILIKE '%%denied%%' THEN 2 ELSE 0 END"
+
+OUTCOME_COLUMN_DDL = "ALTER TABLE access_requests ADD COLUMN IF NOT EXISTS outcome SMALLINT"
+
+# (name, statement); built CONCURRENTLY so adding them never blocks ingestion.
+# (created_at, id) backs keyset pagination of the entries list and the others its filters
+ACCESS_REQUEST_INDEXES = (
+    ('idx_access_requests_outcome_created',
+     "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_access_requests_outcome_created ON access_requests (outcome, created_at)"),
+    ('idx_access_requests_product_created',
+     "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_access_requests_product_created ON access_requests (product_id, created_at)"),
+    ('idx_access_requests_created_id',
+     "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_access_requests_created_id ON access_requests (created_at, id)"),
+    ('idx_access_requests_uid_created',
+     "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_access_requests_uid_created ON access_requests (uid, created_at)"),
+)
+
+OUTCOME_BACKFILL_LOCK = 7460113  # pg advisory lock key, one backfill at a time
+
+ROLLUP_DDL = """
+    CREATE TABLE IF NOT EXISTS access_rollup (
+        day DATE NOT NULL,
+        hour SMALLINT NOT NULL,
+        product_id VARCHAR(255) NOT NULL DEFAULT '',
+        outcome SMALLINT NOT NULL,
+        count BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, hour, product_id, outcome)
+    );
+    CREATE TABLE IF NOT EXISTS access_uids (
+        uid VARCHAR(255) PRIMARY KEY,
+        first_seen TIMESTAMP NOT NULL DEFAULT NOW()
+    );
+"""
+
+# product_id '' stands for taps whose product was unknown (NULL in access_requests)
+CARD_ASSIGNMENTS_DDL = """
+    CREATE TABLE IF NOT EXISTS card_assignments (
+        uid VARCHAR(255) NOT NULL,
+        product_id VARCHAR(255) NOT NULL DEFAULT '',
+        active BOOLEAN NOT NULL DEFAULT FALSE,
+        assigned_at TIMESTAMP,
+        updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (uid, product_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_card_assignments_product ON card_assignments (product_id, uid);
+"""
+
+# Raw insert plus rollup maintenance in one statement; {columns} must include
+# outcome and whatever else the caller passes in VALUES
+INSERT_ACCESS_SQL = """
+    WITH inserted AS (
+        INSERT INTO access_requests ({columns})
+        VALUES %s
+        RETURNING uid, product_id, outcome, created_at
+    ), known_cards AS (
+        INSERT INTO card_assignments (uid, product_id)
+        SELECT DISTINCT uid, COALESCE(product_id, '') FROM inserted WHERE uid IS NOT NULL
+        ORDER BY 1, 2
+        ON CONFLICT DO NOTHING
+        RETURNING product_id
+    ), rolled_up AS (
+        INSERT INTO access_rollup (day, hour, product_id, outcome, count)
+        SELECT created_at::date, EXTRACT(HOUR FROM created_at)::smallint,
+               COALESCE(product_id, ''), outcome, COUNT(*)
+        FROM inserted
+        GROUP BY 1, 2, 3, 4
+        ORDER BY 1, 2, 3, 4
+        ON CONFLICT (day, hour, product_id, outcome)
+        DO UPDATE SET count = access_rollup.count + EXCLUDED.count
+    ), new_uids AS (
+        INSERT INTO access_uids (uid)
+        SELECT DISTINCT uid FROM inserted WHERE uid IS NOT NULL
+        ON CONFLICT DO NOTHING
+    )
+    SELECT DISTINCT product_id FROM known_cards
+"""
+
+
+def access_outcome(access_status):
+    """Outcome code for a raw access_status string"""
+    status = (access_status or '').lower()
+    if 'granted' in status:
+        return OUTCOME_GRANTED
+    if 'denied' in status:
+        return OUTCOME_DENIED
+    return OUTCOME_OTHER
+
+
+def create_rollup_tables(cursor):
+    cursor.execute(ROLLUP_DDL)
+
+
+def create_access_rollup(cursor):
+    """Create the rollup tables and load them from the event log (a schema migration step)"""
+    create_rollup_tables(cursor)
+    written = backfill_rollup(cursor)
+    log.info("Backfilled %s rollup rows", written)
+
+
+def create_card_assignments(cursor):
+    """Create card_assignments and, the first time, fill it from the event log (a schema migration step)"""
+    cursor.execute("SELECT to_regclass('card_assignments') IS NULL as missing")
+    missing = cursor.fetchone()['missing']
+    cursor.execute(CARD_ASSIGNMENTS_DDL)
+    if missing:
+        written = backfill_card_assignments(cursor)
+        log.info("Backfilled %s card assignments", written)
+
+
+def backfill_card_assignments(cursor):
+    """
+    Add the card pairs of the event log that card_assignments is missing.
+
+    A new pair is active if any of its rows is (the rule the snapshot used
+    when it grouped access_requests); assigned_at is its first 'Assigned'
+    row. Pairs already in card_assignments are left alone: status changes
+    are only recorded there, so the log cannot tell whether a card was
+    deactivated since. Runs in the caller's transaction. Returns the
+    number of pairs written.
+    """
+    cursor.execute("""
+        INSERT INTO card_assignments (uid, product_id, active, assigned_at, updated_at)
+        SELECT uid, COALESCE(product_id, ''), BOOL_OR(COALESCE(active, FALSE)),
+               MIN(created_at) FILTER (WHERE access_status = 'Assigned'), MAX(created_at)
+        FROM access_requests
+        WHERE uid IS NOT NULL
+        GROUP BY 1, 2
+        ON CONFLICT (uid, product_id) DO NOTHING
+    """)
+    return cursor.rowcount
+
+
+def set_card_active(cursor, uid, product_id, active, assigned=False):
+    """Upsert the active flag of a card pair; `assigned` also stamps assigned_at"""
+    cursor.execute("""
+        INSERT INTO card_assignments (uid, product_id, active, assigned_at, updated_at)
+        VALUES (%s, %s, %s, CASE WHEN %s THEN NOW() END, NOW())
+        ON CONFLICT (uid, product_id) DO UPDATE
+        SET active = EXCLUDED.active,
+            assigned_at = COALESCE(EXCLUDED.assigned_at, card_assignments.assigned_at),
+            updated_at = NOW()
+    """, (uid, product_id or '', active, assigned))
+
+
+def update_card_active(cursor, uid, product_id, active):
+    """Set the active flag of an existing card pair; False if there is no such pair"""
+    cursor.execute("""
+        UPDATE card_assignments SET active = %s, updated_at = NOW()
+        WHERE uid = %s AND product_id = %s
+    """, (active, uid, product_id or ''))
+    return cursor.rowcount > 0
+
+
+def build_access_request_indexes(conn):
+    """
+    Build the access_requests indexes (a schema migration step run outside a transaction).
+
+    CONCURRENTLY needs autocommit; the connection's previous mode is
+    restored afterwards. A build that failed or was interrupted leaves an
+    INVALID index that IF NOT EXISTS would skip forever, so those are
+    dropped and rebuilt. A partitioned access_requests (see
+    access_partitions) cannot build them concurrently, and gets plain
+    partitioned indexes instead.
+    """
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT relkind = 'p' as partitioned FROM pg_class WHERE oid = to_regclass('access_requests')")
+        partitioned = cursor.fetchone()['partitioned']
+        cursor.execute("""
+            SELECT index_class.relname as name
+            FROM pg_index
+            JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid
+            WHERE pg_index.indrelid = to_regclass('access_requests') AND NOT pg_index.indisvalid
+        """)
+        invalid = {row['name'] for row in cursor.fetchall()}
+        for name, statement in ACCESS_REQUEST_INDEXES:
+            if name in invalid:
+                log.warning("Rebuilding invalid index %s", name)
+                cursor.execute(f"DROP INDEX {'' if partitioned else 'CONCURRENTLY '}IF EXISTS {name}")
+            cursor.execute(statement.replace(' CONCURRENTLY', '') if partitioned else statement)
+        cursor.close()
+    finally:
+        conn.autocommit = autocommit
+
+
+def backfill_outcomes(conn, batch_size=50000):
+    """
+    Fill outcome for rows written before the column existed.
+
+    Walks the table in id ranges, committing each range, so it never holds
+    long locks. Returns the number of rows updated, or None if another
+    process already holds the backfill lock.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_try_advisory_lock(%s) as locked", (OUTCOME_BACKFILL_LOCK,))
+    if not cursor.fetchone()['locked']:
+        conn.rollback()
+        return None
+
+    updated = 0
+    try:
+        cursor.execute("SELECT MIN(id) as low, MAX(id) as high FROM access_requests WHERE outcome IS NULL")
+        bounds = cursor.fetchone()
+        conn.commit()
+        if bounds['low'] is None:
+            return 0
+
+        for low in range(bounds['low'], bounds['high'] + 1, batch_size):
+            cursor.execute(f"""
+                UPDATE access_requests SET outcome = {OUTCOME_SQL.format(column='access_status')}
+                WHERE id >= %s AND id < %s AND outcome IS NULL
+            """, (low, low + batch_size))
+            updated += cursor.rowcount
+            conn.commit()
+        return updated
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (OUTCOME_BACKFILL_LOCK,))
+        conn.commit()
+        cursor.close()
+
+
+def insert_access_requests(cursor, columns, rows):
+    """
+    Insert access_requests rows and fold them into the rollup.
+
+    Args:
+        cursor: Cursor in the caller's transaction.
+        columns (tuple): access_requests columns, in the order of each row;
+            must include 'outcome'.
+        rows (list): Value tuples.
+
+    Returns:
+        list: product_ids of card pairs seen for the first time ('' for an
+        unknown product), the only taps that change an access snapshot.
+    """
+    if not rows:
+        return []
+    sql = INSERT_ACCESS_SQL.format(columns=', '.join(columns))
+    new_pairs = execute_values(cursor, sql, rows, page_size=len(rows), fetch=True)
+    return [row['product_id'] for row in new_pairs]
+
+
+def backfill_rollup(cursor, since=None):
+    """
+    Rebuild rollup rows from access_requests, for every day or from `since` on.
+
+    Runs in the caller's transaction; the DELETE and re-aggregation commit
+    together, so readers never see a partially rebuilt day. Only months
+    that still have rows in access_requests are replaced: months whose
+    partitions retention archived and dropped (see access_partitions)
+    keep their rollup counts.
+
+    The rollup is locked against the ingest statement for the rebuild,
+    which waits for taps in flight and holds new ones until the caller
+    commits; otherwise a tap committed after the DELETE would add a row
+    the re-aggregation then collides with.
+
+    Returns:
+        int: Number of rollup rows written.
+    """
+    day_filter = "WHERE created_at >= %s" if since else ""
+    params = (since,) if since else ()
+
+    cursor.execute("LOCK TABLE access_rollup IN SHARE ROW EXCLUSIVE MODE")
+    cursor.execute(f"""
+        DELETE FROM access_rollup
+        WHERE date_trunc('month', day::timestamp) IN (
+            SELECT DISTINCT date_trunc('month', created_at) FROM access_requests {day_filter}
+        )
+        {'AND day >= %s' if since else ''}
+    """, params * 2)
+    cursor.execute(f"""
+        INSERT INTO access_rollup (day, hour, product_id, outcome, count)
+        SELECT created_at::date, EXTRACT(HOUR FROM created_at)::smallint,
+               COALESCE(product_id, ''),
+               COALESCE(outcome, {OUTCOME_SQL.format(column='access_status')}), COUNT(*)
+        FROM access_requests
+        {day_filter}
+        GROUP BY 1, 2, 3, 4
+    """, params)
+    written = cursor.rowcount
+
+    cursor.execute(f"""
+        INSERT INTO access_uids (uid, first_seen)
+        SELECT uid, MIN(created_at) FROM access_requests
+        {"WHERE uid IS NOT NULL AND created_at >= %s" if since else "WHERE uid IS NOT NULL"}
+        GROUP BY uid
+        ON CONFLICT DO NOTHING
+    """, params)
+    return written
+
+
+def dashboard_totals(cursor, today):
+    """Totals for the dashboard cards in a single pass over the rollup"""
+    cursor.execute("""
+        SELECT COALESCE(SUM(count), 0) as total_entries,
+               COALESCE(SUM(count) FILTER (WHERE day = %s), 0) as today_entries,
+               COUNT(DISTINCT NULLIF(product_id, '')) as unique_rooms,
+               COALESCE(SUM(count) FILTER (WHERE outcome = %s), 0) as granted_count,
+               COALESCE(SUM(count) FILTER (WHERE outcome = %s), 0) as denied_count,
+               (SELECT COUNT(*) FROM access_uids) as unique_users
+        FROM access_rollup
+    """, (today, OUTCOME_GRANTED, OUTCOME_DENIED))
+    return {key: int(value) for key, value in dict(cursor.fetchone()).items()}
+
+
+def daily_counts(cursor, start_day, end_day):
+    """{day: count} for start_day..end_day inclusive (days without taps omitted)"""
+    cursor.execute("""
+        SELECT day, SUM(count) as count
+        FROM access_rollup
+        WHERE day >= %s AND day <= %s
+        GROUP BY day
+    """, (start_day, end_day))
+    return {row['day']: int(row['count']) for row in cursor.fetchall()}
+
+
+def rollup_count(cursor, start_day=None, end_day=None, product_ids=None, outcome=None):
+    """
+    Number of access_requests rows matching whole-day, product and outcome
+    filters, summed from the rollup instead of counting the event log.
+    """
+    conditions, params = [], []
+    if start_day:
+        conditions.append("day >= %s")
+        params.append(start_day)
+    if end_day:
+        conditions.append("day <= %s")
+        params.append(end_day)
+    if product_ids is not None:
+        conditions.append("product_id = ANY(%s)")
+        params.append(list(product_ids))
+    if outcome is not None:
+        conditions.append("outcome = %s")
+        params.append(outcome)
+
+    cursor.execute(f"""
+        SELECT COALESCE(SUM(count), 0) as count FROM access_rollup
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+    """, params)
+    return int(cursor.fetchone()['count'])
+
+
+def trend_histograms(cursor, start_day, end_day):
+    """
+    Daily, hourly, day-of-week and outcome histograms in one grouped query.
+
+    Returns:
+        dict: {'daily': {day: count}, 'hourly': [24 counts],
+        'day_of_week': [7 counts, Monday first], 'outcomes': {code: count}}
+    """
+    cursor.execute("""
+        SELECT day, hour, (EXTRACT(ISODOW FROM day)::int - 1) as dow, outcome,
+               GROUPING(day) as no_day, GROUPING(hour) as no_hour,
+               GROUPING(EXTRACT(ISODOW FROM day)::int - 1) as no_dow,
+               SUM(count) as count
+        FROM access_rollup
+        WHERE day >= %s AND day <= %s
+        GROUP BY GROUPING SETS ((day), (hour), (EXTRACT(ISODOW FROM day)::int - 1), (outcome))
+    """, (start_day, end_day))
+
+    histograms = {'daily': {}, 'hourly': [0] * 24, 'day_of_week': [0] * 7, 'outcomes': {}}
+    for row in cursor.fetchall():
+        count = int(row['count'])
+        if not row['no_day']:
+            histograms['daily'][row['day']] = count
+        elif not row['no_hour']:
+            histograms['hourly'][row['hour']] = count
+        elif not row['no_dow']:
+            histograms['day_of_week'][row['dow']] = count
+        else:
+            histograms['outcomes'][row['outcome']] = count
+    return histograms
+
+
+def room_histograms(cursor, start_day=None, end_day=None):
+    """
+    Per-product outcome, hour and day-of-week histograms in one grouped query.
+
+    Days are inclusive; either bound may be None for open-ended history.
+
+    Returns:
+        dict: {product_id: {'outcomes': {code: count}, 'hourly': [24 counts],
+        'day_of_week': [7 counts, Sunday first]}}
+    """
+    cursor.execute("""
+        SELECT product_id, hour, EXTRACT(DOW FROM day)::int as dow, outcome,
+               GROUPING(hour) as no_hour, GROUPING(EXTRACT(DOW FROM day)::int) as no_dow,
+               SUM(count) as count
+        FROM access_rollup
+        WHERE product_id <> ''
+          AND (%(start)s::date IS NULL OR day >= %(start)s)
+          AND (%(end)s::date IS NULL OR day <= %(end)s)
+        GROUP BY GROUPING SETS ((product_id, hour), (product_id, EXTRACT(DOW FROM day)::int),
+                                (product_id, outcome))
+    """, {'start': start_day, 'end': end_day})
+
+    rooms = {}
+    for row in cursor.fetchall():
+        room = rooms.setdefault(row['product_id'], {'outcomes': {}, 'hourly': [0] * 24, 'day_of_week': [0] * 7})
+        count = int(row['count'])
+        if not row['no_hour']:
+            room['hourly'][row['hour']] = count
+        elif not row['no_dow']:
+            room['day_of_week'][row['dow']] = count
+        else:
+            room['outcomes'][row['outcome']] = count
+    return rooms
+
+
+def main():
+    import os
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--since', type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+                        help="Only rebuild days on or after YYYY-MM-DD")
+    parser.add_argument('--outcomes', action='store_true',
+                        help="Only backfill access_requests.outcome, leave the rollup alone")
+    parser.add_argument('--cards', action='store_true',
+                        help="Only add card pairs from the event log missing in card_assignments")
+    args = parser.parse_args()
+
+    load_dotenv()
+    conn = psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        port=os.getenv("DB_PORT"),
+        cursor_factory=RealDictCursor
+    )
+    try:
+        # Column, indexes and tables come from the schema migrations
+        from schema import migrate
+        migrate(conn)
+
+        if args.cards:
+            cursor = conn.cursor()
+            started = datetime.now()
+            written = backfill_card_assignments(cursor)
+            conn.commit()
+            print(f"card_assignments backfilled: {written} pairs in {(datetime.now() - started).total_seconds():.1f}s")
+            return
+
+        started = datetime.now()
+        updated = backfill_outcomes(conn)
+        if updated is None:
+            print("Outcome backfill already running in another process")
+        else:
+            print(f"Outcome backfilled for {updated} rows in {(datetime.now() - started).total_seconds():.1f}s")
+        if args.outcomes:
+            return
+
+        cursor = conn.cursor()
+        started = datetime.now()
+        written = backfill_rollup(cursor, args.since)
+        conn.commit()
+        print(f"Rollup rebuilt {'from ' + str(args.since) if args.since else 'for every month in access_requests'}: "
+              f"{written} rows in {(datetime.now() - started).total_seconds():.1f}s")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,543 @@
+"""
+Set-based builder for the access-control snapshot served to door controllers.
+
+The snapshot (cards, active guests and per-product access lists) is compiled
+from a fixed handful of queries that are joined in memory, so the number of
+round trips does not grow with the number of guests, cards or VIP rooms.
+
+Both the /api/access_control_data route and the MQTT publisher use this
+module, which keeps their payloads identical. SnapshotCache keeps compiled
+per-product documents between polls, versioned so devices can ask for
+"nothing changed" (304) or only the changes since a version they hold.
+Versions are derived from the document content, so every process (and
+the MQTT publisher) gives the same document the same version.
+"""
+import hashlib
+import json
+import threading
+import time
+
+SPECIAL_CARD_TYPES = ('Master Card', 'Service Card')
+
+
+def load_snapshot_rows(cursor):
+    """
+    Run the snapshot queries and return their raw rows.
+
+    Args:
+        cursor: Database cursor returning dict-like rows.
+
+    Returns:
+        dict: Row lists keyed by source ('matrix', 'vip_rooms', 'products',
+        'packages', 'cards', 'guests').
+    """
+    rows = {}
+
+    # 1. Access matrix
+    cursor.execute("SELECT package_type, facility, has_access FROM access_matrix")
+    rows['matrix'] = cursor.fetchall()
+
+    # 2. VIP room mappings
+    cursor.execute("SELECT product_id, vip_rooms, COALESCE(updated, FALSE) as updated FROM vip_rooms")
+    rows['vip_rooms'] = cursor.fetchall()
+
+    # 3. Regular rooms
+    cursor.execute("SELECT product_id, room_no, COALESCE(updated, FALSE) as updated FROM productstable")
+    rows['products'] = cursor.fetchall()
+
+    # 4. Card packages, oldest first so the first package per UID is stable
+    cursor.execute("SELECT uid, product_id, package_type FROM card_packages ORDER BY id")
+    rows['packages'] = cursor.fetchall()
+
+    # 5. One row per known (card, product) pair, from the assignment table
+    cursor.execute("""
+        SELECT ca.uid, NULLIF(ca.product_id, '') as product_id,
+               COALESCE(cp.package_type, 'General') as type,
+               ca.active
+        FROM card_assignments ca
+        LEFT JOIN card_packages cp ON ca.uid = cp.uid AND ca.product_id = cp.product_id
+    """)
+    rows['cards'] = cursor.fetchall()
+
+    # 6. Active guests
+    cursor.execute("""
+        SELECT g.name, g.card_ui_id as uid,
+               g.checkin_time as checkin, g.checkout_time as checkout,
+               p.product_id
+        FROM guest_registrations g
+        JOIN productstable p ON g.room_id = p.room_no
+        WHERE NOW() BETWEEN g.checkin_time AND g.checkout_time
+          AND g.checkout_time > NOW()
+    """)
+    rows['guests'] = cursor.fetchall()
+
+    return rows
+
+
+def _format_time(value):
+    if hasattr(value, 'strftime'):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+
+def compile_snapshot(rows):
+    """
+    Join the raw snapshot rows in memory.
+
+    Returns:
+        dict: {
+            'cards': top-level card list (special cards, then guest cards),
+            'products': {product_id: {'product_id', 'updated', 'cards', ['guests']}},
+            'regular_products': set of productstable IDs,
+            'vip_products': set of vip_rooms IDs
+        }
+    """
+    # Access matrix: package_type -> facilities it may enter
+    granted_facilities = {}
+    for row in rows['matrix']:
+        if row['has_access']:
+            granted_facilities.setdefault(row['package_type'], []).append(row['facility'])
+
+    facility_to_product = {}
+    updated_flags = {}
+    vip_products = set()
+    for row in rows['vip_rooms']:
+        facility_to_product[row['vip_rooms']] = row['product_id']
+        updated_flags[row['product_id']] = row['updated']
+        vip_products.add(row['product_id'])
+
+    regular_products = set()
+    for row in rows['products']:
+        updated_flags.setdefault(row['product_id'], row['updated'])
+        regular_products.add(row['product_id'])
+
+    first_package = {}
+    special_packages = []
+    seen_special = set()
+    for row in rows['packages']:
+        first_package.setdefault(row['uid'], row['package_type'])
+        key = (row['uid'], row['package_type'])
+        if row['package_type'] in SPECIAL_CARD_TYPES and key not in seen_special:
+            seen_special.add(key)
+            special_packages.append(key)
+
+    # Unique card details by UID and the set of UIDs seen per product
+    card_details = {}
+    product_cards = {}
+    active_uids = set()
+    active_pairs = set()
+    for row in rows['cards']:
+        uid = row['uid']
+        card_type = row['type']
+
+        if uid not in card_details:
+            card_details[uid] = {'uid': uid, 'type': card_type, 'active': row['active']}
+        else:
+            # Prefer a specific package type over General
+            if card_type != 'General' and card_details[uid]['type'] == 'General':
+                card_details[uid]['type'] = card_type
+            card_details[uid]['active'] = card_details[uid]['active'] or row['active']
+
+        product_cards.setdefault(row['product_id'], set()).add(uid)
+        if row['active']:
+            active_uids.add(uid)
+            active_pairs.add((uid, row['product_id']))
+
+    # VIP rooms accept Master/Service cards and any package the matrix grants
+    for product_id in vip_products:
+        product_cards.setdefault(product_id, set())
+    for uid, card in card_details.items():
+        if card['type'] in SPECIAL_CARD_TYPES:
+            for product_id in vip_products:
+                product_cards[product_id].add(uid)
+        else:
+            for facility in granted_facilities.get(card['type'], []):
+                if facility in facility_to_product:
+                    product_cards[facility_to_product[facility]].add(uid)
+
+    # Top-level cards: active Master and Service cards
+    cards = []
+    for uid, package_type in special_packages:
+        if uid in active_uids:
+            cards.append({
+                "uid": uid,
+                "type": package_type,
+                "access_rooms": ["all"],
+                "active": True
+            })
+
+    # Active guests whose card is active for their room
+    guests = []
+    for row in rows['guests']:
+        uid = row['uid']
+        if (uid, row['product_id']) not in active_pairs:
+            continue
+
+        package_type = first_package.get(uid, 'General') if uid in active_uids else 'General'
+        access_rooms = [row['product_id']]
+        for facility in granted_facilities.get(package_type, []):
+            if facility in facility_to_product:
+                access_rooms.append(facility_to_product[facility])
+
+        guests.append({
+            "name": row['name'],
+            "uid": uid,
+            "checkin": _format_time(row['checkin']),
+            "checkout": _format_time(row['checkout']),
+            "package_type": package_type,
+            "access_rooms": access_rooms
+        })
+
+    guests_by_product = {}
+    for guest in guests:
+        for product_id in guest['access_rooms']:
+            guests_by_product.setdefault(product_id, []).append(guest)
+
+    # Guest cards not already listed as special cards
+    existing_uids = {card['uid'] for card in cards}
+    for guest in guests:
+        if guest['uid'] not in existing_uids:
+            cards.append({
+                "uid": guest['uid'],
+                "type": guest['package_type'],
+                "active": True,
+                "access_rooms": guest['access_rooms']
+            })
+            existing_uids.add(guest['uid'])
+
+    products = {}
+    for product_id in regular_products | vip_products:
+        product_data = {
+            "product_id": product_id,
+            "updated": updated_flags.get(product_id, False),
+            "cards": [card_details[uid] for uid in sorted(product_cards.get(product_id, ()), key=str)]
+        }
+        if product_id in guests_by_product:
+            product_data['guests'] = guests_by_product[product_id]
+        products[product_id] = product_data
+
+    return {
+        'cards': cards,
+        'products': products,
+        'regular_products': regular_products,
+        'vip_products': vip_products
+    }
+
+
+def build_access_snapshot(cursor):
+    """Load and compile the full access-control snapshot"""
+    return compile_snapshot(load_snapshot_rows(cursor))
+
+
+def cards_for_product(snapshot, product_id):
+    """Top-level cards a single door needs: "all" cards plus guests with access to it"""
+    return [
+        card for card in snapshot['cards']
+        if card['access_rooms'] == ["all"] or product_id in card['access_rooms']
+    ]
+
+
+def _group_by_uid(items):
+    grouped = {}
+    for item in items:
+        grouped.setdefault(item['uid'], []).append(item)
+    return grouped
+
+
+def _diff_by_uid(old, new):
+    """
+    Changes between two uid-grouped lists.
+
+    'added' holds every current item of a uid that is new or changed, and
+    'removed' the uids that are gone. A device drops its items for every
+    uid in either list, then appends 'added'.
+    """
+    added = []
+    for uid, items in new.items():
+        if old.get(uid) != items:
+            added.extend(items)
+    removed = [uid for uid in old if uid not in new]
+    return {"added": added, "removed": removed}
+
+
+def _uid_events(old, new, kind, removed_event):
+    events = []
+    for uid, items in new.items():
+        previous = old.get(uid)
+        if previous == items:
+            continue
+        if previous is None:
+            event = kind + '_added'
+        elif (len(previous) == len(items) == 1
+              and {key: value for key, value in previous[0].items() if key != 'active'}
+              == {key: value for key, value in items[0].items() if key != 'active'}):
+            event = kind + ('_activated' if items[0].get('active') else '_deactivated')
+        else:
+            event = kind + '_updated'
+        events.append({"event": event, "uid": uid, kind: items if len(items) > 1 else items[0]})
+    for uid in old:
+        if uid not in new:
+            events.append({"event": removed_event, "uid": uid})
+    return events
+
+
+def change_events(old, new):
+    """
+    Compact change events between two uid-grouped versions of a product.
+
+    Product cards give card_added / card_activated / card_deactivated /
+    card_updated / card_revoked, guests give guest_added / guest_updated /
+    guest_expired and the top-level access cards give access_card_*
+    events. A uid with several items carries them all as a list.
+    """
+    return (_uid_events(old['product_cards'], new['product_cards'], 'card', 'card_revoked')
+            + _uid_events(old['guests'], new['guests'], 'guest', 'guest_expired')
+            + _uid_events(old['cards'], new['cards'], 'access_card', 'access_card_revoked'))
+
+
+def render_access_snapshot(snapshot, product_id=None, updated=None):
+    """
+    Shape a compiled snapshot into the device response document.
+
+    Args:
+        snapshot (dict): Result of build_access_snapshot().
+        product_id (str): Only include this product and the cards it needs.
+            All products and cards if None.
+        updated (bool): Override every product's updated flag.
+
+    Returns:
+        dict: {"cards": [...], "products": [...]} sorted by product_id.
+    """
+    if product_id is None:
+        product_ids = snapshot['products'].keys()
+        cards = list(snapshot['cards'])
+    else:
+        product_ids = [product_id] if product_id in snapshot['products'] else []
+        cards = cards_for_product(snapshot, product_id)
+
+    products = []
+    for pid in sorted(product_ids, key=str):
+        product_data = snapshot['products'][pid]
+        if updated is not None:
+            product_data = dict(product_data, updated=updated)
+        products.append(product_data)
+
+    return {
+        "cards": cards,
+        "products": products
+    }
+
+
+def _canonical(value):
+    """value with dict keys and list items in a fixed order, so equal documents serialise equally"""
+    if isinstance(value, dict):
+        return {key: _canonical(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [_canonical(item) for item in value]
+        return sorted(items, key=lambda item: json.dumps(item, sort_keys=True, default=str))
+    return value
+
+
+def content_version(product, cards):
+    """
+    Version of a product document: a 53-bit hash of its content.
+
+    Identical in every process that compiles the same data, and exact as a
+    JSON number in JavaScript clients.
+    """
+    text = json.dumps(_canonical({'product': product, 'cards': cards}), sort_keys=True, default=str)
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'big') >> 11
+
+
+class SnapshotCache:
+    """
+    Compiled per-product snapshots keyed by product_id.
+
+    Entries are served straight from memory until their product is marked
+    dirty or they are older than ttl seconds (guests expire at checkout
+    without any write). A dirty read recompiles once and refreshes every
+    entry; an entry's version only moves when its document changed, and is
+    the content_version() of the document.
+    """
+
+    def __init__(self, ttl, history=32):
+        self.ttl = ttl
+        self.history = history
+        self._entries = {}
+        self._history = {}      # product_id -> {version: uid-grouped lists}
+        self._dirty = set()
+        self._all_dirty = True
+        self._build_lock = threading.Lock()
+        self._dirty_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'rebuilds': 0}
+
+    def mark_dirty(self, *product_ids):
+        with self._dirty_lock:
+            self._dirty.update(product_ids)
+
+    def mark_all_dirty(self):
+        with self._dirty_lock:
+            self._all_dirty = True
+
+    def _is_current(self, product_id, entry):
+        return (entry is not None
+                and not self._all_dirty
+                and product_id not in self._dirty
+                and time.monotonic() - entry['built_at'] < self.ttl)
+
+    def _expired(self):
+        entry = next(iter(self._entries.values()), None)
+        return entry is None or time.monotonic() - entry['built_at'] >= self.ttl
+
+    def entries(self, load_rows):
+        """Every product's current entry, rebuilding first if anything is stale"""
+        with self._build_lock:
+            if self._all_dirty or self._dirty or self._expired():
+                self._stats['misses'] += 1
+                self._rebuild(load_rows)
+            return dict(self._entries)
+
+    def get(self, product_id, load_rows):
+        """
+        Return the cached entry for product_id, rebuilding if it is stale.
+
+        Args:
+            product_id (str): Product to look up.
+            load_rows (callable): Returns load_snapshot_rows() output; only
+                called on a rebuild.
+
+        Returns:
+            dict or None: {'product', 'cards', 'version', 'updated', 'built_at'},
+            or None if the product does not exist.
+        """
+        entry = self._entries.get(product_id)
+        if self._is_current(product_id, entry):
+            self._stats['hits'] += 1
+            return entry
+
+        with self._build_lock:
+            entry = self._entries.get(product_id)
+            if self._is_current(product_id, entry):
+                self._stats['hits'] += 1
+                return entry
+
+            self._stats['misses'] += 1
+            self._rebuild(load_rows)
+            return self._entries.get(product_id)
+
+    def _rebuild(self, load_rows):
+        # Take the dirty set first so marks that arrive mid-build are kept
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+            all_dirty, self._all_dirty = self._all_dirty, False
+
+        try:
+            snapshot = compile_snapshot(load_rows())
+        except Exception:
+            with self._dirty_lock:
+                self._dirty.update(dirty)
+                self._all_dirty = self._all_dirty or all_dirty
+            raise
+
+        built_at = time.monotonic()
+        entries = {}
+        for product_id, product_data in snapshot['products'].items():
+            product = {key: value for key, value in product_data.items() if key != 'updated'}
+            cards = cards_for_product(snapshot, product_id)
+            previous = self._entries.get(product_id)
+
+            if previous is not None and previous['product'] == product and previous['cards'] == cards:
+                version = previous['version']
+            else:
+                version = content_version(product, cards)
+                self._remember(product_id, version, product, cards)
+
+            entries[product_id] = {
+                'product': product,
+                'cards': cards,
+                'version': version,
+                'updated': bool(product_data['updated']),
+                'built_at': built_at
+            }
+
+        self._entries = entries
+        for product_id in list(self._history):
+            if product_id not in entries:
+                del self._history[product_id]
+        self._stats['rebuilds'] += 1
+
+    def _remember(self, product_id, version, product, cards):
+        versions = self._history.setdefault(product_id, {})
+        # Kept in insertion order; a document that returns to an earlier state becomes the newest again
+        versions.pop(version, None)
+        versions[version] = {
+            'cards': _group_by_uid(cards),
+            'product_cards': _group_by_uid(product['cards']),
+            'guests': _group_by_uid(product.get('guests', []))
+        }
+        while len(versions) > self.history:
+            del versions[next(iter(versions))]
+
+    def delta(self, entry, since_version):
+        """
+        Changes to an entry's document since an earlier version.
+
+        Args:
+            entry (dict): Current entry from get().
+            since_version (int): Version the device already holds.
+
+        Returns:
+            dict or None: Added/removed top-level cards, product cards and
+            guests, or None if since_version is no longer (or never was)
+            held here, in which case the device needs the full document.
+        """
+        old, new = self._versions(entry, since_version)
+        if old is None or new is None:
+            return None
+
+        return {
+            "product_id": entry['product']['product_id'],
+            "since_version": since_version,
+            "version": entry['version'],
+            "updated": entry['updated'],
+            "cards": _diff_by_uid(old['cards'], new['cards']),
+            "product_cards": _diff_by_uid(old['product_cards'], new['product_cards']),
+            "guests": _diff_by_uid(old['guests'], new['guests'])
+        }
+
+    def _versions(self, entry, since_version):
+        versions = self._history.get(entry['product']['product_id'], {})
+        return versions.get(since_version), versions.get(entry['version'])
+
+    def events(self, entry, since_version):
+        """
+        change_events() from since_version to the entry's version, or None if
+        since_version is no longer held.
+        """
+        old, new = self._versions(entry, since_version)
+        if old is None or new is None:
+            return None
+        return change_events(old, new)
+
+    def mark_served(self, product_id):
+        """The device has pulled this product; clear its updated flag"""
+        entry = self._entries.get(product_id)
+        if entry is not None:
+            entry['updated'] = False
+
+    @staticmethod
+    def render(entry, updated=None):
+        """Device response document for a cache entry"""
+        product = dict(entry['product'])
+        product['updated'] = entry['updated'] if updated is None else updated
+        return {
+            "cards": list(entry['cards']),
+            "products": [product]
+        }
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['entries'] = len(self._entries)
+        stats['dirty'] = len(self._dirty)
+        stats['all_dirty'] = self._all_dirty
+        return stats
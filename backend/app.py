@@ -1,19 +1,41 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, session, Blueprint
+from flask import Flask, render_template, request, redirect, url_for, jsonify, session, Blueprint, g, has_app_context, has_request_context, Response
 import psycopg2
+import psycopg2.pool
 from psycopg2.extras import RealDictCursor
 from functools import wraps
 from datetime import datetime, timedelta
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
 import uuid
+import base64
+import hmac
+import hashlib
 import re
 import time
 import json
 import os
 import threading
+import queue
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import select
+import signal
+import sys
+import atexit
+import logging
 import paho.mqtt.client as mqtt
-from flask_socketio import SocketIO 
 from dotenv import load_dotenv
+from access_snapshot import build_access_snapshot, render_access_snapshot, load_snapshot_rows, SnapshotCache
+from access_rollup import (
+    insert_access_requests, dashboard_totals, daily_counts, rollup_count, trend_histograms,
+    room_histograms, backfill_outcomes, access_outcome, set_card_active, update_card_active,
+    OUTCOME_OTHER, OUTCOME_GRANTED, OUTCOME_DENIED
+)
+from access_partitions import maintain as maintain_partitions, is_partitioned, list_partitions, archive_files
+from schema import migrate as migrate_schema, detect_schema, SchemaState
+from app_logging import configure as configure_logging, parse_levels, request_id_var, SAMPLED
+from metrics import Registry, RateMeter
+from query_profiler import RequestProfile, ProfileStore
 
 
 app = Flask(__name__)
@@ -28,501 +50,2106 @@ CORS(app,
 
 load_dotenv()
 
+# Logging settings (see app_logging.py)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")  # Per-logger overrides, e.g. "app.access=DEBUG,werkzeug=WARNING"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()  # "json" or "text"
+LOG_QUEUE_MAX = int(os.getenv("LOG_QUEUE_MAX", 10000))
+LOG_TAP_SAMPLE_RATE = float(os.getenv("LOG_TAP_SAMPLE_RATE", 0.01))  # Fraction of per-tap debug lines kept
+
+log_handler = configure_logging(LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_MAX, LOG_TAP_SAMPLE_RATE, parse_levels(LOG_LEVELS))
+atexit.register(log_handler.stop)
+
+log = logging.getLogger('app')
+db_log = logging.getLogger('app.db')
+mqtt_log = logging.getLogger('app.mqtt')
+access_log = logging.getLogger('app.access')
+auth_log = logging.getLogger('app.auth')
+
+
+@app.before_request
+def assign_request_id():
+    """Tag log records of this request with the caller's X-Request-ID or a new id"""
+    g.request_id = (request.headers.get('X-Request-ID') or uuid.uuid4().hex)[:64]
+    g.request_id_token = request_id_var.set(g.request_id)
+
+
+@app.after_request
+def add_request_id_header(response):
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+
+@app.teardown_request
+def clear_request_id(exception=None):
+    token = g.pop('request_id_token', None)
+    if token is not None:
+        request_id_var.reset(token)
+
+
+@app.route('/api/logging', methods=['GET'])
+def logging_stats():
+    """Log queue metrics (queued, dropped when full, sampled out, depth)"""
+    return jsonify(dict(log_handler.stats(), level=LOG_LEVEL, format=LOG_FORMAT))
+
+
+# Prometheus-style metrics (see metrics.py), served from GET /metrics
+metrics_registry = Registry()
+http_requests = metrics_registry.counter('tapntrack_http_requests_total', 'HTTP requests by endpoint, method and status')
+http_request_seconds = metrics_registry.histogram('tapntrack_http_request_duration_seconds', 'HTTP request latency by endpoint')
+http_in_flight = metrics_registry.gauge('tapntrack_http_requests_in_flight', 'HTTP requests being handled')
+http_db_queries = metrics_registry.histogram('tapntrack_http_request_db_queries', 'Database statements per HTTP request',
+                                             buckets=(0, 1, 2, 5, 10, 20, 50, 100))
+http_db_seconds = metrics_registry.histogram('tapntrack_http_request_db_seconds', 'Database time per HTTP request')
+db_query_seconds = metrics_registry.histogram('tapntrack_db_query_duration_seconds', 'Database statement latency by statement type')
+mqtt_connects = metrics_registry.counter('tapntrack_mqtt_connects_total', 'MQTT connection results by return code')
+mqtt_disconnects = metrics_registry.counter('tapntrack_mqtt_disconnects_total', 'MQTT disconnects by return code')
+access_taps = metrics_registry.counter('tapntrack_access_taps_total', 'Reader taps by transport and result')
+access_tap_rate = RateMeter(60)
+
+DB_QUERY_TYPES = {'select', 'insert', 'update', 'delete', 'with'}
+
+# Development SQL profiler (see query_profiler.py); records every statement per request
+SQL_PROFILE = os.getenv("SQL_PROFILE", "false").lower() == "true"
+SQL_PROFILE_REPEAT_THRESHOLD = int(os.getenv("SQL_PROFILE_REPEAT_THRESHOLD", 3))  # Same template this often = N+1 suspect
+SQL_PROFILE_HISTORY = int(os.getenv("SQL_PROFILE_HISTORY", 200))  # Request reports kept for /debug/profile
+
+query_profiles = ProfileStore(SQL_PROFILE_HISTORY)
+
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_started = time.perf_counter()
+    g.db_queries = 0
+    g.db_time = 0.0
+    if SQL_PROFILE:
+        g.query_profile = RequestProfile()
+    http_in_flight.inc()
+
+
+@app.after_request
+def record_response_status(response):
+    g.status_code = response.status_code
+    profile = g.get('query_profile')
+    if profile is not None:
+        suspects = profile.suspects(SQL_PROFILE_REPEAT_THRESHOLD)
+        response.headers['X-Query-Profile'] = (f"queries={profile.count}; ms={profile.total_time * 1000:.1f}; "
+                                               f"n_plus_one={len(suspects)}")
+        if suspects:
+            db_log.warning("Possible N+1 in %s %s: %s", request.method, request.path,
+                           ', '.join(f"{suspect['count']}x {suspect['sql'][:120]}" for suspect in suspects))
+    return response
+
+
+@app.teardown_request
+def record_request_metrics(exception=None):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return
+    http_in_flight.dec()
+    # The URL rule, not the path, so ids in URLs don't create a series each
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    status = 500 if exception is not None else g.get('status_code', 500)
+    http_requests.inc(endpoint=endpoint, method=request.method, status=status)
+    http_request_seconds.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+    http_db_queries.observe(g.db_queries, endpoint=endpoint)
+    http_db_seconds.observe(g.db_time, endpoint=endpoint)
+    profile = g.pop('query_profile', None)
+    if profile is not None and endpoint != '/debug/profile':
+        query_profiles.record(endpoint, request.method, status, profile.report(SQL_PROFILE_REPEAT_THRESHOLD))
+
+
+def record_db_query(cursor, query, params, elapsed):
+    """Statement latency by type, plus the current request's query count, time and profile"""
+    text = query.decode(errors='replace') if isinstance(query, bytes) else query if isinstance(query, str) else ''
+    words = text.split(None, 1)
+    query_type = words[0].lower() if words else 'other'
+    db_query_seconds.observe(elapsed, type=query_type if query_type in DB_QUERY_TYPES else 'other')
+    if has_request_context() and 'db_queries' in g:
+        g.db_queries += 1
+        g.db_time += elapsed
+        profile = g.get('query_profile')
+        if profile is not None:
+            profile.add(query, params, cursor.rowcount, elapsed)
+
+
+class TimedCursor(RealDictCursor):
+    """RealDictCursor that reports every statement to record_db_query()"""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_db_query(self, query, vars, time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_db_query(self, query, None, time.perf_counter() - started)
+
+
+@app.route('/debug/profile', methods=['GET', 'DELETE'])
+def debug_profile():
+    """
+    SQL profiles per route (avg/max queries, N+1 suspects) and the latest requests.
+
+    Only with SQL_PROFILE=true. ?route=/api/... narrows to one URL rule,
+    ?recent=N sets how many request reports are listed; DELETE clears.
+    """
+    if not SQL_PROFILE:
+        return jsonify({'error': 'SQL profiling is disabled (set SQL_PROFILE=true)'}), 404
+    if request.method == 'DELETE':
+        query_profiles.clear()
+        return jsonify({'message': 'Profiles cleared'})
+    return jsonify(dict(query_profiles.snapshot(request.args.get('route'), request.args.get('recent', 20, type=int)),
+                        repeat_threshold=SQL_PROFILE_REPEAT_THRESHOLD))
+
+
+# Connection pool settings
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))  # Seconds to wait for a free connection
+DB_POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", 30))  # Ping connections idle longer than this
+
+
+class DatabasePool:
+    """
+    Process-wide, thread-safe PostgreSQL connection pool.
+
+    Wraps psycopg2's ThreadedConnectionPool so that callers block (up to
+    DB_POOL_TIMEOUT) instead of failing when every connection is in use,
+    connections are health-checked on checkout, and usage metrics are kept.
+    """
+
+    def __init__(self, minconn, maxconn, timeout, ping_after, **connect_kwargs):
+        self.pid = os.getpid()
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, **connect_kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self._stats = {
+            'checkouts': 0,
+            'in_use': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+            'health_check_failures': 0
+        }
+
+    def getconn(self):
+        started = time.monotonic()
+        waited = False
+
+        if not self._slots.acquire(blocking=False):
+            waited = True
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self._stats['timeouts'] += 1
+                raise psycopg2.pool.PoolError(f"Timed out after {self.timeout}s waiting for a database connection")
+
+        try:
+            conn = self._checkout_healthy()
+        except Exception:
+            self._slots.release()
+            raise
+
+        wait_time = time.monotonic() - started
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+            if waited:
+                self._stats['waits'] += 1
+                self._stats['wait_time_total'] += wait_time
+                self._stats['wait_time_max'] = max(self._stats['wait_time_max'], wait_time)
+        return conn
+
+    def _checkout_healthy(self):
+        # Retry once per slot: a broken connection is discarded and replaced
+        for _ in range(self.maxconn + 1):
+            conn = self._pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            with self._lock:
+                self._stats['health_check_failures'] += 1
+                self._last_used.pop(id(conn), None)
+            self._pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError("Unable to obtain a healthy database connection")
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < self.ping_after:
+            return True
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except Exception as e:
+            db_log.warning("Discarding unhealthy database connection: %s", e)
+            return False
+
+    def putconn(self, conn):
+        close = bool(conn.closed)
+        if not close:
+            try:
+                conn.autocommit = False
+            except Exception:
+                close = True
+
+        with self._lock:
+            self._stats['in_use'] -= 1
+            if close:
+                self._last_used.pop(id(conn), None)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+
+        try:
+            # ThreadedConnectionPool rolls back any open transaction on return
+            self._pool.putconn(conn, close=close)
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['max_size'] = self.maxconn
+        stats['open'] = len(self._pool._used) + len(self._pool._pool)
+        stats['idle'] = len(self._pool._pool)
+        stats['wait_time_avg'] = stats['wait_time_total'] / stats['waits'] if stats['waits'] else 0.0
+        return stats
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+class PooledConnection:
+    """
+    Proxy around a pooled psycopg2 connection.
+
+    close() returns the connection to the pool instead of closing the socket.
+    Request-scoped connections ignore close() entirely; they are released once
+    by the app-context teardown so every helper in a request shares them.
+    commit() runs the callbacks registered with after_commit(); rollback()
+    discards them, and release() runs any left over, for transactions
+    committed with a COMMIT statement.
+    """
+
+    def __init__(self, pool, conn, request_scoped=False):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, 'request_scoped', request_scoped)
+        object.__setattr__(self, 'released', False)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def cursor(self, *args, **kwargs):
+        # Routes asking for RealDictCursor explicitly still get the instrumented one
+        if kwargs.get('cursor_factory') is RealDictCursor:
+            kwargs['cursor_factory'] = TimedCursor
+        return self._conn.cursor(*args, **kwargs)
+
+    def commit(self):
+        self._conn.commit()
+        run_after_commit(self._conn)
+
+    def rollback(self):
+        self._conn.rollback()
+        _after_commit.pop(id(self._conn), None)
+
+    def close(self):
+        if not self.request_scoped:
+            self.release()
+
+    def release(self):
+        if not self.released:
+            object.__setattr__(self, 'released', True)
+            run_after_commit(self._conn)
+            self._pool.putconn(self._conn)
+
+
+_after_commit = {}  # id(raw connection) -> callbacks waiting for its transaction to commit
+
+
+def after_commit(cursor, callback):
+    """
+    Call callback once the transaction of cursor's connection commits
+    (straight away in autocommit mode), for in-process caches that must
+    not be marked stale before other readers can see the change.
+    """
+    conn = cursor.connection
+    if conn.autocommit:
+        callback()
+    else:
+        _after_commit.setdefault(id(conn), []).append(callback)
+
+
+def run_after_commit(conn):
+    for callback in _after_commit.pop(id(conn), ()):
+        try:
+            callback()
+        except Exception as e:
+            db_log.error("Error in after-commit callback: %s", e)
+
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+
+def get_db_pool():
+    """Return the process-wide pool, creating it on first use (and after fork)"""
+    global _db_pool
+    if _db_pool is None or _db_pool.pid != os.getpid():
+        with _db_pool_lock:
+            if _db_pool is None or _db_pool.pid != os.getpid():
+                _db_pool = DatabasePool(
+                    DB_POOL_MIN,
+                    DB_POOL_MAX,
+                    DB_POOL_TIMEOUT,
+                    DB_POOL_PING_AFTER,
+                    **db_connect_params()
+                )
+    return _db_pool
+
+
+def close_db_pool():
+    """Close this process's pool (the gunicorn master does so before forking workers)"""
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is not None and _db_pool.pid == os.getpid():
+            _db_pool.closeall()
+        _db_pool = None
+
+
+def db_connect_params():
+    """psycopg2.connect() keyword arguments built from the environment"""
+    return {
+        'host': os.getenv("DB_HOST"),
+        'database': os.getenv("DB_NAME"),
+        'user': os.getenv("DB_USER"),
+        'password': os.getenv("DB_PASSWORD"),
+        'port': os.getenv("DB_PORT"),
+        'cursor_factory': TimedCursor
+    }
+
+
 # Database connection function
-def get_db_connection():
+def get_db_connection(standalone=False):
+    """
+    Get a pooled database connection.
+
+    Inside a Flask request the same connection is returned on every call and
+    released in teardown; outside a request (startup, MQTT thread) the caller
+    owns the connection and close() hands it back to the pool. Pass
+    standalone=True to get a private connection even inside a request.
+    """
     try:
-        conn = psycopg2.connect(
-            host=os.getenv("DB_HOST"),
-            database=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            port=os.getenv("DB_PORT"),
-            cursor_factory=RealDictCursor
-        )
-        return conn
+        if has_app_context() and not standalone:
+            conn = g.get('db_conn')
+            if conn is None:
+                pool = get_db_pool()
+                conn = PooledConnection(pool, pool.getconn(), request_scoped=True)
+                g.db_conn = conn
+            return conn
+
+        pool = get_db_pool()
+        return PooledConnection(pool, pool.getconn())
     except Exception as e:
-        print(f"Database connection error: {e}")
+        db_log.error("Database connection error: %s", e)
         return None
 
 
+@app.teardown_appcontext
+def release_db_connection(exception=None):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        try:
+            conn.release()
+        except Exception as e:
+            db_log.error("Error releasing database connection: %s", e)
+
+
+@app.route('/api/db_pool', methods=['GET'])
+def db_pool_stats():
+    """Connection pool metrics (in-use, idle, waits, wait time)"""
+    return jsonify(get_db_pool().stats())
+
+
 
 MQTT_BROKER = os.getenv("MQTT_BROKER")
 MQTT_PORT = int(os.getenv("MQTT_PORT", 1883))  # Default to 1883 if not set
 MQTT_TOPIC = os.getenv("MQTT_TOPIC")
+ACCESS_EVENT_TOPIC = "/RFID/access_control_events/{product_id}"
+ACCESS_RESYNC_TOPIC = "/RFID/access_control_resync/+"  # Devices publish here after a sequence gap
 
 
 mqtt_client = mqtt.Client(transport="websockets")  # Use WebSocket transport
 
+# Outbound publish queue settings
+MQTT_PUBLISH_QOS = int(os.getenv("MQTT_PUBLISH_QOS", 0))
+MQTT_QUEUE_MAX = int(os.getenv("MQTT_QUEUE_MAX", 5000))
+MQTT_QUEUE_POLICY = os.getenv("MQTT_QUEUE_POLICY", "drop_oldest").lower()  # or "drop_newest"
+MQTT_LOOP_INTERVAL_MS = int(os.getenv("MQTT_LOOP_INTERVAL_MS", 50))
+
+
+class MqttPublishQueue:
+    """
+    Bounded outbound buffer drained by the MQTT thread.
+
+    Callers never touch the network: publish() only queues the message and
+    serialisation happens when the MQTT thread sends it. Messages given a
+    key are merged, so a newer message replaces a pending one with the same
+    key in place (e.g. several full snapshots for one product go out once).
+    While the broker is unreachable messages stay buffered; when the buffer
+    is full MQTT_QUEUE_POLICY drops the oldest or the newest message and
+    calls its on_drop callback so the owner can recover (e.g. resync).
+    Messages are sent in queue order; QoS defaults to MQTT_PUBLISH_QOS.
+    """
+
+    def __init__(self, maxsize, policy, qos):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.qos = qos
+        self._messages = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._inflight = {}     # mid -> send time, for QoS > 0 acknowledgements
+        self._stats = {
+            'enqueued': 0,
+            'merged': 0,
+            'dropped': 0,
+            'published': 0,
+            'failed': 0,
+            'max_depth': 0,
+            'queue_wait_total': 0.0,
+            'queue_wait_max': 0.0,
+            'acked': 0,
+            'ack_latency_total': 0.0,
+            'ack_latency_max': 0.0
+        }
+
+    def publish(self, topic, payload, qos=None, retain=False, key=None, on_drop=None):
+        """
+        Queue a message for the MQTT thread.
+
+        Args:
+            topic (str): Topic to publish to.
+            payload: str/bytes, or a dict serialised to JSON when sent.
+            qos (int): Overrides MQTT_PUBLISH_QOS.
+            retain (bool): Publish as the topic's retained message.
+            key: Merge key; a pending message with the same key is replaced.
+            on_drop (callable): Called if the message is dropped unsent.
+        """
+        message = {
+            'topic': topic,
+            'payload': payload,
+            'qos': self.qos if qos is None else qos,
+            'retain': retain,
+            'on_drop': on_drop,
+            'enqueued_at': time.monotonic()
+        }
+        dropped = None
+
+        with self._lock:
+            if key is not None and key in self._messages:
+                # The newer copy goes to the back so it still follows anything queued after the old one
+                del self._messages[key]
+                self._messages[key] = message
+                self._stats['merged'] += 1
+                return True
+
+            if key is None:
+                self._seq += 1
+                key = ('seq', self._seq)
+
+            if len(self._messages) >= self.maxsize:
+                self._stats['dropped'] += 1
+                if self.policy == 'drop_newest':
+                    dropped = message
+                else:
+                    dropped = self._messages.popitem(last=False)[1]
+
+            if dropped is not message:
+                self._messages[key] = message
+                self._stats['enqueued'] += 1
+                self._stats['max_depth'] = max(self._stats['max_depth'], len(self._messages))
+
+        if dropped is not None and dropped['on_drop'] is not None:
+            try:
+                dropped['on_drop']()
+            except Exception as e:
+                mqtt_log.error("Error in MQTT drop callback for %s: %s", dropped['topic'], e)
+        return dropped is not message
+
+    def service(self, client, limit=500):
+        """Send up to limit queued messages; called from the MQTT thread while connected"""
+        for _ in range(limit):
+            with self._lock:
+                if not self._messages:
+                    return
+                key, message = self._messages.popitem(last=False)
+
+            payload = message['payload']
+            if not isinstance(payload, (str, bytes)):
+                payload = json.dumps(payload, default=str)
+
+            result = client.publish(message['topic'], payload, qos=message['qos'], retain=message['retain'])
+            if result.rc != mqtt.MQTT_ERR_SUCCESS:
+                # Connection dropped: put it back at the front unless a newer copy arrived
+                with self._lock:
+                    self._stats['failed'] += 1
+                    if key not in self._messages:
+                        self._messages[key] = message
+                        self._messages.move_to_end(key, last=False)
+                return
+
+            now = time.monotonic()
+            wait = now - message['enqueued_at']
+            with self._lock:
+                self._stats['published'] += 1
+                self._stats['queue_wait_total'] += wait
+                self._stats['queue_wait_max'] = max(self._stats['queue_wait_max'], wait)
+                if message['qos'] > 0:
+                    if len(self._inflight) >= self.maxsize:
+                        self._inflight.clear()  # Acks lost with a dropped session
+                    self._inflight[result.mid] = now
+
+    def on_publish(self, client, userdata, mid):
+        with self._lock:
+            sent_at = self._inflight.pop(mid, None)
+            if sent_at is not None:
+                latency = time.monotonic() - sent_at
+                self._stats['acked'] += 1
+                self._stats['ack_latency_total'] += latency
+                self._stats['ack_latency_max'] = max(self._stats['ack_latency_max'], latency)
+
+    def depth(self):
+        return len(self._messages)
+
+    def idle(self):
+        """Nothing queued and no QoS > 0 message waiting for its acknowledgement"""
+        with self._lock:
+            return not self._messages and not self._inflight
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['depth'] = len(self._messages)
+            stats['inflight'] = len(self._inflight)
+        stats['queue_wait_avg'] = stats['queue_wait_total'] / stats['published'] if stats['published'] else 0.0
+        stats['ack_latency_avg'] = stats['ack_latency_total'] / stats['acked'] if stats['acked'] else 0.0
+        stats['connected'] = mqtt_client.is_connected()
+        stats['policy'] = self.policy
+        stats['qos'] = self.qos
+        return stats
+
+
+mqtt_publish_queue = MqttPublishQueue(MQTT_QUEUE_MAX, MQTT_QUEUE_POLICY, MQTT_PUBLISH_QOS)
+mqtt_client.on_publish = mqtt_publish_queue.on_publish
+
+
+@app.route('/api/mqtt_queue', methods=['GET'])
+def mqtt_queue_stats():
+    """Outbound MQTT queue metrics (depth, merged, dropped, queue wait, ack latency)"""
+    return jsonify(mqtt_publish_queue.stats())
+
+
+# Inbound message router settings
+MQTT_ROUTER_WORKERS = int(os.getenv("MQTT_ROUTER_WORKERS", 4))
+MQTT_ROUTER_MAX_PENDING = int(os.getenv("MQTT_ROUTER_MAX_PENDING", 1000))
+MQTT_ACK_SUFFIX = "/ack"
+
+
+class MqttRouter:
+    """
+    Dispatches inbound MQTT messages to handlers by topic pattern.
+
+    Patterns use MQTT wildcards ('+' for one level, '#' for the rest) and
+    are subscribed on every (re)connect. The paho network thread only
+    matches the topic and hands the message to a worker pool, so a slow
+    handler never stalls the network loop. Each '+' / '#' level is passed
+    to the handler as an argument, followed by the decoded payload (JSON
+    when it parses, otherwise text).
+
+    A handler returns a dict (or None) that is sent back as the ACK with
+    "status": "ok" unless it sets its own; an exception sends
+    "status": "error". ACKs go to the
+    payload's "reply_to" topic if given, otherwise to the message topic
+    plus MQTT_ACK_SUFFIX, which no route subscribes to.
+    """
+
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self._routes = []
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._pid = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'received': 0, 'unmatched': 0, 'dropped': 0, 'handled': 0, 'errors': 0,
+                       'handler_time_total': 0.0, 'handler_time_max': 0.0}
+
+    @staticmethod
+    def _compile(pattern):
+        parts = []
+        for level in pattern.split('/'):
+            if level == '+':
+                parts.append('([^/]+)')
+            elif level == '#':
+                parts.append('(.*)')
+            else:
+                parts.append(re.escape(level))
+        return re.compile('^' + '/'.join(parts) + '$')
+
+    def route(self, pattern, handler, ack=True, qos=0):
+        """Register handler(*wildcard_levels, payload) for topics matching pattern"""
+        self._routes.append({'pattern': pattern, 'regex': self._compile(pattern),
+                             'handler': handler, 'ack': ack, 'qos': qos})
+
+    def subscribe(self, client):
+        for route in self._routes:
+            client.subscribe(route['pattern'], route['qos'])
+            mqtt_log.info("Subscribed to topic %s", route['pattern'])
+
+    def _get_executor(self):
+        # Created lazily so forked worker processes get their own pool
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="mqtt-handler")
+        return self._executor
+
+    def on_message(self, client, userdata, msg):
+        # Runs on the paho network thread: match and hand off only
+        with self._stats_lock:
+            self._stats['received'] += 1
+
+        for route in self._routes:
+            match = route['regex'].match(msg.topic)
+            if match:
+                break
+        else:
+            with self._stats_lock:
+                self._stats['unmatched'] += 1
+            return
+
+        if self._closed:
+            # Shutting down: handlers already running finish, new messages are not taken
+            with self._stats_lock:
+                self._stats['dropped'] += 1
+            return
+
+        if not self._pending.acquire(blocking=False):
+            with self._stats_lock:
+                self._stats['dropped'] += 1
+            mqtt_log.warning("MQTT handlers busy, dropped message on topic '%s'", msg.topic)
+            return
+
+        try:
+            self._get_executor().submit(self._handle, route, match.groups(), msg.topic, msg.payload)
+        except Exception:
+            self._pending.release()
+            raise
+
+    def _handle(self, route, params, topic, raw_payload):
+        started = time.monotonic()
+        payload = raw_payload.decode('utf-8', errors='replace')
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            pass
+
+        # Only dedicated ACK topics are accepted as reply_to
+        reply_to = payload.get('reply_to') if isinstance(payload, dict) else None
+        if not isinstance(reply_to, str) or not reply_to.endswith(MQTT_ACK_SUFFIX) or '+' in reply_to or '#' in reply_to:
+            reply_to = None
+        # Log records of this message share an id, like an HTTP request
+        request_id = request_id_var.set(uuid.uuid4().hex)
+        try:
+            # App context so handlers share one pooled connection, released on teardown
+            with app.app_context():
+                result = route['handler'](*params, payload)
+            ack = dict({'status': 'ok'}, **(result or {}))
+        except Exception as e:
+            with self._stats_lock:
+                self._stats['errors'] += 1
+            mqtt_log.error("Error handling MQTT message on topic '%s': %s", topic, e)
+            ack = {'status': 'error', 'error': str(e)}
+        finally:
+            request_id_var.reset(request_id)
+            self._pending.release()
+
+        ack_topic = reply_to or topic + MQTT_ACK_SUFFIX
+        # Never ACK onto a subscribed topic; that would deliver the ACK back to us
+        if route['ack'] and not any(other['regex'].match(ack_topic) for other in self._routes):
+            ack['topic'] = topic
+            mqtt_publish_queue.publish(ack_topic, ack)
+
+        elapsed = time.monotonic() - started
+        with self._stats_lock:
+            self._stats['handled'] += 1
+            self._stats['handler_time_total'] += elapsed
+            self._stats['handler_time_max'] = max(self._stats['handler_time_max'], elapsed)
+
+    def close(self):
+        """Stop taking messages and wait for the running handlers (shutdown)"""
+        self._closed = True
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=True)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['handler_time_avg'] = stats['handler_time_total'] / stats['handled'] if stats['handled'] else 0.0
+        stats['routes'] = [route['pattern'] for route in self._routes]
+        return stats
+
+
+mqtt_router = MqttRouter(MQTT_ROUTER_WORKERS, MQTT_ROUTER_MAX_PENDING)
+
+
+def handle_device_message(payload):
+    """Messages on the legacy MQTT_TOPIC are only acknowledged"""
+    mqtt_log.debug("MQTT device message on %s: %s", MQTT_TOPIC, payload, extra=SAMPLED)
+
+
+if MQTT_TOPIC:
+    mqtt_router.route(MQTT_TOPIC, handle_device_message)
+
+
+@app.route('/api/mqtt_router', methods=['GET'])
+def mqtt_router_stats():
+    """Inbound MQTT router metrics (received, unmatched, dropped, errors, handler time)"""
+    return jsonify(mqtt_router.stats())
+
+
 def on_connect(client, userdata, flags, rc):
+    mqtt_connects.inc(rc=rc)
     if rc == 0:
-        print(f"Connected to MQTT broker at {MQTT_BROKER}:{MQTT_PORT} with result code {rc}")
-        client.subscribe(MQTT_TOPIC)
-        print(f"Subscribed to topic {MQTT_TOPIC}")
+        mqtt_log.info("Connected to MQTT broker at %s:%s with result code %s", MQTT_BROKER, MQTT_PORT, rc)
+        mqtt_router.subscribe(client)
+        access_change_publisher.request_resync()
     else:
-        print(f"Failed to connect to MQTT broker. Return code: {rc}")
-
-def on_message(client, userdata, msg):
-    topic = msg.topic
-    payload = msg.payload.decode()
-    print(f"MQTT message received on topic {topic}: {payload}")
-    # Debugging: Log the received message
-    print(f"Debug: Received payload '{payload}' on topic '{topic}'")
-
-    # Avoid infinite loop by ignoring acknowledgment messages
-    if payload == "OK":
-        print(f"Ignoring acknowledgment message on topic '{topic}'")
-        return
-
-    # Send acknowledgment (ACK) back to the same topic
-    ack_message = "OK"
-    result = client.publish(topic, ack_message)
-    status = result[0]
-    if status == 0:
-        print(f"Sent acknowledgment '{ack_message}' to topic '{topic}'")
-    else:
-        print(f"Failed to send acknowledgment to topic '{topic}', status: {status}")
+        mqtt_log.error("Failed to connect to MQTT broker. Return code: %s", rc)
 
 mqtt_client.on_connect = on_connect
-mqtt_client.on_message = on_message
+mqtt_client.on_message = mqtt_router.on_message
 
 
 def on_disconnect(client, userdata, rc):
-    print(f"Disconnected from MQTT broker with result code {rc}")
+    mqtt_disconnects.inc(rc=rc)
+    mqtt_log.info("Disconnected from MQTT broker with result code %s", rc)
 
 mqtt_client.on_disconnect = on_disconnect
 
 
+mqtt_stop = threading.Event()  # Set by shutdown(): publish what is queued, disconnect and return
+
+
 def mqtt_thread():
-    while True:
+    access_change_publisher.ensure_started()
+    partition_maintainer.ensure_started()
+    session_janitor.ensure_started()
+    loop_timeout = MQTT_LOOP_INTERVAL_MS / 1000.0
+    while not mqtt_stop.is_set():
         try:
-            print(f"Attempting to connect to MQTT broker at {MQTT_BROKER}:{MQTT_PORT} using WebSocket...")
+            mqtt_log.info("Attempting to connect to MQTT broker at %s:%s using WebSocket...", MQTT_BROKER, MQTT_PORT)
             mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
-            mqtt_client.loop_forever()
+
+            # Network loop plus the outbound queue; queued messages wait here while disconnected
+            while True:
+                rc = mqtt_client.loop(timeout=loop_timeout)
+                if rc != mqtt.MQTT_ERR_SUCCESS:
+                    mqtt_log.info("MQTT network loop stopped with result code %s", rc)
+                    break
+                if mqtt_client.is_connected():
+                    mqtt_publish_queue.service(mqtt_client)
+                    if mqtt_stop.is_set() and mqtt_publish_queue.idle():
+                        mqtt_client.disconnect()
+                        mqtt_log.info("MQTT queue flushed, disconnected from broker")
+                        return
         except Exception as e:
-            print(f"Failed to connect to MQTT broker: {e}")
-            time.sleep(5)  # Retry after 5 seconds
+            mqtt_log.error("Failed to connect to MQTT broker: %s", e)
+        mqtt_stop.wait(5)  # Retry after 5 seconds
 
 
 
-def publish_access_control_data(product_id, data_json):
+def publish_access_control_data(product_id, data_json, retain=False, on_drop=None):
     """
-    Publish access control data JSON to MQTT topic for the given product_id.
+    Queue access control data JSON for the MQTT topic of the given product_id.
+
+    A newer document for the same product replaces one still waiting in the
+    outbound queue.
 
     Args:
         product_id (str): The product ID to publish under.
         data_json (dict): The JSON data (dict) to publish.
+        retain (bool): Keep as the topic's retained message for new subscribers.
+        on_drop (callable): Called if the queue drops the document unsent.
     """
-    try:
-        # Compose MQTT topic dynamically based on product_id
-        topic = f"/RFID/access_control_data/{product_id}"
+    # Compose MQTT topic dynamically based on product_id
+    topic = f"/RFID/access_control_data/{product_id}"
+    if not mqtt_publish_queue.publish(topic, data_json, retain=retain, key=('snapshot', product_id), on_drop=on_drop):
+        mqtt_log.warning("MQTT queue full, dropped access control data for topic '%s'", topic)
+
+
+
+
+
+
+DB_LISTEN = os.getenv("DB_LISTEN", "true").lower() == "true"
+
+
+class NotificationListener:
+    """
+    Dedicated LISTEN connection that dispatches PostgreSQL notifications.
+
+    Callbacks receive the notification payload, or None right after the
+    listener (re)connects, since notifications may have been missed.
+    """
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self._handlers = {}
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel, callback):
+        self._handlers.setdefault(channel, []).append(callback)
+
+    def ensure_started(self):
+        # Started lazily so forked worker processes get their own listener
+        if not self.enabled:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._listen, name="db-notification-listener")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _dispatch(self, channel, payload):
+        for callback in self._handlers.get(channel, []):
+            try:
+                callback(payload)
+            except Exception as e:
+                log.error("Error handling notification on %s: %s", channel, e)
+
+    def _listen(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**db_connect_params())
+                conn.autocommit = True
+                cursor = conn.cursor()
+                for channel in self._handlers:
+                    cursor.execute(f"LISTEN {channel}")
+                for channel in self._handlers:
+                    self._dispatch(channel, None)
+
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self._dispatch(notify.channel, notify.payload)
+            except Exception as e:
+                log.error("Database notification listener error: %s", e)
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                time.sleep(5)
+
+
+notification_listener = NotificationListener(DB_LISTEN)
 
-        # Convert dict to JSON string
-        payload = json.dumps(data_json)
 
-        # Publish message
-        result = mqtt_client.publish(topic, payload)
+PRODUCT_REGISTRY_TTL = float(os.getenv("PRODUCT_REGISTRY_TTL", 300))  # Safety net for out-of-band edits
+CACHE_RELOAD_BACKOFF = float(os.getenv("CACHE_RELOAD_BACKOFF", 5))  # Seconds to serve a stale copy after a failed reload
+PRODUCT_REGISTRY_CHANNEL = "product_registry"
 
-        status = result[0]
-        if status == 0:
-            print(f"Published access control data to topic '{topic}'")
+
+class ProductRegistry:
+    """
+    In-memory copy of productstable and vip_rooms.
+
+    Answers "does this product exist" and "which product is this VIP room"
+    without a database round trip. The copy is reloaded lazily after
+    invalidate() (called by the routes that edit either table), after a
+    PostgreSQL NOTIFY on PRODUCT_REGISTRY_CHANNEL from another process, or
+    once PRODUCT_REGISTRY_TTL seconds have passed. A failed reload keeps
+    serving the previous copy for CACHE_RELOAD_BACKOFF seconds before the
+    next attempt, so requests do not queue behind pool checkouts.
+    """
+
+    def __init__(self, ttl, retry_backoff=CACHE_RELOAD_BACKOFF):
+        self.ttl = ttl
+        self.retry_backoff = retry_backoff
+        self.version = 0
+        self._load_lock = threading.Lock()
+        self._generation_lock = threading.Lock()
+        self._generation = 0
+        self._loaded_generation = -1
+        self._loaded_at = 0.0
+        self._retry_at = 0.0
+        self._products = {}     # product_id -> room_no
+        self._rooms = {}        # room_no -> product_id
+        self._vip_rooms = {}    # product_id -> vip room name
+        self._vip_names = {}    # vip room name -> product_id
+
+    def _is_fresh(self):
+        return (self._loaded_generation == self._generation
+                and time.monotonic() - self._loaded_at < self.ttl)
+
+    def _is_backing_off(self):
+        return self._loaded_generation >= 0 and time.monotonic() < self._retry_at
+
+    def _ensure_loaded(self):
+        notification_listener.ensure_started()
+        if self._is_fresh() or self._is_backing_off():
+            return
+        with self._load_lock:
+            if self._is_fresh() or self._is_backing_off():
+                return
+            try:
+                self._load()
+            except Exception as e:
+                if self._loaded_generation < 0:
+                    raise
+                self._retry_at = time.monotonic() + self.retry_backoff
+                log.error("Product registry reload failed, serving previous copy for %ss: %s", self.retry_backoff, e)
+
+    def _load(self):
+        generation = self._generation
+
+        # Private connection so a reload never touches the route's transaction
+        conn = get_db_connection(standalone=True)
+        if not conn:
+            raise psycopg2.OperationalError("Unable to connect to database")
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT product_id, room_no FROM productstable")
+            products = {row['product_id']: row['room_no'] for row in cursor.fetchall()}
+
+            cursor.execute("SELECT product_id, vip_rooms FROM vip_rooms")
+            vip_rooms = {row['product_id']: row['vip_rooms'] for row in cursor.fetchall()}
+            cursor.close()
+        finally:
+            conn.close()
+
+        self._products = products
+        self._rooms = {room_no: product_id for product_id, room_no in products.items()}
+        self._vip_rooms = vip_rooms
+        self._vip_names = {name: product_id for product_id, name in vip_rooms.items()}
+        self._loaded_generation = generation
+        self._loaded_at = time.monotonic()
+        self.version += 1
+        log.info("Product registry loaded: %s products, %s VIP rooms", len(products), len(vip_rooms))
+
+    def invalidate(self, notify_conn=None):
+        """
+        Drop the cached copy. Call after the change is committed.
+
+        Args:
+            notify_conn: Optional connection used to NOTIFY other processes.
+        """
+        with self._generation_lock:
+            self._generation += 1
+
+        if notify_conn is not None:
+            try:
+                cursor = notify_conn.cursor()
+                cursor.execute(f"NOTIFY {PRODUCT_REGISTRY_CHANNEL}")
+                notify_conn.commit()
+                cursor.close()
+            except Exception as e:
+                log.error("Error sending product registry notification: %s", e)
+
+    def product_exists(self, product_id):
+        """True if product_id is in productstable or vip_rooms"""
+        self._ensure_loaded()
+        return product_id in self._products or product_id in self._vip_rooms
+
+    def vip_product_id(self, vip_room_name):
+        """product_id for a VIP room name, or None"""
+        self._ensure_loaded()
+        return self._vip_names.get(vip_room_name)
+
+    def product_for_room(self, room_no):
+        """product_id for a regular room number, or None"""
+        self._ensure_loaded()
+        return self._rooms.get(room_no)
+
+    def vip_product_ids(self):
+        """All VIP room product IDs"""
+        self._ensure_loaded()
+        return list(self._vip_rooms)
+
+
+product_registry = ProductRegistry(PRODUCT_REGISTRY_TTL)
+notification_listener.subscribe(PRODUCT_REGISTRY_CHANNEL, lambda payload: product_registry.invalidate())
+
+
+SNAPSHOT_CACHE_TTL = float(os.getenv("SNAPSHOT_CACHE_TTL", 60))  # Also bounds how long an expired guest lingers
+SNAPSHOT_HISTORY = int(os.getenv("SNAPSHOT_HISTORY", 32))  # Versions per product kept for ?since_version= deltas
+SNAPSHOT_CHANNEL = "access_snapshot"
+
+# Compiled per-product access-control documents served to polling devices
+snapshot_cache = SnapshotCache(SNAPSHOT_CACHE_TTL, SNAPSHOT_HISTORY)
+
+
+def _on_snapshot_notification(payload):
+    if not payload or payload == '*':
+        snapshot_cache.mark_all_dirty()
+    else:
+        snapshot_cache.mark_dirty(*payload.split(','))
+    access_change_publisher.wake()
+
+
+def _on_products_changed(payload):
+    snapshot_cache.mark_all_dirty()
+    access_change_publisher.wake()
+
+
+notification_listener.subscribe(SNAPSHOT_CHANNEL, _on_snapshot_notification)
+# Product and VIP room edits change which documents exist at all
+notification_listener.subscribe(PRODUCT_REGISTRY_CHANNEL, _on_products_changed)
+
+
+def mark_snapshots_dirty(cursor, product_ids=None):
+    """
+    Mark compiled access-control snapshots stale.
+
+    The local cache is marked once the caller's transaction commits (a
+    rebuild before that would read the old rows and clear the mark), and a
+    NOTIFY is queued in the transaction so every other process marks too.
+
+    Args:
+        cursor: Cursor in the transaction making the change.
+        product_ids (list): Affected products, or None if any product may be affected.
+    """
+    if product_ids is None:
+        payload = '*'
+    else:
+        product_ids = [str(product_id) for product_id in product_ids if product_id]
+        if not product_ids:
+            return
+        payload = ','.join(product_ids)
+        if len(payload) > 7000:  # NOTIFY payloads are capped at 8000 bytes
+            payload = '*'
+
+    cursor.execute("SELECT pg_notify(%s, %s)", (SNAPSHOT_CHANNEL, payload))
+
+    def mark():
+        if product_ids is None:
+            snapshot_cache.mark_all_dirty()
         else:
-            print(f"Failed to publish to topic '{topic}', status: {status}")
+            snapshot_cache.mark_dirty(*product_ids)
+        access_change_publisher.wake()
 
-    except Exception as e:
-        print(f"Error publishing access control data: {str(e)}")
+    after_commit(cursor, mark)
+
+
+def guest_snapshot_products(product_id):
+    """Products whose snapshot lists a guest of product_id: the room plus every VIP room"""
+    return [product_id] + product_registry.vip_product_ids()
+
+
+def load_access_snapshot_rows():
+    conn = get_db_connection()
+    if not conn:
+        raise psycopg2.OperationalError("Unable to connect to database")
+    try:
+        cursor = conn.cursor()
+        rows = load_snapshot_rows(cursor)
+        cursor.close()
+        return rows
+    finally:
+        conn.close()
+
+
+def get_product_snapshot(product_id, cursor=None):
+    """
+    Cached snapshot entry for product_id, or None if the product is unknown.
+
+    Args:
+        product_id (str): Product to look up.
+        cursor: Optional cursor to rebuild with (sees the caller's transaction).
+    """
+    notification_listener.ensure_started()
+    if cursor is not None:
+        return snapshot_cache.get(product_id, lambda: load_snapshot_rows(cursor))
+    return snapshot_cache.get(product_id, load_access_snapshot_rows)
+
+
+@app.route('/api/snapshot_cache', methods=['GET'])
+def snapshot_cache_stats():
+    """Access snapshot cache metrics (hits, misses, rebuilds, dirty products)"""
+    return jsonify(snapshot_cache.stats())
+
+
+# Change-event publishing settings
+ACCESS_EVENT_DEBOUNCE_MS = int(os.getenv("ACCESS_EVENT_DEBOUNCE_MS", 250))  # Coalesce bursts of writes
+ACCESS_SNAPSHOT_INTERVAL = float(os.getenv("ACCESS_SNAPSHOT_INTERVAL", 300))  # Retained full snapshots; 0 disables
+
+
+class AccessChangePublisher:
+    """
+    Publishes access-control changes to MQTT as compact per-product events.
+
+    Runs in the MQTT process. Whenever snapshots are marked dirty (locally
+    or via NOTIFY from another process) it rebuilds the snapshot cache once
+    and publishes, for every product whose version moved, the change events
+    since the version it last published:
+
+        /RFID/access_control_events/{product_id}
+        {"product_id", "seq", "epoch", "version", "events": [...]}
+
+    seq increases by one for every message on a product. Full documents go
+    to /RFID/access_control_data/{product_id} as retained messages (with the
+    seq they replace) every ACCESS_SNAPSHOT_INTERVAL seconds, when the
+    previous version is no longer in the cache history, and on request. A
+    device that sees a seq gap (or a new epoch) publishes to
+    /RFID/access_control_resync/{product_id} and adopts the next snapshot.
+    """
+
+    def __init__(self, debounce_ms, snapshot_interval):
+        self.debounce = debounce_ms / 1000.0
+        self.snapshot_interval = snapshot_interval
+        self.epoch = int(time.time())
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._resync = set()
+        self._resync_all = False
+        self._published = {}    # product_id -> version last published
+        self._seq = {}          # product_id -> last seq
+        self._last_snapshot = 0.0
+        self._thread = None
+        self._pid = None
+        self._stats = {'event_messages': 0, 'events': 0, 'snapshots': 0, 'resync_requests': 0, 'errors': 0}
+
+    def ensure_started(self):
+        # Only the process that runs the MQTT client publishes
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="access-change-publisher")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def request_resync(self, product_id=None):
+        """Publish a full snapshot for product_id (every product if None) on the next pass"""
+        with self._lock:
+            if product_id:
+                self._resync.add(product_id)
+            else:
+                self._resync_all = True
+            self._stats['resync_requests'] += 1
+        self.wake()
+
+    def _run(self):
+        while True:
+            # Wake on changes, and at least every TTL so expired guests are noticed
+            timeout = SNAPSHOT_CACHE_TTL
+            if self.snapshot_interval > 0:
+                timeout = min(timeout, max(0.0, self._last_snapshot + self.snapshot_interval - time.monotonic()))
+            if self._wake.wait(timeout):
+                time.sleep(self.debounce)
+            self._wake.clear()
+
+            try:
+                self.publish_changes()
+            except Exception as e:
+                self._stats['errors'] += 1
+                log.error("Error publishing access control changes: %s", e)
+                time.sleep(1)
+
+    def _next_seq(self, product_id):
+        self._seq[product_id] = self._seq.get(product_id, 0) + 1
+        return self._seq[product_id]
+
+    def _publish_snapshot(self, product_id, entry):
+        document = SnapshotCache.render(entry)
+        document.update(version=entry['version'], seq=self._next_seq(product_id), epoch=self.epoch)
+        publish_access_control_data(product_id, document, retain=True,
+                                    on_drop=lambda: self.request_resync(product_id))
+        self._stats['snapshots'] += 1
+
+    def _publish_events(self, product_id, entry, events):
+        message = {
+            "product_id": product_id,
+            "seq": self._next_seq(product_id),
+            "epoch": self.epoch,
+            "version": entry['version'],
+            "events": events
+        }
+        # Never merged: a dropped message leaves a seq gap, so follow it with a snapshot
+        mqtt_publish_queue.publish(ACCESS_EVENT_TOPIC.format(product_id=product_id), message,
+                                   on_drop=lambda: self.request_resync(product_id))
+        self._stats['event_messages'] += 1
+        self._stats['events'] += len(events)
+
+    def publish_changes(self):
+        notification_listener.ensure_started()
+        entries = snapshot_cache.entries(load_access_snapshot_rows)
+
+        with self._lock:
+            resync, self._resync = self._resync, set()
+            resync_all, self._resync_all = self._resync_all, False
+
+        snapshot_due = self.snapshot_interval > 0 and time.monotonic() - self._last_snapshot >= self.snapshot_interval
+        if snapshot_due:
+            self._last_snapshot = time.monotonic()
+
+        for product_id, entry in entries.items():
+            last_version = self._published.get(product_id)
+            self._published[product_id] = entry['version']
+
+            if last_version is None or snapshot_due or resync_all or product_id in resync:
+                self._publish_snapshot(product_id, entry)
+            elif entry['version'] != last_version:
+                events = snapshot_cache.events(entry, last_version)
+                if events is None:
+                    self._publish_snapshot(product_id, entry)
+                elif events:
+                    self._publish_events(product_id, entry, events)
 
+        for product_id in list(self._published):
+            if product_id not in entries:
+                del self._published[product_id]
+                self._seq.pop(product_id, None)
 
+    def stats(self):
+        stats = dict(self._stats)
+        stats['products'] = len(self._published)
+        stats['epoch'] = self.epoch
+        return stats
 
 
+access_change_publisher = AccessChangePublisher(ACCESS_EVENT_DEBOUNCE_MS, ACCESS_SNAPSHOT_INTERVAL)
+mqtt_router.route(ACCESS_RESYNC_TOPIC, lambda product_id, payload: access_change_publisher.request_resync(product_id), ack=False)
 
 
-def mark_product_updated(product_id):
+@app.route('/api/access_events', methods=['GET'])
+def access_events_stats():
+    """Change-event publisher metrics (messages, events, snapshots, resyncs)"""
+    return jsonify(access_change_publisher.stats())
+
+
+def _mark_updated(description, mark):
+    """
+    Run mark(cursor) in the caller's transaction without risking it.
+
+    Inside a request the statements share the route's transaction, so they
+    run behind a savepoint: a failure is rolled back to it and the route
+    carries on (its commit covers the flags). Routes in autocommit mode need
+    neither; outside a request the statements commit on their own.
+    """
+    conn = None
+    savepoint = False
     try:
         conn = get_db_connection()
+        savepoint = conn.request_scoped and not conn.autocommit
         cursor = conn.cursor()
+        if savepoint:
+            cursor.execute("SAVEPOINT mark_updated")
+        mark(cursor)
+        if savepoint:
+            cursor.execute("RELEASE SAVEPOINT mark_updated")
+        elif not conn.request_scoped:
+            conn.commit()
+        cursor.close()
+        conn.close()
+    except Exception as e:
+        access_log.error("Error marking %s updated: %s", description, e)
+        if conn is not None:
+            try:
+                if savepoint:
+                    conn.cursor().execute("ROLLBACK TO SAVEPOINT mark_updated")
+                elif not conn.request_scoped:
+                    conn.rollback()
+                conn.close()
+            except Exception as rollback_error:
+                access_log.error("Error rolling back after marking %s updated: %s", description, rollback_error)
+
+
+def mark_product_updated(product_id, snapshot_changed=True):
+    def mark(cursor):
         cursor.execute("""
             UPDATE productstable
             SET updated = TRUE
             WHERE product_id = %s
         """, (product_id,))
-        conn.commit()
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        print(f"Error marking product {product_id} updated: {str(e)}")
+        if snapshot_changed:
+            mark_snapshots_dirty(cursor, [product_id])
+
+    _mark_updated(f"product {product_id}", mark)
 
 def mark_products_updated_for_uid(uid):
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    def mark(cursor):
         cursor.execute("""
-            SELECT DISTINCT product_id
-            FROM access_requests
-            WHERE uid = %s
+            SELECT product_id
+            FROM card_assignments
+            WHERE uid = %s AND product_id <> ''
         """, (uid,))
-        products = cursor.fetchall()
-        for p in products:
+        product_ids = [p['product_id'] for p in cursor.fetchall()]
+        if product_ids:
             cursor.execute("""
                 UPDATE productstable
                 SET updated = TRUE
-                WHERE product_id = %s
-            """, (p['product_id'],))
-        conn.commit()
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        print(f"Error marking products updated for UID {uid}: {str(e)}")
+                WHERE product_id = ANY(%s)
+            """, (product_ids,))
+        mark_snapshots_dirty(cursor, product_ids)
+
+    _mark_updated(f"products for UID {uid}", mark)
+
+
+
+
+
+# Access ingestion settings
+ACCESS_INGEST_MODE = os.getenv("ACCESS_INGEST_MODE", "batched")  # "batched" or "sync"
+ACCESS_QUEUE_MAX = int(os.getenv("ACCESS_QUEUE_MAX", 10000))
+ACCESS_FLUSH_ROWS = int(os.getenv("ACCESS_FLUSH_ROWS", 500))
+ACCESS_FLUSH_INTERVAL_MS = int(os.getenv("ACCESS_FLUSH_INTERVAL_MS", 200))
+ACCESS_FLUSH_RETRIES = int(os.getenv("ACCESS_FLUSH_RETRIES", 5))
+
+
+# Column order of queued tap tuples
+ACCESS_EVENT_COLUMNS = ('uid', 'timestamp', 'product_id', 'access_status', 'outcome')
+
+
+class AccessIngestQueue:
+    """
+    Bounded in-memory buffer for reader taps.
+
+    A background writer drains the queue every ACCESS_FLUSH_INTERVAL_MS or
+    ACCESS_FLUSH_ROWS taps, whichever comes first, and writes the whole batch
+    with one multi-row INSERT plus one coalesced `updated` flag UPDATE.
+    Connection errors retry the batch; a batch rejected for its data is
+    split in halves until only the offending rows fail, and those are
+    dropped and counted as invalid.
+    """
+
+    def __init__(self, maxsize, batch_size, flush_interval_ms, max_retries):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'accepted': 0,
+            'rejected': 0,
+            'flushed': 0,
+            'batches': 0,
+            'failed_batches': 0,
+            'dropped': 0,
+            'invalid': 0,
+            'last_batch_size': 0,
+            'last_flush_ms': 0.0
+        }
 
+    def ensure_started(self):
+        # Started lazily so forked worker processes get their own writer
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._stop.clear()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="access-ingest-writer")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def submit(self, event):
+        """Queue an (uid, timestamp, product_id, access_status, outcome) tuple. Returns False when full."""
+        self.ensure_started()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._stats_lock:
+                self._stats['rejected'] += 1
+            return False
+        with self._stats_lock:
+            self._stats['accepted'] += 1
+        return True
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            batch = self._next_batch()
+            if batch:
+                self._flush_with_retry(batch)
+
+    def _flush_with_retry(self, batch):
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                self.flush(batch)
+                return
+            except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+                # One bad row fails the whole statement and would fail every retry: bisect to find it
+                with self._stats_lock:
+                    self._stats['failed_batches'] += 1
+                if len(batch) == 1:
+                    with self._stats_lock:
+                        self._stats['invalid'] += 1
+                    access_log.warning("Dropped invalid access request %s: %s", batch[0], e)
+                    return
+                access_log.warning("Batch of %s access requests rejected, splitting it: %s", len(batch), e)
+                middle = len(batch) // 2
+                self._flush_with_retry(batch[:middle])
+                self._flush_with_retry(batch[middle:])
+                return
+            except Exception as e:
+                with self._stats_lock:
+                    self._stats['failed_batches'] += 1
+                access_log.error("Error flushing %s access requests (attempt %s): %s", len(batch), attempt, e)
+                if self._stop.is_set():
+                    break
+                time.sleep(min(0.5 * attempt, 5))
+
+        with self._stats_lock:
+            self._stats['dropped'] += len(batch)
+        access_log.error("Dropped %s access requests after %s failed flushes", len(batch), self.max_retries)
+
+    def flush(self, batch):
+        started = time.monotonic()
+        conn = get_db_connection()
+        if not conn:
+            raise psycopg2.OperationalError("Unable to connect to database")
+
+        try:
+            cursor = conn.cursor()
+            # One statement for the raw rows and their rollup counts
+            new_pair_products = insert_access_requests(cursor, ACCESS_EVENT_COLUMNS, batch)
+
+            # One flag write per distinct product instead of one per tap
+            product_ids = sorted({event[2] for event in batch if event[2]})
+            if product_ids:
+                cursor.execute("""
+                    UPDATE productstable
+                    SET updated = TRUE
+                    WHERE product_id = ANY(%s)
+                """, (product_ids,))
+            # Snapshots only change when a tap registers a new card pair
+            new_pair_products = sorted(product_id for product_id in set(new_pair_products) if product_id)
+            if new_pair_products:
+                mark_snapshots_dirty(cursor, new_pair_products)
+
+            conn.commit()
+            cursor.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        with self._stats_lock:
+            self._stats['flushed'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['last_batch_size'] = len(batch)
+            self._stats['last_flush_ms'] = round((time.monotonic() - started) * 1000, 2)
+
+    def drain(self, timeout=10):
+        """Stop accepting work and wait for the writer to flush what is queued"""
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['mode'] = ACCESS_INGEST_MODE
+        stats['queue_depth'] = self._queue.qsize()
+        stats['queue_max'] = self._queue.maxsize
+        return stats
+
+
+access_ingest_queue = AccessIngestQueue(
+    ACCESS_QUEUE_MAX,
+    ACCESS_FLUSH_ROWS,
+    ACCESS_FLUSH_INTERVAL_MS,
+    ACCESS_FLUSH_RETRIES
+)
+atexit.register(access_ingest_queue.drain)
+
+
+def ingest_access_event(uid, timestamp, access_status, product_id):
+    """
+    Validate and persist a single reader tap.
+
+    Unknown product IDs are stored as NULL. In batched mode the tap is queued
+    for the background writer; in sync mode it is inserted and committed here.
+
+    Returns:
+        tuple: (accepted, product_found). accepted is False when the ingest
+        queue is full and the caller should back off.
+    """
+    # Check if the product_id exists in EITHER productstable OR vip_rooms
+    product_exists = bool(product_id) and product_registry.product_exists(product_id)
+
+    # If product doesn't exist, set it to NULL for the insert
+    if not product_exists and product_id:
+        access_log.debug("Product %s does not exist in products or VIP rooms tables. Setting to NULL.", product_id, extra=SAMPLED)
+        product_id = None
+
+    # Normalized once here so analytics never classify the status text again
+    event = (uid, timestamp, product_id, access_status, access_outcome(access_status))
+
+    if ACCESS_INGEST_MODE == 'batched':
+        return access_ingest_queue.submit(event), product_exists
+
+    conn = get_db_connection()
+    if not conn:
+        raise psycopg2.OperationalError("Unable to connect to database")
+
+    cursor = conn.cursor()
+
+    new_pair_products = insert_access_requests(cursor, ACCESS_EVENT_COLUMNS, [event])
+
+    # Flag the product in the same transaction as the insert
+    if product_id:
+        mark_product_updated(product_id, snapshot_changed=product_id in new_pair_products)
+
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+    return True, product_exists
+
+
+ACCESS_REQUIRED_FIELDS = ('uid', 'time', 'access')
+ACCESS_EVENT_TOPIC_IN = "/RFID/access/+"  # Taps over MQTT, last level is the product_id
+
+
+def missing_access_field(data):
+    """First required tap field missing from data, or None"""
+    if not isinstance(data, dict):
+        return ACCESS_REQUIRED_FIELDS[0]
+    for field in ACCESS_REQUIRED_FIELDS:
+        if field not in data:
+            return field
+    return None
 
 
+def count_tap(transport, result):
+    """result is accepted, rejected (queue full), invalid or error"""
+    access_taps.inc(transport=transport, result=result)
+    if result == 'accepted':
+        access_tap_rate.mark()
 
 
-def fetch_access_control_data_for_product(product_id, cursor=None):
+def handle_mqtt_access_event(product_id, payload):
     """
-    Fetch access control data for a specific product_id.
-    
-    Args:
-        product_id (str): Product ID to fetch data for
-        cursor: Optional database cursor. If None, a new connection is created.
-        
-    Returns:
-        dict: Access control data for the product
+    MQTT /RFID/access/{product_id}: a reader tap, same pipeline as POST /access.
+
+    The ACK carries product_found like the HTTP response; a full ingest
+    queue is reported as an error ACK with retry set so the reader backs off.
     """
-    close_conn = False
-    conn = None
-    
-    try:
-        if cursor is None:
-            conn = get_db_connection()
-            if not conn:
-                return {'error': 'Unable to connect to database'}
-            cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            close_conn = True
-        
-        # Initialize the response structure
-        response_data = {
-            "cards": [],
-            "products": []
-        }
-        
-        # 1. Fetch master cards and service cards
-        cursor.execute("""
-            SELECT cp.uid, cp.package_type as type, 
-                CASE WHEN cp.package_type IN ('Master Card', 'Service Card') THEN '["all"]'::json
-                    ELSE NULL
-                    END as access_rooms
-                FROM card_packages cp
-                WHERE cp.package_type IN ('Master Card', 'Service Card')
-                GROUP BY cp.uid, cp.package_type
-        """)
-        
-        special_cards = cursor.fetchall()
-        
-        # Process special cards
-        for card in special_cards:
-            card_data = dict(card)
-            
-            # Make sure access_rooms is properly processed
-            if isinstance(card_data['access_rooms'], str):
-                import json
-                card_data['access_rooms'] = json.loads(card_data['access_rooms'])
-            elif card_data['access_rooms'] is None:
-                card_data['access_rooms'] = ["all"]  # Both Service and Master cards get all access
-            
-            card_data['active'] = True
-            response_data['cards'].append(card_data)
+    if not isinstance(payload, dict):
+        count_tap('mqtt', 'invalid')
+        raise ValueError("Access event must be a JSON object")
 
-        # 2. First get the access matrix
-        cursor.execute("""
-            SELECT package_type, facility, has_access 
-            FROM access_matrix
-        """)
-        
-        package_access = {}
-        for row in cursor.fetchall():
-            pkg_type = row['package_type']
-            facility = row['facility']
-            has_access = row['has_access']
-            
-            if pkg_type not in package_access:
-                package_access[pkg_type] = {}
-                
-            package_access[pkg_type][facility] = has_access
-        
-        # 3. Get VIP room mappings
-        cursor.execute("""
-            SELECT product_id, vip_rooms 
-            FROM vip_rooms
-        """)
-        
-        vip_product_to_facility = {}
-        facility_to_product = {}
-        
-        for row in cursor.fetchall():
-            vip_product_to_facility[row['product_id']] = row['vip_rooms']
-            facility_to_product[row['vip_rooms']] = row['product_id']
-            
-        # 4. Get all active guests - using NOW() BETWEEN ensures only current guests are included
-        # Modified to ensure we only get guests with future checkout times
-        cursor.execute("""
-            SELECT g.id, g.name, g.card_ui_id as uid, g.room_id,
-                   g.checkin_time as checkin, g.checkout_time as checkout,
-                   p.product_id
-            FROM guest_registrations g
-            JOIN productstable p ON g.room_id = p.room_no
-            WHERE NOW() BETWEEN g.checkin_time AND g.checkout_time 
-            AND g.checkout_time > NOW()
-        """)
+    field = missing_access_field(payload)
+    if field:
+        count_tap('mqtt', 'invalid')
+        raise ValueError(f"Missing required field: {field}")
 
-        all_guests = cursor.fetchall()
-        
-        # 5. Get package type for each guest's card and simplify guest objects
-        guests_with_packages = []
-        for guest in all_guests:
-            guest_dict = dict(guest)
-            card_uid = guest_dict['uid']
-            
-            # Get package type for this card
-            cursor.execute("""
-                SELECT package_type
-                FROM card_packages
-                WHERE uid = %s
-                LIMIT 1
-            """, (card_uid,))
-            
-            package_result = cursor.fetchone()
-            if package_result:
-                guest_dict['package_type'] = package_result['package_type']
-            else:
-                guest_dict['package_type'] = 'General'  # Default if no package assigned
-                
-            # Calculate access rooms for this guest
-            access_rooms = [guest_dict['product_id']]  # Always has access to assigned room
-            
-            # Check which VIP facilities this package has access to
-            if guest_dict['package_type'] in package_access:
-                for facility, has_access in package_access[guest_dict['package_type']].items():
-                    if has_access and facility in facility_to_product:
-                        vip_product_id = facility_to_product[facility]
-                        access_rooms.append(vip_product_id)
-            
-            guest_dict['access_rooms'] = access_rooms
+    try:
+        accepted, product_exists = ingest_access_event(payload['uid'], payload['time'], payload['access'], product_id)
+    except Exception:
+        count_tap('mqtt', 'error')
+        raise
+    if not accepted:
+        count_tap('mqtt', 'rejected')
+        return {"status": "error", "message": "Access request queue is full, retry later", "retry": True}
 
-            # Convert datetime objects to human-readable strings without the 'T'
-            if isinstance(guest_dict['checkin'], datetime):
-               guest_dict['checkin'] = guest_dict['checkin'].strftime('%Y-%m-%d %H:%M:%S')
+    count_tap('mqtt', 'accepted')
+    return {"uid": payload['uid'], "product_found": product_exists}
 
-            if isinstance(guest_dict['checkout'], datetime):
-               guest_dict['checkout'] = guest_dict['checkout'].strftime('%Y-%m-%d %H:%M:%S')
-            
-            # Create simplified guest object with only necessary fields
-            simplified_guest = {
-                "name": guest_dict['name'],
-                "uid": guest_dict['uid'],
-                "checkin": guest_dict['checkin'],
-                "checkout": guest_dict['checkout'],
-                "package_type": guest_dict['package_type'],
-                "access_rooms": guest_dict['access_rooms']
-            }
-            
-            guests_with_packages.append(simplified_guest)
-        
-        # Create mappings for guests by their access products
-        guests_by_product = {}
-        for guest in guests_with_packages:
-            for product_id_item in guest['access_rooms']:
-                if product_id_item not in guests_by_product:
-                    guests_by_product[product_id_item] = []
-                guests_by_product[product_id_item].append(guest)
-        
-        # Check if it's a regular product
-        cursor.execute("""
-            SELECT product_id, room_no
-            FROM productstable
-            WHERE product_id = %s
-        """, (product_id,))
-        
-        regular_product = cursor.fetchone()
-        
-        if regular_product:
-            product_data = {
-                "product_id": regular_product['product_id'],
-                "updated": True,  # We're generating this for an update
-                "cards": []
-            }
-            
-            # Get cards
-            cursor.execute(""" 
-                SELECT ar.uid, 
-                    COALESCE(
-                        (SELECT package_type FROM card_packages WHERE uid = ar.uid AND package_type IN ('Master Card', 'Service Card') LIMIT 1),
-                        (SELECT package_type FROM card_packages WHERE uid = ar.uid AND product_id = %s LIMIT 1),
-                        'General'
-                    ) as type,
-                    TRUE as active
-                FROM access_requests ar
-                WHERE ar.product_id = %s
-                GROUP BY ar.uid
-            """, (product_id, product_id))
-
-            for card in cursor.fetchall():
-                product_data['cards'].append(dict(card))
-            
-            # Add guests if applicable
-            if product_id in guests_by_product:
-                product_data['guests'] = guests_by_product[product_id]
-            
-            response_data['products'].append(product_data)
-        
-        # Check if it's a VIP room
-        cursor.execute("""
-            SELECT product_id, vip_rooms
-            FROM vip_rooms
-            WHERE product_id = %s
-        """, (product_id,))
-        
-        vip_room = cursor.fetchone()
-        
-        if vip_room:
-            product_data = {
-                "product_id": vip_room['product_id'],
-                "updated": True,  # We're generating this for an update
-                "cards": []
-            }
-            
-            # Get cards
-            cursor.execute("""
-                SELECT ar.uid, 
-                       COALESCE(cp.package_type, 'General') as type,
-                       TRUE as active
-                FROM access_requests ar
-                LEFT JOIN card_packages cp ON ar.uid = cp.uid AND ar.product_id = cp.product_id
-                WHERE ar.product_id = %s
-                GROUP BY ar.uid, cp.package_type
-            """, (product_id,))
-            
-            for card in cursor.fetchall():
-                product_data['cards'].append(dict(card))
-            
-            # Add guests if any has access to this VIP room
-            if product_id in guests_by_product:
-                product_data['guests'] = guests_by_product[product_id]
-            
-            response_data['products'].append(product_data)
-        
-        if close_conn and conn:
-            cursor.close()
-            conn.close()
-        
-        return response_data
-        
-    except Exception as e:
-        print(f"Error fetching access control data for product {product_id}: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        
-        if close_conn and conn:
-            cursor.close()
-            conn.close()
-            
-        return {"error": str(e)}
+
+mqtt_router.route(ACCESS_EVENT_TOPIC_IN, handle_mqtt_access_event, qos=1)
 
 
 @app.route("/access", methods=["POST"])
 def handle_access():
-    print("----- RECEIVED ACCESS REQUEST -----")
-    
-    # Print raw request data
-    print("Raw Request:", request)
-    
-    data = request.get_json()
-    print("Parsed JSON Data:", data)
+    data = request.get_json(silent=True)
     
     # Validate required fields
-    required_fields = ['uid', 'time', 'access']
-    
-    for field in required_fields:
-        if field not in data:
-            error_msg = f"Missing required field: {field}"
-            print(f"VALIDATION ERROR: {error_msg}")
-            return jsonify({
-                "message": error_msg,
-                "status": "error"
-            }), 400
+    field = missing_access_field(data)
+    if field:
+        error_msg = f"Missing required field: {field}" if isinstance(data, dict) else "Request body must be a JSON object"
+        access_log.warning("Rejected access request: %s", error_msg)
+        count_tap('http', 'invalid')
+        return jsonify({
+            "message": error_msg,
+            "status": "error"
+        }), 400
     
     # Get product_id or set to NULL if not found
     product_id = data.get('product_id')
     
-    print(f"Access attempt - UID: {data['uid']}, Product: {product_id or 'Unknown'}, Status: {data['access']}")
+    # Per-tap line, sampled (LOG_TAP_SAMPLE_RATE) so DEBUG stays affordable under load
+    access_log.debug("Access attempt - UID: %s, Product: %s, Status: %s",
+                     data['uid'], product_id or 'Unknown', data['access'], extra=SAMPLED)
     
     try:
-        # Store in database
-        print("Connecting to database...")
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Check if the product_id exists in EITHER productstable OR vip_rooms
-        product_exists = False
-        if product_id:
-            # Check productstable
-            cursor.execute("SELECT 1 FROM productstable WHERE product_id = %s", (product_id,))
-            if cursor.fetchone() is not None:
-                product_exists = True
-            else:
-                # Check vip_rooms
-                cursor.execute("SELECT 1 FROM vip_rooms WHERE product_id = %s", (product_id,))
-                if cursor.fetchone() is not None:
-                    product_exists = True
-        
-        # If product doesn't exist, set it to NULL for the insert
-        if not product_exists and product_id:
-            print(f"Warning: Product {product_id} does not exist in products or VIP rooms tables. Setting to NULL.")
-            product_id = None
-        
-        print("Executing database insert...")
-        cursor.execute("""
-            INSERT INTO access_requests (uid, timestamp, product_id, access_status)
-            VALUES (%s, %s, %s, %s)
-        """, (data['uid'], data['time'], product_id, data['access']))
-        
-        print(f"Database insert successful, rows affected: {cursor.rowcount}")
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-
-        if product_id:
-            mark_product_updated(product_id)
+        accepted, product_exists = ingest_access_event(data['uid'], data['time'], data['access'], product_id)
+
+        if not accepted:
+            # Backpressure: the writer is behind, ask the reader to retry
+            access_log.warning("Access ingest queue full, rejecting request")
+            count_tap('http', 'rejected')
+            response = jsonify({
+                "message": "Access request queue is full, retry later",
+                "status": "error"
+            })
+            response.headers['Retry-After'] = '1'
+            return response, 503
 
+        count_tap('http', 'accepted')
         response_data = {
             "message": "Access request processed successfully",
             "data": data,
             "status": "success",
             "product_found": product_exists
         }
-        
-        print("Response Data Sent to Client:", response_data)
-        print("----- ACCESS REQUEST COMPLETED -----")
-
 
         return jsonify(response_data)
         
     except Exception as e:
-        print(f"ERROR PROCESSING ACCESS REQUEST: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        access_log.exception("Error processing access request: %s", e)
+        count_tap('http', 'error')
         
         error_response = {
             "message": f"Error processing access request: {str(e)}",
             "status": "error"
         }
-        print("Error Response:", error_response)
         return jsonify(error_response), 500
 
+
+@app.route('/api/access_ingest', methods=['GET'])
+def access_ingest_stats():
+    """Access ingestion queue metrics (depth, accepted, rejected, flushes) of the process that answers"""
+    return jsonify(dict(access_ingest_queue.stats(), pid=os.getpid()))
+
 # Simple session dictionary - will be reset on server restart
 active_sessions = {}
 
 
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", 60))  # Longest a revoked token can linger in another process
+TOKEN_CACHE_MAX = int(os.getenv("TOKEN_CACHE_MAX", 10000))
+TOKEN_CACHE_CHANNEL = "session_cache"
+
+
+class TokenCache:
+    """
+    LRU cache of validated bearer tokens -> user.
+
+    Entries live for TOKEN_CACHE_TTL seconds or until the session expires,
+    whichever is sooner. Logout and user edits drop entries straight away
+    in this process and via NOTIFY on TOKEN_CACHE_CHANNEL in the others;
+    the TTL bounds staleness if a notification is missed.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()  # token -> (user, expires monotonic)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, token):
+        """Cached user dict for token, or None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            user, expires = entry
+            if expires <= now:
+                del self._entries[token]
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(token)
+            self._stats['hits'] += 1
+            return dict(user)
+
+    def put(self, token, user, session_remaining):
+        """Cache user for token; session_remaining is the session's lifetime left in seconds"""
+        expires = time.monotonic() + min(self.ttl, max(float(session_remaining), 0.0))
+        with self._lock:
+            self._entries[token] = (dict(user), expires)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def invalidate_token(self, token):
+        with self._lock:
+            if self._entries.pop(token, None) is not None:
+                self._stats['invalidations'] += 1
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            tokens = [token for token, (user, _) in self._entries.items() if user['id'] == user_id]
+            for token in tokens:
+                del self._entries[token]
+            self._stats['invalidations'] += len(tokens)
+
+    def clear(self):
+        with self._lock:
+            self._stats['invalidations'] += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return dict(self._stats, size=len(self._entries), max_entries=self.max_entries, ttl=self.ttl,
+                        hit_rate=round(self._stats['hits'] / lookups, 4) if lookups else 0.0)
+
+
+token_cache = TokenCache(TOKEN_CACHE_TTL, TOKEN_CACHE_MAX)
+
+
+def _on_session_notification(payload):
+    # None means the listener reconnected and may have missed invalidations
+    if not payload:
+        token_cache.clear()
+        revocation_list.invalidate()
+    elif payload == 'revoked':
+        revocation_list.invalidate()
+    elif payload.startswith('user:'):
+        token_cache.invalidate_user(int(payload[5:]))
+    elif payload.startswith('token:'):
+        token_cache.invalidate_token(payload[6:])
+
+
+notification_listener.subscribe(TOKEN_CACHE_CHANNEL, _on_session_notification)
+
+
+AUTH_TOKEN_MODE = os.getenv("AUTH_TOKEN_MODE", "session").lower()  # "session" (sessions table) or "signed"
+AUTH_TOKEN_SECRET = os.getenv("AUTH_TOKEN_SECRET", "")
+AUTH_TOKEN_HOURS = int(os.getenv("AUTH_TOKEN_HOURS", 24))
+SESSION_PURGE_INTERVAL = int(os.getenv("SESSION_PURGE_INTERVAL", 3600))
+
+if AUTH_TOKEN_MODE == 'signed' and not AUTH_TOKEN_SECRET:
+    auth_log.warning("AUTH_TOKEN_MODE is 'signed' but AUTH_TOKEN_SECRET is empty, falling back to session tokens")
+    AUTH_TOKEN_MODE = 'session'
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def issue_signed_token(user, hours=AUTH_TOKEN_HOURS):
+    """
+    HS256 JWT for user with sub, email, role, iat, exp and jti claims.
+
+    Returns:
+        tuple: (token, expires_at datetime)
+    """
+    issued = time.time()
+    claims = {
+        'sub': user['id'],
+        'email': user['email'],
+        'role': user['role'],
+        'iat': round(issued, 3),  # Sub-second, so a token issued just after a revocation outlives it
+        'exp': int(issued) + hours * 3600,
+        'jti': uuid.uuid4().hex
+    }
+    signing_input = (_b64encode(json.dumps({'alg': 'HS256', 'typ': 'JWT'}, separators=(',', ':')).encode()) + '.' +
+                     _b64encode(json.dumps(claims, separators=(',', ':')).encode()))
+    signature = hmac.new(AUTH_TOKEN_SECRET.encode(), signing_input.encode(), hashlib.sha256).digest()
+    return signing_input + '.' + _b64encode(signature), datetime.fromtimestamp(claims['exp'])
+
+
+def decode_signed_token(token, verify_expiry=True):
+    """Claims of a valid signed token, or None (bad signature, malformed or expired)"""
+    if not AUTH_TOKEN_SECRET or token.count('.') != 2:
+        return None
+    signing_input, _, signature = token.rpartition('.')
+    expected = hmac.new(AUTH_TOKEN_SECRET.encode(), signing_input.encode(), hashlib.sha256).digest()
+    try:
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            return None
+        header, payload = signing_input.split('.')
+        if json.loads(_b64decode(header)).get('alg') != 'HS256':
+            return None
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, TypeError):
+        return None
+    if verify_expiry and claims.get('exp', 0) <= time.time():
+        return None
+    return claims
+
+
+class RevocationList:
+    """
+    In-memory copy of token_revocations.
+
+    Holds revoked token IDs ('jti:<id>') and per-user cut-offs
+    ('user:<id>': tokens issued before it are rejected, e.g. after a role
+    change). Entries only live until the tokens they cover would have
+    expired anyway, so the list stays small. Reloaded after a NOTIFY on
+    TOKEN_CACHE_CHANNEL and at least every TOKEN_CACHE_TTL seconds; a
+    failed reload keeps the previous entries for CACHE_RELOAD_BACKOFF
+    seconds before the next attempt.
+    """
+
+    def __init__(self, ttl, retry_backoff=CACHE_RELOAD_BACKOFF):
+        self.ttl = ttl
+        self.retry_backoff = retry_backoff
+        self._entries = {}      # key -> revoked_at epoch seconds
+        self._loaded_at = None
+        self._ever_loaded = False
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def _is_current(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return True
+        # Serve the previous entries while backing off from a failed reload
+        return self._ever_loaded and time.monotonic() < self._retry_at
+
+    def _ensure_loaded(self):
+        if self._is_current():
+            return
+        with self._lock:
+            if self._is_current():
+                return
+            try:
+                self._load()
+            except Exception as e:
+                if not self._ever_loaded:
+                    raise
+                self._retry_at = time.monotonic() + self.retry_backoff
+                log.error("Token revocation reload failed, serving previous list for %ss: %s", self.retry_backoff, e)
+
+    def _load(self):
+        # Private connection so a reload never touches the route's transaction
+        conn = get_db_connection(standalone=True)
+        if not conn:
+            raise psycopg2.OperationalError("Unable to connect to database")
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT key, revoked_at FROM token_revocations WHERE expires_at > %s", (time.time(),))
+            self._entries = {row['key']: float(row['revoked_at']) for row in cursor.fetchall()}
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        self._loaded_at = time.monotonic()
+        self._ever_loaded = True
+
+    def is_revoked(self, claims):
+        self._ensure_loaded()
+        if f"jti:{claims.get('jti')}" in self._entries:
+            return True
+        cutoff = self._entries.get(f"user:{claims.get('sub')}")
+        return cutoff is not None and claims.get('iat', 0) < cutoff
+
+    def add(self, key, revoked_at):
+        self._entries[key] = revoked_at
+
+
+revocation_list = RevocationList(TOKEN_CACHE_TTL)
+
+
+def revoke_signed_tokens(cursor, claims=None, user_id=None):
+    """
+    Revoke one signed token (its claims) or every token issued to user_id so far.
+
+    Written in the caller's transaction, with a NOTIFY so other processes
+    reload their revocation list once it commits. Times are epoch seconds
+    from this process's clock, the one iat and exp claims are issued on,
+    so the cut-off does not depend on the database clock or TimeZone.
+    """
+    revoked_at = time.time()
+    if claims is not None:
+        key, expires_at = f"jti:{claims['jti']}", float(claims['exp'])
+    else:
+        key, expires_at = f"user:{user_id}", revoked_at + AUTH_TOKEN_HOURS * 3600
+    cursor.execute("""
+        INSERT INTO token_revocations (key, revoked_at, expires_at) VALUES (%s, %s, %s)
+        ON CONFLICT (key) DO UPDATE SET revoked_at = EXCLUDED.revoked_at,
+            expires_at = GREATEST(token_revocations.expires_at, EXCLUDED.expires_at)
+    """, (key, revoked_at, expires_at))
+    revocation_list.add(key, revoked_at)
+    cursor.execute("SELECT pg_notify(%s, %s)", (TOKEN_CACHE_CHANNEL, 'revoked'))
+
+
+class SessionJanitor:
+    """Deletes expired sessions and revocation entries every SESSION_PURGE_INTERVAL seconds"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stats = {'runs': 0, 'sessions_purged': 0, 'revocations_purged': 0, 'errors': 0}
+
+    def ensure_started(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="session-janitor")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self.purge()
+            time.sleep(self.interval)
+
+    def purge(self):
+        conn = get_db_connection(standalone=True)
+        if not conn:
+            return
+        try:
+            cursor = conn.cursor()
+            sessions_purged = 0
+            if schema_state.has_table('sessions'):
+                cursor.execute("DELETE FROM sessions WHERE expires_at <= NOW()")
+                sessions_purged = cursor.rowcount
+            cursor.execute("DELETE FROM token_revocations WHERE expires_at <= %s", (time.time(),))
+            revocations_purged = cursor.rowcount
+            conn.commit()
+            cursor.close()
+            with self._lock:
+                self._stats['runs'] += 1
+                self._stats['sessions_purged'] += sessions_purged
+                self._stats['revocations_purged'] += revocations_purged
+            if sessions_purged or revocations_purged:
+                auth_log.info("Purged %s expired sessions and %s revocations", sessions_purged, revocations_purged)
+        except Exception as e:
+            with self._lock:
+                self._stats['errors'] += 1
+            auth_log.error("Error purging expired sessions: %s", e)
+        finally:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+session_janitor = SessionJanitor(SESSION_PURGE_INTERVAL)
+
+
+def invalidate_cached_sessions(cursor, token=None, user_id=None):
+    """
+    Drop cached tokens for a logout (token) or a user edit (user_id).
+
+    Local entries go straight away; the NOTIFY is queued in the caller's
+    transaction, so other processes drop theirs once the change commits.
+    """
+    if token is not None:
+        token_cache.invalidate_token(token)
+        cursor.execute("SELECT pg_notify(%s, %s)", (TOKEN_CACHE_CHANNEL, f"token:{token}"))
+    if user_id is not None:
+        token_cache.invalidate_user(user_id)
+        cursor.execute("SELECT pg_notify(%s, %s)", (TOKEN_CACHE_CHANNEL, f"user:{user_id}"))
+
+
+@app.route('/api/token_cache', methods=['GET'])
+def token_cache_stats():
+    """Bearer-token cache metrics (hits, misses, size, evictions, invalidations) and session purges"""
+    return jsonify(dict(token_cache.stats(), mode=AUTH_TOKEN_MODE, session_janitor=session_janitor.stats()))
+
+
+# Subsystems with a stats() dict are read at scrape time (fields named here are counters, the rest gauges)
+metrics_registry.add_stats_collector('tapntrack_db_pool', lambda: get_db_pool().stats(),
+                                     counters={'checkouts', 'waits', 'wait_time_total', 'timeouts', 'health_check_failures'})
+metrics_registry.add_stats_collector('tapntrack_mqtt_publish', lambda: mqtt_publish_queue.stats(),
+                                     counters={'enqueued', 'merged', 'dropped', 'published', 'failed', 'acked',
+                                               'queue_wait_total', 'ack_latency_total'})
+metrics_registry.add_stats_collector('tapntrack_mqtt_router', lambda: mqtt_router.stats(),
+                                     counters={'received', 'unmatched', 'dropped', 'handled', 'errors', 'handler_time_total'})
+metrics_registry.add_stats_collector('tapntrack_access_ingest', lambda: access_ingest_queue.stats(),
+                                     counters={'accepted', 'rejected', 'flushed', 'batches', 'failed_batches', 'dropped',
+                                               'invalid'})
+metrics_registry.add_stats_collector('tapntrack_access_events', lambda: access_change_publisher.stats(),
+                                     counters={'event_messages', 'events', 'snapshots', 'resync_requests', 'errors'})
+metrics_registry.add_stats_collector('tapntrack_token_cache', lambda: token_cache.stats(),
+                                     counters={'hits', 'misses', 'expired', 'evictions', 'invalidations'})
+metrics_registry.add_stats_collector('tapntrack_log', lambda: log_handler.stats(),
+                                     counters={'queued', 'dropped', 'sampled_out'})
+metrics_registry.add_collector(lambda: [
+    ('tapntrack_access_taps_per_second', 'gauge', 'Accepted reader taps per second over the last minute',
+     [({}, access_tap_rate.rate())]),
+    ('tapntrack_mqtt_connected', 'gauge', 'Whether the MQTT client is connected', [({}, mqtt_client.is_connected())])
+])
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_api():
+    """Prometheus text exposition of request, database, MQTT, ingest and cache metrics"""
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+
 
 # # Helper function to convert database records to JSON-serializable format
 def serialize_record(record):
@@ -544,74 +2171,344 @@ def serialize_record(record):
 
 
 
-def init_users_table():
-    """Initialize the users table and create default admin user"""
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "true").lower() == "true"  # "false" when deploys run `python -m schema`
+SCHEMA_INIT_ATTEMPTS = int(os.getenv("SCHEMA_INIT_ATTEMPTS", 5))
+SCHEMA_RECHECK_INTERVAL = float(os.getenv("SCHEMA_RECHECK_INTERVAL", 5))  # /readyz re-read while migrations are pending
+
+# Tables and columns as read at startup; routes pick query variants from it
+schema_state = SchemaState({}, 0)
+schema_checked_at = 0.0
+
+
+def init_schema():
+    """
+    Apply pending schema migrations (see schema.py) and record the resulting layout.
+
+    Retried with backoff while the database is unreachable or a migration
+    fails; after SCHEMA_INIT_ATTEMPTS tries startup fails instead of serving
+    routes against an unknown layout.
+    """
+    global schema_state
+    for attempt in range(1, SCHEMA_INIT_ATTEMPTS + 1):
+        conn = get_db_connection()
+        if not conn:
+            log.error("Failed to connect to database during schema initialization (attempt %s of %s)",
+                      attempt, SCHEMA_INIT_ATTEMPTS)
+        else:
+            try:
+                if MIGRATE_ON_STARTUP:
+                    migrate_schema(conn)
+                cursor = conn.cursor()
+                schema_state = detect_schema(cursor)
+                conn.commit()
+                cursor.close()
+                log.info("Schema at migration version %s, %s tables", schema_state.version, len(schema_state.columns))
+                return
+            except Exception as e:
+                log.exception("Error initializing database schema (attempt %s of %s): %s",
+                              attempt, SCHEMA_INIT_ATTEMPTS, e)
+            finally:
+                conn.close()
+        if attempt < SCHEMA_INIT_ATTEMPTS:
+            time.sleep(min(2 ** attempt, 30))
+    raise RuntimeError(f"Database schema could not be initialized after {SCHEMA_INIT_ATTEMPTS} attempts")
+
+
+init_schema()
+
+
+def init_users_table():
+    """Create the default admin user on an empty users table"""
+    try:
+        log.info("Starting user table initialization...")
+        conn = get_db_connection()
+        if not conn:
+            log.error("Failed to connect to database during initialization")
+            return
+            
+        cursor = conn.cursor()
+        
+        # Check if there are any users
+        log.info("Checking if users exist...")
+        cursor.execute("SELECT COUNT(*) FROM users")
+        user_count = cursor.fetchone()['count']
+        log.info("Found %s existing users", user_count)
+        
+        # Create default admin user if no users exist
+        if user_count == 0:
+            log.info("Creating default admin user...")
+            hashed_password = generate_password_hash('VSDevelopers@123')
+            cursor.execute("""
+                INSERT INTO users (email, password, role)
+                VALUES (%s, %s, %s)
+            """, ('zenvinnovations.com', hashed_password, 'admin'))
+            
+            log.info("Created default admin user: zenvinnovations.com")
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        log.info("Users table initialized successfully")
+        
+    except Exception as e:
+        log.exception("Error initializing users table: %s", e)
+# Initialize the users table when the app starts
+log.info("Initializing users table...")
+init_users_table()
+
+
+@app.route('/api/schema', methods=['GET'])
+def schema_api():
+    """Migration version and the table/column layout the routes were started against"""
+    return jsonify(schema_state.as_dict())
+
+
+def backfill_access_outcomes():
+    """Fill access_requests.outcome for rows written before the column existed"""
+    conn = get_db_connection(standalone=True)
+    if not conn:
+        return
+    try:
+        updated = backfill_outcomes(conn)
+        if updated:
+            log.info("Backfilled access outcome for %s rows", updated)
+    except Exception as e:
+        log.error("Error backfilling access outcomes: %s", e)
+    finally:
+        conn.close()
+
+
+# access_requests partition management (see access_partitions.py)
+ACCESS_PARTITION_MONTHS_AHEAD = int(os.getenv("ACCESS_PARTITION_MONTHS_AHEAD", 3))
+ACCESS_RETENTION_MONTHS = int(os.getenv("ACCESS_RETENTION_MONTHS", 0))  # 0 keeps every partition
+ACCESS_ARCHIVE_DIR = os.getenv("ACCESS_ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'access_archive'))
+ACCESS_PARTITION_CHECK_INTERVAL = int(os.getenv("ACCESS_PARTITION_CHECK_INTERVAL", 3600))
+
+
+class PartitionMaintainer:
+    """
+    Keeps access_requests partitions ahead of time and applies retention.
+
+    Runs in the MQTT process every ACCESS_PARTITION_CHECK_INTERVAL seconds;
+    an advisory lock keeps other processes (or the CLI) from running it at
+    the same time. Does nothing until the table has been converted with
+    `python -m access_partitions convert`.
+    """
+
+    def __init__(self, interval, months_ahead, retention_months, archive_dir):
+        self.interval = interval
+        self.months_ahead = months_ahead
+        self.retention_months = retention_months
+        self.archive_dir = archive_dir
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stats = {'runs': 0, 'created': [], 'archived': [], 'errors': 0, 'last_run': None}
+
+    def ensure_started(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="access-partition-maintainer")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self.run_once()
+            time.sleep(self.interval)
+
+    def run_once(self):
+        conn = get_db_connection(standalone=True)
+        if not conn:
+            return None
+        try:
+            result = maintain_partitions(conn, months_ahead=self.months_ahead,
+                                         retention_months=self.retention_months, archive_dir=self.archive_dir)
+            with self._lock:
+                self._stats['runs'] += 1
+                self._stats['last_run'] = datetime.now().isoformat()
+                if result:
+                    self._stats['created'].extend(result['created'])
+                    self._stats['archived'].extend(path for path, _ in result['archived'])
+            if result:
+                for name in result['created']:
+                    log.info("Created access_requests partition %s", name)
+                for path, rows in result['archived']:
+                    log.info("Archived %s access requests to %s", rows, path)
+            return result
+        except Exception as e:
+            with self._lock:
+                self._stats['errors'] += 1
+            log.exception("Error maintaining access_requests partitions: %s", e)
+            return None
+        finally:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, created=list(self._stats['created']), archived=list(self._stats['archived']))
+
+
+partition_maintainer = PartitionMaintainer(ACCESS_PARTITION_CHECK_INTERVAL, ACCESS_PARTITION_MONTHS_AHEAD,
+                                           ACCESS_RETENTION_MONTHS, ACCESS_ARCHIVE_DIR)
+
+
+@app.route('/api/access_partitions', methods=['GET'])
+def access_partitions_api():
+    """access_requests partitions, archive files and maintainer activity"""
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
     try:
-        print("Starting user table initialization...")
-        conn = get_db_connection()
-        if not conn:
-            print("Failed to connect to database during initialization")
-            return
-            
         cursor = conn.cursor()
-        
-        # Create users table if it doesn't exist
-        print("Creating users table if it doesn't exist...")
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                email VARCHAR(255) UNIQUE NOT NULL,
-                password VARCHAR(255) NOT NULL,
-                role VARCHAR(50) NOT NULL DEFAULT 'manager',
-                created_at TIMESTAMP NOT NULL DEFAULT NOW()
-            )
-        """)
-        
-        # Check if there are any users
-        print("Checking if users exist...")
-        cursor.execute("SELECT COUNT(*) FROM users")
-        user_count = cursor.fetchone()['count']
-        print(f"Found {user_count} existing users")
-        
-        # Create default admin user if no users exist
-        if user_count == 0:
-            print("Creating default admin user...")
-            hashed_password = generate_password_hash('VSDevelopers@123')
-            cursor.execute("""
-                INSERT INTO users (email, password, role)
-                VALUES (%s, %s, %s)
-            """, ('zenvinnovations.com', hashed_password, 'admin'))
-            
-            print("Created default admin user: zenvinnovations.com")
-        
-        conn.commit()
+        partitioned = is_partitioned(cursor)
+        partitions = [
+            {'name': name, 'month': month.strftime('%Y-%m'), 'estimated_rows': rows, 'bytes': size}
+            for name, month, rows, size in list_partitions(cursor)
+        ]
         cursor.close()
         conn.close()
-        
-        print("Users table initialized successfully")
-        
+        archives = [
+            {'month': month.strftime('%Y-%m'), 'path': path, 'bytes': os.path.getsize(path)}
+            for month, path in archive_files(ACCESS_ARCHIVE_DIR)
+        ]
+        return jsonify({
+            'partitioned': partitioned,
+            'partitions': partitions,
+            'archives': archives,
+            'retention_months': ACCESS_RETENTION_MONTHS,
+            'maintainer': partition_maintainer.stats()
+        })
     except Exception as e:
-        print(f"Error initializing users table: {str(e)}")
-        # Add more detail about the error
-        import traceback
-        traceback.print_exc()
-# Initialize the users table when the app starts
-print("Initializing users table...")
-init_users_table()
+        log.exception("Error reading access_requests partitions: %s", e)
+        return jsonify({'error': str(e)}), 500
 
 
 # API ENDPOINTS 
 
 
 
+# Entries list page size: default and upper bound for ?limit=
+RFID_ENTRIES_PAGE_SIZE = int(os.getenv("RFID_ENTRIES_PAGE_SIZE", 10))
+RFID_ENTRIES_MAX_PAGE_SIZE = int(os.getenv("RFID_ENTRIES_MAX_PAGE_SIZE", 1000))
+
+ENTRY_OUTCOMES = {'granted': OUTCOME_GRANTED, 'denied': OUTCOME_DENIED, 'other': OUTCOME_OTHER}
+
+
+def encode_entry_cursor(record):
+    """Opaque keyset cursor for an access_requests row: its (created_at, id)"""
+    raw = f"{record['created_at'].isoformat()}|{record['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_entry_cursor(token):
+    """(created_at, id) from a cursor made by encode_entry_cursor; raises ValueError"""
+    try:
+        created_at, entry_id = base64.urlsafe_b64decode(token.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(entry_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def estimate_row_count(cursor, sql, params):
+    """Planner row estimate for a query, without running it"""
+    cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+    row = cursor.fetchone()
+    plan = row['QUERY PLAN'] if isinstance(row, dict) else row[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def entry_filters(cursor, args):
+    """
+    WHERE conditions for the entries list from the request query string.
+
+    Supports uid, product_id, room (room_no or VIP room, resolved to its
+    product IDs), outcome (granted/denied/other) and start_date/end_date
+    (YYYY-MM-DD, inclusive). Raises ValueError on malformed values.
+
+    Returns:
+        tuple: (conditions, params, filters) where filters holds the parsed
+        values the total count needs.
+    """
+    conditions, params = [], []
+    filters = {'uid': None, 'product_ids': None, 'outcome': None, 'start_day': None, 'end_day': None}
+
+    uid = args.get('uid', '').strip()
+    if uid:
+        conditions.append("uid = %s")
+        params.append(uid)
+        filters['uid'] = uid
+
+    product_ids = None
+    if args.get('product_id'):
+        product_ids = {args['product_id'].strip()}
+    if args.get('room'):
+        cursor.execute("""
+            SELECT product_id FROM productstable WHERE room_no::text = %(room)s
+            UNION
+            SELECT product_id FROM vip_rooms WHERE vip_rooms::text = %(room)s
+        """, {'room': args['room'].strip()})
+        room_products = {row['product_id'] for row in cursor.fetchall()}
+        product_ids = room_products if product_ids is None else product_ids & room_products
+    if product_ids is not None:
+        conditions.append("product_id = ANY(%s)")
+        params.append(sorted(product_ids))
+        filters['product_ids'] = sorted(product_ids)
+
+    outcome = args.get('outcome', '').strip().lower()
+    if outcome:
+        if outcome not in ENTRY_OUTCOMES:
+            raise ValueError("outcome must be one of: " + ', '.join(ENTRY_OUTCOMES))
+        conditions.append("outcome = %s")
+        params.append(ENTRY_OUTCOMES[outcome])
+        filters['outcome'] = ENTRY_OUTCOMES[outcome]
+
+    if args.get('start_date'):
+        filters['start_day'] = datetime.strptime(args['start_date'], '%Y-%m-%d').date()
+        conditions.append("created_at >= %s")
+        params.append(filters['start_day'])
+    if args.get('end_date'):
+        filters['end_day'] = datetime.strptime(args['end_date'], '%Y-%m-%d').date()
+        conditions.append("created_at < %s")
+        params.append(filters['end_day'] + timedelta(days=1))
+
+    return conditions, params, filters
+
+
 @app.route('/api/rfid_entries')
 # @api_auth_required
 def api_rfid_entries():
+    """
+    Access log entries, newest first, with keyset pagination.
+
+    Query params:
+        limit: Page size (default RFID_ENTRIES_PAGE_SIZE).
+        cursor: next_cursor/prev_cursor of a previous page.
+        direction: 'next' (older entries, default) or 'prev' (newer).
+        page: Legacy offset paging, used only when no cursor is given.
+        uid, product_id, room, outcome, start_date, end_date: Filters.
+
+    total_entries comes from the rollup when the filters allow it, otherwise
+    from the planner estimate (total_estimated is then true).
+    """
     try:
-        # Pagination
-        page = request.args.get('page', 1, type=int)
-        per_page = 10
-        offset = (page - 1) * per_page
+        per_page = min(max(request.args.get('limit', RFID_ENTRIES_PAGE_SIZE, type=int), 1),
+                       RFID_ENTRIES_MAX_PAGE_SIZE)
+        page = max(request.args.get('page', 1, type=int), 1)
+        direction = request.args.get('direction', 'next')
+        token = request.args.get('cursor')
+        if direction not in ('next', 'prev'):
+            return jsonify({'error': "direction must be 'next' or 'prev'"}), 400
+        try:
+            position = decode_entry_cursor(token) if token else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         conn = get_db_connection()
         if not conn:
@@ -619,40 +2516,77 @@ def api_rfid_entries():
             
         cursor = conn.cursor()
         
-        # Get total count for pagination
-        cursor.execute("SELECT COUNT(*) as total FROM access_requests")
-        total_entries = cursor.fetchone()['total']
+        try:
+            conditions, params, filters = entry_filters(cursor, request.args)
+        except ValueError as e:
+            cursor.close()
+            conn.close()
+            return jsonify({'error': f"Invalid filter: {str(e)}"}), 400
+        
+        # Total for the filter set: the rollup covers everything but uid
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        if filters['uid'] is None:
+            total_entries = rollup_count(cursor, filters['start_day'], filters['end_day'],
+                                         filters['product_ids'], filters['outcome'])
+            total_estimated = False
+        else:
+            total_entries = estimate_row_count(cursor, f"SELECT id FROM access_requests {where}", params)
+            total_estimated = True
+        
+        # Keyset on (created_at, id); one extra row tells whether another page exists
+        page_conditions, page_params = list(conditions), list(params)
+        offset = 0
+        if position:
+            page_conditions.append("(created_at, id) < (%s, %s)" if direction == 'next' else "(created_at, id) > (%s, %s)")
+            page_params.extend(position)
+        else:
+            offset = (page - 1) * per_page
+        order = "DESC" if direction == 'next' or not position else "ASC"
         
-        # Get entries for current page
-        cursor.execute("""
+        cursor.execute(f"""
             SELECT * FROM access_requests
-            ORDER BY created_at DESC
+            {'WHERE ' + ' AND '.join(page_conditions) if page_conditions else ''}
+            ORDER BY created_at {order}, id {order}
             LIMIT %s OFFSET %s
-        """, (per_page, offset))
+        """, page_params + [per_page + 1, offset])
         entries = cursor.fetchall()
         
+        cursor.close()
+        conn.close()
+        
+        more = len(entries) > per_page
+        entries = entries[:per_page]
+        if order == "ASC":
+            entries.reverse()
+        
+        # Older entries exist past the last row when we walked forward and found
+        # more, or whenever we came back from an older page
+        has_next = more if order == "DESC" else True
+        has_prev = (more if order == "ASC" else bool(position) or offset > 0)
+        next_cursor = encode_entry_cursor(entries[-1]) if entries and has_next else None
+        prev_cursor = encode_entry_cursor(entries[0]) if entries and has_prev else None
+        
         # Convert entries to serializable format
         serialized_entries = []
         for entry in entries:
             serialized_entry = serialize_record(entry)
             serialized_entries.append(serialized_entry)
         
-        cursor.close()
-        conn.close()
-        
         # Calculate total pages
-        total_pages = (total_entries + per_page - 1) 
+        total_pages = max((total_entries + per_page - 1) // per_page, 1)
         
         return jsonify({
             'entries': serialized_entries,
             'page': page,
+            'per_page': per_page,
             'total_pages': total_pages,
-            'total_entries': total_entries
+            'total_entries': total_entries,
+            'total_estimated': total_estimated,
+            'next_cursor': next_cursor,
+            'prev_cursor': prev_cursor
         })
     except Exception as e:
-        print(f"RFID Entries API error: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("RFID Entries API error: %s", e)
         # socketio.emit('new_rfid_entry', new_entry)
         return jsonify({'error': 'An error occurred fetching RFID entries'}), 500
 
@@ -670,76 +2604,43 @@ def api_dashboard():
             
         cursor = conn.cursor()
         
-        # Total entries
-        cursor.execute("SELECT COUNT(*) as total FROM access_requests")
-        total_entries = cursor.fetchone()['total']
-        
-        # Today's entries
-        today = datetime.now().strftime('%Y-%m-%d')
-        cursor.execute("SELECT COUNT(*) as count FROM access_requests WHERE DATE(created_at) = %s", (today,))
-        today_entries = cursor.fetchone()['count']
-        
-        # Get unique rooms (assuming product_id is room)
-        cursor.execute("SELECT COUNT(DISTINCT product_id) as count FROM access_requests")
-        unique_rooms = cursor.fetchone()['count']
-        
-        # Get unique users (assuming uid is user)
-        cursor.execute("SELECT COUNT(DISTINCT uid) as count FROM access_requests")
-        unique_users = cursor.fetchone()['count']
-        
-        # Get access status counts
-        cursor.execute("SELECT COUNT(*) as count FROM access_requests WHERE access_status LIKE '%Granted%'")
-        granted_count = cursor.fetchone()['count']
-        
-        cursor.execute("SELECT COUNT(*) as count FROM access_requests WHERE access_status LIKE '%Denied%'")
-        denied_count = cursor.fetchone()['count']
+        # Totals, today's entries, unique rooms/users and outcome counts from the rollup
+        end_date = datetime.now().date()
+        totals = dashboard_totals(cursor, end_date)
+        total_entries = totals['total_entries']
+        today_entries = totals['today_entries']
+        unique_rooms = totals['unique_rooms']
+        unique_users = totals['unique_users']
+        granted_count = totals['granted_count']
+        denied_count = totals['denied_count']
         
         # Get daily trend data (last 30 days)
-        end_date = datetime.now().date()
         start_date = end_date - timedelta(days=29)
+        counts_by_day = daily_counts(cursor, start_date, end_date)
         
-        # Format dates for SQL
-        start_date_str = start_date.strftime('%Y-%m-%d')
-        end_date_str = (end_date + timedelta(days=1)).strftime('%Y-%m-%d')
-        
-        # Get daily counts
-        cursor.execute("""
-            SELECT DATE(created_at) as check_date, COUNT(*) as count
-            FROM access_requests
-            WHERE created_at >= %s AND created_at < %s
-            GROUP BY check_date
-            ORDER BY check_date
-        """, (start_date_str, end_date_str))
-        
-        # Initialize with all dates in range having zero counts
+        # Initialize with all dates in range, zero where there were no taps
         daily_data = {}
         current_date = start_date
         while current_date <= end_date:
             date_str = current_date.strftime('%Y-%m-%d')
-            daily_data[date_str] = 0
+            daily_data[date_str] = counts_by_day.get(current_date, 0)
             current_date += timedelta(days=1)
-            
-        # Fill in actual counts
-        results = cursor.fetchall()
-        for row in results:
-            date_str = row['check_date'].strftime('%Y-%m-%d')
-            daily_data[date_str] = row['count']
         
         # Convert to arrays for the response
         date_labels = list(daily_data.keys())
-        daily_counts = list(daily_data.values())
+        day_values = list(daily_data.values())
         
         # Calculate average
-        avg_daily = sum(daily_counts) / len(daily_counts) if daily_counts else 0
+        avg_daily = sum(day_values) / len(day_values) if day_values else 0
         
         # Get max and min days
-        if daily_counts:
-            max_count = max(daily_counts)
-            max_day_idx = daily_counts.index(max_count)
+        if day_values:
+            max_count = max(day_values)
+            max_day_idx = day_values.index(max_count)
             max_day = date_labels[max_day_idx]
             
-            min_count = min(daily_counts)
-            min_day_idx = daily_counts.index(min_count)
+            min_count = min(day_values)
+            min_day_idx = day_values.index(min_count)
             min_day = date_labels[min_day_idx]
         else:
             max_count = 0
@@ -752,7 +2653,7 @@ def api_dashboard():
         for i, date_str in enumerate(date_labels):
             daily_entries.append({
                 "date": date_str,
-                "count": daily_counts[i]
+                "count": day_values[i]
             })
         
         # Get recent entries
@@ -776,7 +2677,7 @@ def api_dashboard():
             'granted_count': granted_count,
             'denied_count': denied_count,
             'daily_labels': date_labels,
-            'daily_counts': daily_counts,
+            'daily_counts': day_values,
             'daily_entries': daily_entries,  # Added structured daily entries data
             'recent_entries': serialized_entries,
             'average_entries': round(avg_daily, 1),  # Added average
@@ -784,13 +2685,34 @@ def api_dashboard():
             'peak_count': max_count  # Added peak count
         })
     except Exception as e:
-        print(f"Dashboard API error: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Dashboard API error: %s", e)
         return jsonify({'error': 'An error occurred fetching dashboard data'}), 500
 
 
 # CHECKIN TRENDS ENDPOINT
+
+TRENDS_MAX_POINTS = 120  # Most points in the checkin_trends daily series
+
+
+def trend_bucket(num_days):
+    """Smallest of day/week/month/year that keeps the series within TRENDS_MAX_POINTS"""
+    if num_days <= TRENDS_MAX_POINTS:
+        return 'day'
+    if num_days / 7 <= TRENDS_MAX_POINTS:
+        return 'week'
+    if num_days / 30 <= TRENDS_MAX_POINTS:
+        return 'month'
+    return 'year'
+
+
+def trend_bucket_start(day, bucket):
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    if bucket == 'year':
+        return day.replace(month=1, day=1)
+    return day
         
 @app.route('/api/checkin_trends')
 # @api_auth_required
@@ -815,9 +2737,6 @@ def api_checkin_trends():
             end_date = datetime.now().date()
             start_date = end_date - timedelta(days=int(period) - 1)  # Adjusted to include full range
             
-        # Add one day to end_date to include the entire end day
-        end_date_inclusive = end_date + timedelta(days=1)
-            
         # Connect to database
         conn = get_db_connection()
         if not conn:
@@ -825,106 +2744,26 @@ def api_checkin_trends():
             
         cursor = conn.cursor()
         
-        # Get check-in data for the selected period
-        cursor.execute("""
-            SELECT 
-                created_at,
-                access_status
-            FROM 
-                access_requests
-            WHERE 
-                created_at >= %s AND created_at < %s
-            ORDER BY 
-                created_at
-        """, (start_date, end_date_inclusive))
+        # All histograms for the period from one grouped query over the rollup
+        histograms = trend_histograms(cursor, start_date, end_date)
+        hourly_counts = histograms['hourly']
+        day_of_week_counts = histograms['day_of_week']
+        granted_count = histograms['outcomes'].get(OUTCOME_GRANTED, 0)
+        denied_count = histograms['outcomes'].get(OUTCOME_DENIED, 0)
         
-        # Fetch all access records
-        access_records = cursor.fetchall()
+        cursor.close()
+        conn.close()
         
-        # Process the data
+        # Complete date range, zero where there were no taps
         daily_data = {}
-        hourly_counts = [0] * 24
-        day_of_week_counts = [0] * 7
-        granted_count = 0
-        denied_count = 0
-        
-        # Generate complete date range
-        complete_date_range = []
         current_date = start_date
         while current_date <= end_date:
-            # Initialize all dates with zero count
-            daily_data[current_date] = 0
-            complete_date_range.append(current_date)
+            daily_data[current_date] = histograms['daily'].get(current_date, 0)
             current_date += timedelta(days=1)
         
-        if not access_records:
-            # Return empty data with the complete date range
-            sorted_dates = sorted(daily_data.keys())
-            date_labels = [date.strftime('%Y-%m-%d') for date in sorted_dates]
-            daily_counts = [0 for _ in sorted_dates]
-            
-            return jsonify({
-                'total_entries': 0,
-                'avg_daily': 0,
-                'granted_count': 0,
-                'granted_percentage': 0,
-                'denied_count': 0,
-                'denied_percentage': 0,
-                'date_labels': date_labels,
-                'daily_counts': daily_counts,
-                'hourly_counts': hourly_counts,
-                'day_of_week_counts': day_of_week_counts,
-                'max_daily': 0,
-                'max_day': 'N/A',
-                'min_daily': 0,
-                'min_day': 'N/A',
-                'most_active_hour': 0,
-                'most_active_dow': 0
-            })
-        
-        # Count check-ins by date, hour, and day of week
-        for record in access_records:
-            # Handle RealDictRow or regular tuple
-            if isinstance(record, dict):
-                timestamp = record.get('created_at')
-                access_status = record.get('access_status', '')
-            else:
-                timestamp = record[0]
-                access_status = record[1] if len(record) > 1 else ''
-            
-            # Skip if timestamp is None
-            if not timestamp:
-                continue
-                
-            # Get date components
-            date_only = timestamp.date()
-            hour = timestamp.hour
-            day_of_week = timestamp.weekday()  # 0 is Monday, 6 is Sunday
-            
-            # Count by date - date is already initialized with 0
-            if date_only in daily_data:  # Only count if within our date range
-                daily_data[date_only] += 1
-            
-            # Count by hour
-            hourly_counts[hour] += 1
-            
-            # Count by day of week
-            day_of_week_counts[day_of_week] += 1
-            
-            # Count by access status
-            if 'granted' in access_status.lower():
-                granted_count += 1
-            elif 'denied' in access_status.lower():
-                denied_count += 1
-        
-        # Sort dates and prepare labels and data for daily trend chart
-        sorted_dates = sorted(daily_data.keys())
-        date_labels = [date.strftime('%Y-%m-%d') for date in sorted_dates]
-        daily_counts = [daily_data[date] for date in sorted_dates]
-        
         # Calculate statistics
-        total_entries = len(access_records)
-        num_days = len(sorted_dates)
+        total_entries = sum(daily_data.values())
+        num_days = len(daily_data)
         avg_daily = total_entries / num_days if num_days > 0 else 0
         
         # Calculate percentages
@@ -932,21 +2771,26 @@ def api_checkin_trends():
         denied_percentage = (denied_count / total_entries * 100) if total_entries > 0 else 0
         
         # Find max and min daily check-ins
-        max_daily = max(daily_data.values()) if daily_data else 0
-        max_day_date = next((date for date, count in daily_data.items() if count == max_daily), None)
-        max_day = max_day_date.strftime('%Y-%m-%d') if max_day_date else 'N/A'
-        
-        min_daily = min(daily_data.values()) if daily_data else 0
-        min_day_date = next((date for date, count in daily_data.items() if count == min_daily), None)
-        min_day = min_day_date.strftime('%Y-%m-%d') if min_day_date else 'N/A'
+        if total_entries > 0:
+            max_daily = max(daily_data.values())
+            max_day = next(date for date, count in daily_data.items() if count == max_daily).strftime('%Y-%m-%d')
+            min_daily = min(daily_data.values())
+            min_day = next(date for date, count in daily_data.items() if count == min_daily).strftime('%Y-%m-%d')
+        else:
+            max_daily, max_day, min_daily, min_day = 0, 'N/A', 0, 'N/A'
         
         # Find most active hour and day of week
         most_active_hour = hourly_counts.index(max(hourly_counts)) if max(hourly_counts) > 0 else 0
         most_active_dow = day_of_week_counts.index(max(day_of_week_counts)) if max(day_of_week_counts) > 0 else 0
         
-        # Close database connection
-        cursor.close()
-        conn.close()
+        # Long ranges are summed into weekly/monthly/yearly points so the chart stays bounded
+        bucket = trend_bucket(num_days)
+        bucketed = {}
+        for date, count in daily_data.items():
+            label = trend_bucket_start(date, bucket).strftime('%Y-%m-%d')
+            bucketed[label] = bucketed.get(label, 0) + count
+        date_labels = list(bucketed.keys())
+        daily_counts = list(bucketed.values())
         
         # Return JSON response
         return jsonify({
@@ -958,6 +2802,7 @@ def api_checkin_trends():
             'denied_percentage': denied_percentage,
             'date_labels': date_labels,
             'daily_counts': daily_counts,
+            'bucket': bucket,
             'hourly_counts': hourly_counts,
             'day_of_week_counts': day_of_week_counts,
             'max_daily': max_daily,
@@ -969,9 +2814,7 @@ def api_checkin_trends():
         })
         
     except Exception as e:
-        print(f"Checkin Trends API error: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Checkin Trends API error: %s", e)
         return jsonify({'error': f'An error occurred: {str(e)}'}), 500
 
 
@@ -981,251 +2824,89 @@ def api_checkin_trends():
 
 @app.route('/api/room_frequency', methods=['GET'])
 def room_frequency_api():
+    """
+    Access statistics per room.
+
+    Query params:
+        period: 'all' (default), a number of days ending today, or 'custom'
+            with start_date/end_date (YYYY-MM-DD).
+    """
+    empty = {
+        'room_stats': [],
+        'total_rooms': 0,
+        'total_access': 0,
+        'avg_access_per_room': 0
+    }
+
+    period = request.args.get('period', 'all')
+    try:
+        if period == 'custom':
+            start_date_str = request.args.get('start_date')
+            end_date_str = request.args.get('end_date')
+            if not start_date_str or not end_date_str:
+                return jsonify(dict(empty, error='Start date and end date required for custom period')), 400
+            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+        elif period == 'all':
+            start_date = end_date = None
+        else:
+            end_date = datetime.now().date()
+            start_date = end_date - timedelta(days=int(period) - 1)
+    except ValueError:
+        return jsonify(dict(empty, error='Invalid period or date format (use YYYY-MM-DD)')), 400
+
     # Connect to database
     conn = get_db_connection()
     if not conn:
-        return jsonify({
-            'error': "Unable to connect to database",
-            'room_stats': [],
-            'total_rooms': 0,
-            'total_access': 0,
-            'avg_access_per_room': 0
-        }), 500
+        return jsonify(dict(empty, error="Unable to connect to database")), 500
     
     try:
         cursor = conn.cursor()
         
-        # First, check if access_requests table has data
-        cursor.execute("SELECT COUNT(*) FROM access_requests")
-        total_records = cursor.fetchone()
-        
-        # Handle RealDictRow
-        if isinstance(total_records, dict):
-            record_count = total_records.get('count', 0)
-        else:
-            # Fallback for regular tuple
-            record_count = total_records[0] if total_records else 0
-        
-        print(f"Total records in access_requests: {record_count}")
-        
-        # Initialize empty array for processed stats
-        processed_room_stats = []
-        
-        # Even if no access records, we'll still show rooms with zero stats
-        if record_count > 0:
-            # Get Room Access statistics for regular rooms
-            cursor.execute("""
-                SELECT 
-                    ar.product_id,
-                    p.room_no,
-                    'Regular' as room_type,
-                    COUNT(*) AS total_access,
-                    SUM(CASE WHEN access_status LIKE '%Granted%' THEN 1 ELSE 0 END) AS access_granted,
-                    SUM(CASE WHEN access_status LIKE '%Denied%' THEN 1 ELSE 0 END) AS access_denied,
-                    COALESCE(
-                        (SELECT EXTRACT(HOUR FROM created_at)
-                         FROM access_requests ar2
-                         WHERE ar2.product_id = ar.product_id
-                         GROUP BY EXTRACT(HOUR FROM created_at)
-                         ORDER BY COUNT(*) DESC
-                         LIMIT 1),
-                        -1
-                    ) AS most_active_hour,
-                    COALESCE(
-                        (SELECT EXTRACT(DOW FROM created_at)
-                         FROM access_requests ar2
-                         WHERE ar2.product_id = ar.product_id
-                         GROUP BY EXTRACT(DOW FROM created_at)
-                         ORDER BY COUNT(*) DESC
-                         LIMIT 1),
-                        -1
-                    ) AS most_active_day
-                FROM 
-                    access_requests ar
-                JOIN
-                    productstable p ON ar.product_id = p.product_id
-                GROUP BY 
-                    ar.product_id, p.room_no
-            """)
-            
-            regular_room_stats = cursor.fetchall()
-            
-            # Get data for VIP rooms that have access records
-            cursor.execute("""
-                SELECT 
-                    ar.product_id,
-                    v.vip_rooms,
-                    'VIP' as room_type,
-                    COUNT(*) AS total_access,
-                    SUM(CASE WHEN access_status LIKE '%Granted%' THEN 1 ELSE 0 END) AS access_granted,
-                    SUM(CASE WHEN access_status LIKE '%Denied%' THEN 1 ELSE 0 END) AS access_denied,
-                    COALESCE(
-                        (SELECT EXTRACT(HOUR FROM created_at)
-                         FROM access_requests ar2
-                         WHERE ar2.product_id = ar.product_id
-                         GROUP BY EXTRACT(HOUR FROM created_at)
-                         ORDER BY COUNT(*) DESC
-                         LIMIT 1),
-                        -1
-                    ) AS most_active_hour,
-                    COALESCE(
-                        (SELECT EXTRACT(DOW FROM created_at)
-                         FROM access_requests ar2
-                         WHERE ar2.product_id = ar.product_id
-                         GROUP BY EXTRACT(DOW FROM created_at)
-                         ORDER BY COUNT(*) DESC
-                         LIMIT 1),
-                        -1
-                    ) AS most_active_day
-                FROM 
-                    access_requests ar
-                JOIN
-                    vip_rooms v ON ar.product_id = v.product_id
-                GROUP BY 
-                    ar.product_id, v.vip_rooms
-            """)
-            
-            vip_room_stats = cursor.fetchall()
-            
-            # Process and combine the room statistics
-            day_mapping = {
-                0: "Sunday", 1: "Monday", 2: "Tuesday", 
-                3: "Wednesday", 4: "Thursday", 5: "Friday", 6: "Saturday"
-            }
-            
-            # Process regular rooms with access data
-            for stat in regular_room_stats:
-                if isinstance(stat, dict):
-                    room_stat = {
-                        'room_id': str(stat.get('room_no', 'Unknown')),
-                        'room_type': 'Regular',
-                        'total_access': int(stat.get('total_access', 0)),
-                        'access_granted': int(stat.get('access_granted', 0)),
-                        'access_denied': int(stat.get('access_denied', 0)),
-                        'most_active_hour': f"{int(stat.get('most_active_hour', -1))}:00" if stat.get('most_active_hour', -1) != -1 else 'N/A',
-                        'most_active_day': day_mapping.get(int(stat.get('most_active_day', -1)), 'N/A') if stat.get('most_active_day', -1) != -1 else 'N/A'
-                    }
-                else:
-                    # Fallback for regular tuple
-                    room_stat = {
-                        'room_id': str(stat[1]) if stat[1] is not None else 'Unknown',
-                        'room_type': 'Regular',
-                        'total_access': int(stat[3]) if stat[3] is not None else 0,
-                        'access_granted': int(stat[4]) if stat[4] is not None else 0,
-                        'access_denied': int(stat[5]) if stat[5] is not None else 0,
-                        'most_active_hour': f"{int(stat[6])}:00" if stat[6] is not None and stat[6] != -1 else 'N/A',
-                        'most_active_day': day_mapping.get(int(stat[7]), 'N/A') if stat[7] is not None and stat[7] != -1 else 'N/A'
-                    }
-                processed_room_stats.append(room_stat)
-            
-            # Process VIP rooms with access data
-            for stat in vip_room_stats:
-                if isinstance(stat, dict):
-                    room_stat = {
-                        'room_id': str(stat.get('vip_rooms', 'Unknown')),
-                        'room_type': 'VIP',
-                        'total_access': int(stat.get('total_access', 0)),
-                        'access_granted': int(stat.get('access_granted', 0)),
-                        'access_denied': int(stat.get('access_denied', 0)),
-                        'most_active_hour': f"{int(stat.get('most_active_hour', -1))}:00" if stat.get('most_active_hour', -1) != -1 else 'N/A',
-                        'most_active_day': day_mapping.get(int(stat.get('most_active_day', -1)), 'N/A') if stat.get('most_active_day', -1) != -1 else 'N/A'
-                    }
-                else:
-                    # Fallback for regular tuple
-                    room_stat = {
-                        'room_id': str(stat[1]) if stat[1] is not None else 'Unknown',
-                        'room_type': 'VIP',
-                        'total_access': int(stat[3]) if stat[3] is not None else 0,
-                        'access_granted': int(stat[4]) if stat[4] is not None else 0,
-                        'access_denied': int(stat[5]) if stat[5] is not None else 0,
-                        'most_active_hour': f"{int(stat[6])}:00" if stat[6] is not None and stat[6] != -1 else 'N/A',
-                        'most_active_day': day_mapping.get(int(stat[7]), 'N/A') if stat[7] is not None and stat[7] != -1 else 'N/A'
-                    }
-                processed_room_stats.append(room_stat)
-        
-        # Get ALL regular rooms, including those without access records
+        # Every room, regular and VIP; rooms without taps still get a zero row
         cursor.execute("""
-            SELECT 
-                product_id,
-                room_no,
-                'Regular' as room_type
-            FROM 
-                productstable p
-            WHERE p.product_id NOT IN (SELECT DISTINCT product_id FROM access_requests)
+            SELECT product_id, room_no::text as room_id, 'Regular' as room_type FROM productstable
+            UNION ALL
+            SELECT product_id, vip_rooms::text as room_id, 'VIP' as room_type FROM vip_rooms
         """)
+        rooms = cursor.fetchall()
         
-        inactive_regular_rooms = cursor.fetchall()
+        # Outcome/hour/day histograms for all products in one pass over the rollup
+        histograms = room_histograms(cursor, start_date, end_date)
         
-        # Get ALL VIP rooms, including those without access records
-        cursor.execute("""
-            SELECT 
-                product_id,
-                vip_rooms,
-                'VIP' as room_type
-            FROM 
-                vip_rooms v
-            WHERE v.product_id NOT IN (SELECT DISTINCT product_id FROM access_requests)
-        """)
+        cursor.close()
+        conn.close()
         
-        inactive_vip_rooms = cursor.fetchall()
-        
-        # Process inactive regular rooms
-        for room in inactive_regular_rooms:
-            if isinstance(room, dict):
-                room_stat = {
-                    'room_id': str(room.get('room_no', 'Unknown')),
-                    'room_type': 'Regular',
-                    'total_access': 0,
-                    'access_granted': 0,
-                    'access_denied': 0,
-                    'most_active_hour': 'N/A',
-                    'most_active_day': 'N/A'
-                }
-            else:
-                room_stat = {
-                    'room_id': str(room[1]) if room[1] is not None else 'Unknown',
-                    'room_type': 'Regular',
-                    'total_access': 0,
-                    'access_granted': 0,
-                    'access_denied': 0,
-                    'most_active_hour': 'N/A',
-                    'most_active_day': 'N/A'
-                }
-            processed_room_stats.append(room_stat)
-            
-        # Process inactive VIP rooms
-        for room in inactive_vip_rooms:
-            if isinstance(room, dict):
-                room_stat = {
-                    'room_id': str(room.get('vip_rooms', 'Unknown')),
-                    'room_type': 'VIP',
-                    'total_access': 0,
-                    'access_granted': 0,
-                    'access_denied': 0,
-                    'most_active_hour': 'N/A',
-                    'most_active_day': 'N/A'
-                }
-            else:
-                room_stat = {
-                    'room_id': str(room[1]) if room[1] is not None else 'Unknown',
-                    'room_type': 'VIP',
-                    'total_access': 0,
-                    'access_granted': 0,
-                    'access_denied': 0,
-                    'most_active_hour': 'N/A',
-                    'most_active_day': 'N/A'
-                }
+        day_mapping = {
+            0: "Sunday", 1: "Monday", 2: "Tuesday", 
+            3: "Wednesday", 4: "Thursday", 5: "Friday", 6: "Saturday"
+        }
+        
+        processed_room_stats = []
+        for room in rooms:
+            histogram = histograms.get(room['product_id'])
+            room_stat = {
+                'room_id': room['room_id'] if room['room_id'] is not None else 'Unknown',
+                'room_type': room['room_type'],
+                'total_access': 0,
+                'access_granted': 0,
+                'access_denied': 0,
+                'most_active_hour': 'N/A',
+                'most_active_day': 'N/A'
+            }
+            if histogram:
+                hourly, day_of_week = histogram['hourly'], histogram['day_of_week']
+                room_stat['total_access'] = sum(histogram['outcomes'].values())
+                room_stat['access_granted'] = histogram['outcomes'].get(OUTCOME_GRANTED, 0)
+                room_stat['access_denied'] = histogram['outcomes'].get(OUTCOME_DENIED, 0)
+                if room_stat['total_access']:
+                    room_stat['most_active_hour'] = f"{hourly.index(max(hourly))}:00"
+                    room_stat['most_active_day'] = day_mapping[day_of_week.index(max(day_of_week))]
             processed_room_stats.append(room_stat)
         
         # If no rooms were found at all, return an appropriate message
         if len(processed_room_stats) == 0:
-            return jsonify({
-                'error': "No rooms found in the database",
-                'room_stats': [],
-                'total_rooms': 0,
-                'total_access': 0,
-                'avg_access_per_room': 0
-            }), 404
+            return jsonify(dict(empty, error="No rooms found in the database")), 404
         
         # Sort by total_access in descending order
         processed_room_stats = sorted(processed_room_stats, key=lambda x: x['total_access'], reverse=True)
@@ -1235,32 +2916,24 @@ def room_frequency_api():
         total_access = sum(stat['total_access'] for stat in processed_room_stats)
         avg_access_per_room = total_access / total_rooms if total_rooms > 0 else 0
         
-        cursor.close()
-        conn.close()
-        
         return jsonify({
             'room_stats': processed_room_stats,
             'total_rooms': total_rooms,
             'total_access': total_access,
-            'avg_access_per_room': round(avg_access_per_room, 2)
+            'avg_access_per_room': round(avg_access_per_room, 2),
+            'period': period,
+            'start_date': start_date.strftime('%Y-%m-%d') if start_date else None,
+            'end_date': end_date.strftime('%Y-%m-%d') if end_date else None
         })
     
     except Exception as e:
         # Comprehensive error logging
-        import traceback
-        print("Detailed error in room_frequency route:")
-        print(traceback.format_exc())
+        log.exception("Detailed error in room_frequency route")
         
         if conn:
             conn.close()
         
-        return jsonify({
-            'error': f"An error occurred: {str(e)}",
-            'room_stats': [],
-            'total_rooms': 0,
-            'total_access': 0,
-            'avg_access_per_room': 0
-        }), 500
+        return jsonify(dict(empty, error=f"An error occurred: {str(e)}")), 500
 
 # MANAGE TABLES ENDPOINT
     
@@ -1342,6 +3015,10 @@ def manage_tables_api():
                 
                 # Commit changes
                 conn.commit()
+
+                if product_changes:
+                    product_registry.invalidate(notify_conn=conn)
+                    snapshot_cache.mark_all_dirty()
                 
                 # Get updated data
                 cursor.execute("SELECT product_id, room_no as room_id FROM productstable ORDER BY product_id")
@@ -1364,9 +3041,7 @@ def manage_tables_api():
                 # Rollback in case of error
                 conn.rollback()
                 
-                import traceback
-                print("Error in manage_tables_api POST:")
-                print(traceback.format_exc())
+                log.exception("Error in manage_tables_api POST")
                 
                 return jsonify({
                     'error': f"Error saving changes: {str(e)}"
@@ -1389,9 +3064,7 @@ def manage_tables_api():
     
     except Exception as e:
         # Comprehensive error logging
-        import traceback
-        print("Detailed error in manage_tables_api route:")
-        print(traceback.format_exc())
+        log.exception("Detailed error in manage_tables_api route")
         
         if conn:
             conn.close()
@@ -1446,6 +3119,8 @@ def add_product():
         
         # Commit changes
         conn.commit()
+        product_registry.invalidate(notify_conn=conn)
+        snapshot_cache.mark_all_dirty()
         
         cursor.close()
         conn.close()
@@ -1463,9 +3138,7 @@ def add_product():
         if conn:
             conn.rollback()
         
-        import traceback
-        print("Error in add_product API:")
-        print(traceback.format_exc())
+        log.exception("Error in add_product API")
         
         return jsonify({
             'error': f"Error adding product: {str(e)}"
@@ -1505,8 +3178,10 @@ def delete_product(product_id):
         # Delete related cards first
         cursor.execute("DELETE FROM cardids WHERE product_id = %s", (product_id,))
         
-        # Delete related access entries
+        # Delete related access entries, their rollup counts and card assignments
         cursor.execute("DELETE FROM access_requests WHERE product_id = %s", (product_id,))
+        cursor.execute("DELETE FROM access_rollup WHERE product_id = %s", (product_id,))
+        cursor.execute("DELETE FROM card_assignments WHERE product_id = %s", (product_id,))
         
         # Finally delete the product
         cursor.execute("DELETE FROM productstable WHERE product_id = %s", (product_id,))
@@ -1522,6 +3197,8 @@ def delete_product(product_id):
         
         # Commit changes
         conn.commit()
+        product_registry.invalidate(notify_conn=conn)
+        snapshot_cache.mark_all_dirty()
         
         cursor.close()
         conn.close()
@@ -1535,9 +3212,7 @@ def delete_product(product_id):
         if conn:
             conn.rollback()
         
-        import traceback
-        print("Error in delete_product API:")
-        print(traceback.format_exc())
+        log.exception("Error in delete_product API")
         
         return jsonify({
             'error': f"Error deleting product: {str(e)}"
@@ -1576,22 +3251,25 @@ def login():
         # Verify credentials
         if not user or not check_password_hash(user['password'], password):
             return jsonify({'error': 'Invalid username or password'}), 401
+        
+        # Signed mode: self-contained token, nothing to store
+        if AUTH_TOKEN_MODE == 'signed':
+            token, expires_at = issue_signed_token(user)
+            cursor.close()
+            conn.close()
+            return jsonify({
+                'token': token,
+                'user': {
+                    'id': user['id'],
+                    'email': user['email'],
+                    'role': user['role']
+                },
+                'expires_at': expires_at.isoformat()
+            })
             
         # Generate a unique token
         token = str(uuid.uuid4())
         
-        # Store token in sessions table (create if not exists)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS sessions (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER NOT NULL REFERENCES users(id),
-                token VARCHAR(255) NOT NULL UNIQUE,
-                created_at TIMESTAMP NOT NULL DEFAULT NOW(),
-                expires_at TIMESTAMP NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        """)
-        
         # Set expiration to 24 hours from now
         expires_at = datetime.now() + timedelta(hours=24)
         
@@ -1617,9 +3295,7 @@ def login():
         })
         
     except Exception as e:
-        print(f"Error during login: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error during login: %s", e)
         return jsonify({'error': f"Login failed: {str(e)}"}), 500
     
 # LOGOUT ENDPOINT
@@ -1642,8 +3318,14 @@ def logout():
             
         cursor = conn.cursor()
         
-        # Delete the session
-        cursor.execute("DELETE FROM sessions WHERE token = %s", (token,))
+        # Signed tokens go on the revocation list until they would have expired
+        claims = decode_signed_token(token)
+        if claims is not None:
+            revoke_signed_tokens(cursor, claims=claims)
+        else:
+            # Delete the session and drop it from every process's token cache
+            cursor.execute("DELETE FROM sessions WHERE token = %s", (token,))
+            invalidate_cached_sessions(cursor, token=token)
         
         conn.commit()
         cursor.close()
@@ -1652,7 +3334,7 @@ def logout():
         return jsonify({'message': 'Logged out successfully'})
         
     except Exception as e:
-        print(f"Error during logout: {str(e)}")
+        log.error("Error during logout: %s", e)
         return jsonify({'error': f"Logout failed: {str(e)}"}), 500
     
 # CHECK-SESSION ENDPOINT
@@ -1677,7 +3359,7 @@ def check_session():
         })
         
     except Exception as e:
-        print(f"Error checking session: {str(e)}")
+        log.error("Error checking session: %s", e)
         return jsonify({'error': f"Session check failed: {str(e)}", 'authenticated': False}), 500
 
  
@@ -1693,7 +3375,20 @@ def get_current_user_from_token():
         # Extract the token
         token = auth_header.split(' ')[1]
         
-        # Check if token exists in database or validate JWT token
+        notification_listener.ensure_started()
+        
+        # Signed tokens are verified from their own claims (plus the revocation list)
+        if token.count('.') == 2:
+            claims = decode_signed_token(token)
+            if claims is None or revocation_list.is_revoked(claims):
+                return None
+            return {'id': claims['sub'], 'email': claims['email'], 'role': claims['role']}
+        
+        # Recently validated tokens skip the database entirely
+        user = token_cache.get(token)
+        if user is not None:
+            return user
+        
         conn = get_db_connection()
         if not conn:
             return None
@@ -1702,20 +3397,25 @@ def get_current_user_from_token():
         
         # Retrieve user associated with token
         cursor.execute("""
-            SELECT u.id, u.email, u.role 
+            SELECT u.id, u.email, u.role,
+                   EXTRACT(EPOCH FROM s.expires_at - NOW()) as session_remaining
             FROM users u 
             JOIN sessions s ON u.id = s.user_id 
             WHERE s.token = %s AND s.expires_at > NOW()
         """, (token,))
         
-        user = cursor.fetchone()
+        row = cursor.fetchone()
         
         cursor.close()
         conn.close()
         
+        if not row:
+            return None
+        user = {'id': row['id'], 'email': row['email'], 'role': row['role']}
+        token_cache.put(token, user, row['session_remaining'])
         return user
     except Exception as e:
-        print(f"Error getting current user: {str(e)}")
+        log.error("Error getting current user: %s", e)
         return None
 
 # GETTING USERS ENDPOINT
@@ -1801,9 +3501,7 @@ def get_users():
         })
         
     except Exception as e:
-        print(f"Error getting users: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error getting users: %s", e)
         return jsonify({
             'error': f"Error fetching users: {str(e)}",
             'users': []
@@ -1870,55 +3568,10 @@ def add_user():
             conn.close()
             return jsonify({'error': 'User with this email already exists'}), 409
         
-        # Check if users table exists, create if not
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_schema = 'public' 
-                AND table_name = 'users'
-            )
-        """)
-        table_exists = cursor.fetchone()['exists']
-        
-        if not table_exists:
-            print("Users table doesn't exist. Creating it now...")
-            cursor.execute("""
-                CREATE TABLE users (
-                    id SERIAL PRIMARY KEY,
-                    email VARCHAR(255) UNIQUE NOT NULL,
-                    password VARCHAR(255) NOT NULL,
-                    role VARCHAR(50) NOT NULL DEFAULT 'clerk',
-                    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
-                    added_by_id INTEGER REFERENCES users(id)
-                )
-            """)
-            conn.commit()
-            print("Users table created successfully")
-        else:
-            # Check if added_by_id column exists, add it if not
-            cursor.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.columns 
-                    WHERE table_schema = 'public' 
-                    AND table_name = 'users'
-                    AND column_name = 'added_by_id'
-                )
-            """)
-            column_exists = cursor.fetchone()['exists']
-            
-            if not column_exists:
-                print("Adding added_by_id column to users table...")
-                cursor.execute("""
-                    ALTER TABLE users 
-                    ADD COLUMN added_by_id INTEGER REFERENCES users(id)
-                """)
-                conn.commit()
-                print("Added added_by_id column successfully")
-        
         # Hash the password
         hashed_password = generate_password_hash(password)
         
-        print(f"Adding new user: {email} with role: {role}")
+        log.info("Adding new user: %s with role: %s", email, role)
         
         # Insert new user with added_by_id
         cursor.execute("""
@@ -1933,7 +3586,7 @@ def add_user():
         cursor.close()
         conn.close()
         
-        print(f"User {email} added successfully with ID {new_user_id}")
+        log.info("User %s added successfully with ID %s", email, new_user_id)
         
         return jsonify({
             'message': 'User created successfully',
@@ -1941,9 +3594,7 @@ def add_user():
         }), 201
         
     except Exception as e:
-        print(f"Error adding user: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error adding user: %s", e)
         return jsonify({'error': f"Error adding user: {str(e)}"}), 500
 
 
@@ -1968,25 +3619,7 @@ def migrate_added_by():
             
         cursor = conn.cursor()
         
-        # Check if added_by_id column exists
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.columns 
-                WHERE table_schema = 'public' 
-                AND table_name = 'users'
-                AND column_name = 'added_by_id'
-            )
-        """)
-        column_exists = cursor.fetchone()['exists']
-        
-        if not column_exists:
-            # Add the column
-            cursor.execute("""
-                ALTER TABLE users 
-                ADD COLUMN added_by_id INTEGER REFERENCES users(id)
-            """)
-            conn.commit()
-            
+        # added_by_id itself comes from schema migration 2 (see schema.py)
         # Get the first super_admin user
         cursor.execute("""
             SELECT id FROM users 
@@ -2022,9 +3655,7 @@ def migrate_added_by():
         })
         
     except Exception as e:
-        print(f"Error during migration: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error during migration: %s", e)
         return jsonify({'error': f"Error during migration: {str(e)}"}), 500
 
 
@@ -2108,19 +3739,6 @@ def update_user(user_id):
             params.append(role)
             
             # Create history record for role change
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS user_history (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    change_type VARCHAR(50) NOT NULL,
-                    previous_value TEXT,
-                    new_value TEXT,
-                    changed_by_id INTEGER NOT NULL,
-                    changed_by_email VARCHAR(255) NOT NULL,
-                    timestamp TIMESTAMP NOT NULL DEFAULT NOW()
-                )
-            """)
-            
             cursor.execute("""
                 INSERT INTO user_history (
                     user_id, change_type, previous_value, new_value, 
@@ -2139,19 +3757,6 @@ def update_user(user_id):
             params.append(hashed_password)
             
             # Create history record for password change (don't store the actual password)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS user_history (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    change_type VARCHAR(50) NOT NULL,
-                    previous_value TEXT,
-                    new_value TEXT,
-                    changed_by_id INTEGER NOT NULL,
-                    changed_by_email VARCHAR(255) NOT NULL,
-                    timestamp TIMESTAMP NOT NULL DEFAULT NOW()
-                )
-            """)
-            
             cursor.execute("""
                 INSERT INTO user_history (
                     user_id, change_type, previous_value, new_value, 
@@ -2171,6 +3776,10 @@ def update_user(user_id):
             query = f"UPDATE users SET {', '.join(update_parts)} WHERE id = %s"
             cursor.execute(query, params)
             
+            # Cached sessions and signed tokens of this user carry the old role/email
+            invalidate_cached_sessions(cursor, user_id=user_id)
+            revoke_signed_tokens(cursor, user_id=user_id)
+            
             conn.commit()
             cursor.close()
             conn.close()
@@ -2184,9 +3793,7 @@ def update_user(user_id):
             return jsonify({'message': 'No changes to update'})
         
     except Exception as e:
-        print(f"Error updating user: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error updating user: %s", e)
         return jsonify({'error': f"Error updating user: {str(e)}"}), 500
 
 @app.route('/api/users/<int:user_id>/history', methods=['GET'])
@@ -2214,20 +3821,6 @@ def get_user_history(user_id):
             conn.close()
             return jsonify({'error': 'User not found'}), 404
         
-        # Check if user_history table exists, create if not
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_history (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                change_type VARCHAR(50) NOT NULL,
-                previous_value TEXT,
-                new_value TEXT,
-                changed_by_id INTEGER NOT NULL,
-                changed_by_email VARCHAR(255) NOT NULL,
-                timestamp TIMESTAMP NOT NULL DEFAULT NOW()
-            )
-        """)
-        
         # Get history records
         cursor.execute("""
             SELECT id, change_type, previous_value, new_value, 
@@ -2261,9 +3854,7 @@ def get_user_history(user_id):
         })
         
     except Exception as e:
-        print(f"Error getting user history: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error getting user history: %s", e)
         return jsonify({'error': f"Error getting user history: {str(e)}"}), 500
 
 # Add a route to handle OPTIONS requests for CORS preflight
@@ -2300,16 +3891,8 @@ def get_guests():
             
         cursor = conn.cursor()
         
-        # Check if the table has the new columns
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.columns 
-                WHERE table_schema = 'public' 
-                AND table_name = 'guest_registrations'
-                AND column_name = 'id_type'
-            )
-        """)
-        has_new_columns = cursor.fetchone()['exists']
+        # Layouts from before schema migration 6 only have aadhar_number
+        has_new_columns = schema_state.has_column('guest_registrations', 'id_type')
         
         if has_new_columns:
 
@@ -2375,9 +3958,7 @@ def get_guests():
         return jsonify({'guests': guests})
         
     except Exception as e:
-        print(f"Error getting guests: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error getting guests: %s", e)
         return jsonify({
             'error': f"Error fetching guests: {str(e)}",
             'guests': []
@@ -2425,81 +4006,22 @@ def register_guest():
         # Validate ID number format based on type
         if id_type == 'aadhar' and not re.match(r'^\d{12}$', id_number):
             return jsonify({'error': 'Aadhar number must be 12 digits'}), 400
-        elif id_type == 'passport' and not re.match(r'^[A-Z0-9]{8}$', id_number, re.IGNORECASE):
-            return jsonify({'error': 'Passport number must be 8 characters'}), 400
-            
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': 'Unable to connect to database'}), 500
-            
-        cursor = conn.cursor()
-        # Check if guest_registrations table exists, create if not
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_schema = 'public' 
-                AND table_name = 'guest_registrations'
-            )
-        """)
-        table_exists = cursor.fetchone()['exists']
-        
-        if not table_exists:
-            print("Creating guest_registrations table...")
-            cursor.execute("""
-                CREATE TABLE guest_registrations (
-                    id SERIAL PRIMARY KEY,
-                    guest_id VARCHAR(255),
-                    name VARCHAR(255) NOT NULL,
-                    id_type VARCHAR(50) NOT NULL DEFAULT 'aadhar',
-                    id_number VARCHAR(50) NOT NULL,
-                    address TEXT,
-                    room_id VARCHAR(255) NOT NULL,
-                    card_ui_id VARCHAR(255) NOT NULL,
-                    checkin_time TIMESTAMP NOT NULL,
-                    checkout_time TIMESTAMP NOT NULL,
-                    registered_by INTEGER REFERENCES users(id),
-                    created_at TIMESTAMP NOT NULL DEFAULT NOW()
-                )
-            """)
-            conn.commit()
-            print("guest_registrations table created successfully")
-        else:
-            # Check if id_type column exists, add it if not
-            cursor.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.columns 
-                    WHERE table_schema = 'public' 
-                    AND table_name = 'guest_registrations'
-                    AND column_name = 'id_type'
-                )
-            """)
-            column_exists = cursor.fetchone()['exists']
+        elif id_type == 'passport' and not re.match(r'^[A-Z0-9]{8}$', id_number, re.IGNORECASE):
+            return jsonify({'error': 'Passport number must be 8 characters'}), 400
             
-            if not column_exists:
-                print("Adding id_type column to guest_registrations table...")
-                cursor.execute("""
-                    ALTER TABLE guest_registrations 
-                    ADD COLUMN id_type VARCHAR(50) NOT NULL DEFAULT 'aadhar'
-                """)
-                
-                # Rename aadhar_number to id_number
-                cursor.execute("""
-                    ALTER TABLE guest_registrations 
-                    RENAME COLUMN aadhar_number TO id_number
-                """)
-                
-                conn.commit()
-                print("Updated guest_registrations table schema")
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': 'Unable to connect to database'}), 500
+            
+        cursor = conn.cursor()
         
         # Generate guest_id if not provided
         if not guest_id:
             guest_id = f"G-{int(time.time())}"
         
-        print(f"Registering guest: {name} with ID Type: {id_type}, ID Number: {id_number}")
+        log.info("Registering guest: %s with ID Type: %s, ID Number: %s", name, id_type, id_number)
         
-        # Check if the table has been updated with the new columns
-        try:
-            # Try inserting with new column structure
+        if schema_state.has_column('guest_registrations', 'id_type'):
             cursor.execute("""
                 INSERT INTO guest_registrations (
                     guest_id, name, id_type, id_number, address, room_id, 
@@ -2511,9 +4033,8 @@ def register_guest():
                 guest_id, name, id_type, id_number, address, room_id, 
                 card_ui_id, checkin_time, checkout_time, current_user['id'], datetime.now()
             ))
-        except Exception as column_error:
-            print(f"Column error: {str(column_error)}")
-            # Fallback to old column structure
+        else:
+            # Layouts from before schema migration 6 only have aadhar_number
             cursor.execute("""
                 INSERT INTO guest_registrations (
                     guest_id, name, aadhar_number, address, room_id, 
@@ -2547,23 +4068,19 @@ def register_guest():
                 SET updated = TRUE
                 WHERE product_id = %s
             """, (product_id,))
+            mark_snapshots_dirty(cursor, guest_snapshot_products(product_id))
             
-            print(f"Marked product {product_id} as updated for room {room_id}")
+            log.info("Marked product %s as updated for room %s", product_id, room_id)
         else:
-            print(f"Warning: No product found for room {room_id}")
+            log.warning("No product found for room %s", room_id)
         
+        # Devices get the change from the MQTT change-event publisher
         conn.commit()
         
-        # Fetch updated access control data for this product and publish it to MQTT
-        if product_id:
-            access_data = fetch_access_control_data_for_product(product_id, cursor)
-            conn.commit()
-            publish_access_control_data(product_id, access_data)
-        
         cursor.close()
         conn.close()
         
-        print(f"Guest {name} registered successfully with ID {new_guest_id}")
+        log.info("Guest %s registered successfully with ID %s", name, new_guest_id)
         
         return jsonify({
             'message': 'Guest registered successfully',
@@ -2572,9 +4089,7 @@ def register_guest():
         }), 201
         
     except Exception as e:
-        print(f"Error registering guest: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error registering guest: %s", e)
         return jsonify({'error': f"Error registering guest: {str(e)}"}), 500
 
 @app.route('/api/guests/<int:guest_id>', methods=['PUT'])
@@ -2626,16 +4141,8 @@ def update_guest(guest_id):
         
         old_room_id = existing_guest['room_id']
         
-        # Check if the table has the new columns
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.columns 
-                WHERE table_schema = 'public' 
-                AND table_name = 'guest_registrations'
-                AND column_name = 'id_type'
-            )
-        """)
-        has_new_columns = cursor.fetchone()['exists']
+        # Layouts from before schema migration 6 only have aadhar_number
+        has_new_columns = schema_state.has_column('guest_registrations', 'id_type')
         
         if has_new_columns:
             # Update using new column names
@@ -2667,23 +4174,18 @@ def update_guest(guest_id):
         cursor.execute("SELECT product_id FROM productstable WHERE room_no = %s", (room_id,))
         new_product = cursor.fetchone()
         
-        # Track products that need updating
-        products_to_update = set()
-        
+        # Mark both rooms as updated
         if old_product and 'product_id' in old_product:
-            products_to_update.add(old_product['product_id'])
             mark_product_updated(old_product['product_id'])
         
         if new_product and 'product_id' in new_product:
-            products_to_update.add(new_product['product_id'])
             mark_product_updated(new_product['product_id'])
         
-        conn.commit()
+        # Guests are also listed under every VIP room
+        mark_snapshots_dirty(cursor, product_registry.vip_product_ids())
         
-        # Publish updated access control data for all affected products
-        for product_id in products_to_update:
-            access_data = fetch_access_control_data_for_product(product_id, cursor)
-            publish_access_control_data(product_id, access_data)
+        # Devices get the change from the MQTT change-event publisher
+        conn.commit()
         
         cursor.close()
         conn.close()
@@ -2691,9 +4193,7 @@ def update_guest(guest_id):
         return jsonify({'message': 'Guest updated successfully'})
         
     except Exception as e:
-        print(f"Error updating guest: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error updating guest: %s", e)
         return jsonify({'error': f"Error updating guest: {str(e)}"}), 500
 
 @app.route('/api/guests/<int:guest_id>', methods=['DELETE'])
@@ -2732,24 +4232,18 @@ def delete_guest(guest_id):
         
         # Mark the product as updated
         mark_product_updated(product_id)
+        mark_snapshots_dirty(cursor, product_registry.vip_product_ids())
         
+        # Devices get the change from the MQTT change-event publisher
         conn.commit()
         
-        # Fetch updated access control data
-        access_data = fetch_access_control_data_for_product(product_id, cursor)
-        
         cursor.close()
         conn.close()
         
-        # Publish the updated access control data to MQTT
-        publish_access_control_data(product_id, access_data)
-        
         return jsonify({'message': 'Guest deleted successfully'})
         
     except Exception as e:
-        print(f"Error deleting guest: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error deleting guest: %s", e)
         return jsonify({'error': f"Error deleting guest: {str(e)}"}), 500
 
 
@@ -2757,10 +4251,6 @@ def delete_guest(guest_id):
 def get_past_guests():
     """Get all past guest registrations (checkout time has passed)"""
     try:
-        # Get authentication token
-        auth_header = request.headers.get('Authorization')
-        print(f"Auth header received: {auth_header}")
-        
         # Get current user from session/token
         current_user = get_current_user_from_token()
         if not current_user:
@@ -2775,16 +4265,8 @@ def get_past_guests():
             
         cursor = conn.cursor()
         
-        # Check if the table has the new columns
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.columns 
-                WHERE table_schema = 'public' 
-                AND table_name = 'guest_registrations'
-                AND column_name = 'id_type'
-            )
-        """)
-        has_new_columns = cursor.fetchone()['exists']
+        # Layouts from before schema migration 6 only have aadhar_number
+        has_new_columns = schema_state.has_column('guest_registrations', 'id_type')
         
         if has_new_columns:
             # Query using new column names for past guests only
@@ -2865,9 +4347,7 @@ def get_past_guests():
         })
         
     except Exception as e:
-        print(f"Error getting past guests: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error getting past guests: %s", e)
         return jsonify({
             'success': False,
             'error': f"Error fetching past guests: {str(e)}",
@@ -2894,23 +4374,6 @@ def get_help_messages():
             
         cursor = conn.cursor()
         
-        # Ensure table exists
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS help_messages (
-                id SERIAL PRIMARY KEY,
-                sender VARCHAR(255) NOT NULL,
-                sender_role VARCHAR(50) NOT NULL,
-                recipient VARCHAR(255) NOT NULL,
-                recipient_role VARCHAR(50) NOT NULL,
-                subject TEXT NOT NULL,
-                message TEXT NOT NULL,
-                priority VARCHAR(50) NOT NULL DEFAULT 'normal',
-                timestamp TIMESTAMP NOT NULL DEFAULT NOW(),
-                is_read BOOLEAN NOT NULL DEFAULT FALSE
-            )
-        """)
-        conn.commit()
-        
         # Different query based on role
         if current_user['role'] == 'admin':
             cursor.execute("""
@@ -2968,9 +4431,7 @@ def get_help_messages():
         })
         
     except Exception as e:
-        print(f"Error getting help messages: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error getting help messages: %s", e)
         return jsonify({'error': f"Error fetching messages: {str(e)}"}), 500
 
 
@@ -3023,22 +4484,6 @@ def send_help_message():
             conn.close()
             return jsonify({'error': 'Clerks can only message admins or managers'}), 403
             
-        # Ensure table exists
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS help_messages (
-                id SERIAL PRIMARY KEY,
-                sender VARCHAR(255) NOT NULL,
-                sender_role VARCHAR(50) NOT NULL,
-                recipient VARCHAR(255) NOT NULL,
-                recipient_role VARCHAR(50) NOT NULL,
-                subject TEXT NOT NULL,
-                message TEXT NOT NULL,
-                priority VARCHAR(50) NOT NULL DEFAULT 'normal',
-                timestamp TIMESTAMP NOT NULL DEFAULT NOW(),
-                is_read BOOLEAN NOT NULL DEFAULT FALSE
-            )
-        """)
-        
         # Insert new message
         cursor.execute("""
             INSERT INTO help_messages 
@@ -3059,9 +4504,7 @@ def send_help_message():
         })
         
     except Exception as e:
-        print(f"Error sending help message: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error sending help message: %s", e)
         return jsonify({'error': f"Error sending message: {str(e)}"}), 500
     
 
@@ -3123,9 +4566,7 @@ def get_helpdesk_recipients():
         })
         
     except Exception as e:
-        print(f"Error getting helpdesk recipients: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error getting helpdesk recipients: %s", e)
         return jsonify({'error': f"Error fetching recipients: {str(e)}"}), 500
     
 
@@ -3210,9 +4651,7 @@ def update_message_status(message_id):
         })
         
     except Exception as e:
-        print(f"Error updating message status: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error updating message status: %s", e)
         return jsonify({'error': f"Error updating status: {str(e)}"}), 500
 
 
@@ -3267,7 +4706,7 @@ def get_card_packages():
                         })
                     except AttributeError:
                         # Print debug info about the row
-                        print(f"Debug - row type: {type(row)}, content: {row}")
+                        log.debug("Debug - row type: %s, content: %s", type(row), row)
                         raise
         
         cursor.close()
@@ -3278,9 +4717,7 @@ def get_card_packages():
         })
         
     except Exception as e:
-        import traceback
-        print("Error in get_card_packages API:")
-        print(traceback.format_exc())
+        log.exception("Error in get_card_packages API")
         
         return jsonify({
             'error': f"Error fetching card packages: {str(e)}"
@@ -3326,33 +4763,25 @@ def add_card_package():
         """, (product_id, uid, package_type))
         
         # Mark the product as updated if specified
-        affected_products = []
         if product_id:
             mark_product_updated(product_id)
-            affected_products.append(product_id)
             
         # Also mark all other products this UID has access to
         cursor.execute("""
-            SELECT DISTINCT product_id
-            FROM access_requests
-            WHERE uid = %s AND product_id != %s
+            SELECT product_id
+            FROM card_assignments
+            WHERE uid = %s AND product_id <> '' AND product_id != %s
         """, (uid, product_id if product_id else ''))
         
         for row in cursor.fetchall():
             if row['product_id']:
                 mark_product_updated(row['product_id'])
-                affected_products.append(row['product_id'])
         
-        # Commit changes
-        conn.commit()
+        # A package change can move the card in or out of any VIP room
+        mark_snapshots_dirty(cursor, None)
         
-        # Publish updates to MQTT for all affected products
-        for prod_id in affected_products:
-            # Fetch updated access control data
-            access_data = fetch_access_control_data_for_product(prod_id)
-            
-            # Publish to MQTT
-            publish_access_control_data(prod_id, access_data)
+        # Commit changes; devices get them from the MQTT change-event publisher
+        conn.commit()
         
         cursor.close()
         conn.close()
@@ -3366,9 +4795,7 @@ def add_card_package():
         if conn:
             conn.rollback()
         
-        import traceback
-        print("Error in add_card_package API:")
-        print(traceback.format_exc())
+        log.exception("Error in add_card_package API")
         
         return jsonify({
             'error': f"Error updating card package: {str(e)}"
@@ -3460,7 +4887,6 @@ def update_card_package(package_id):
         # Update each affected product and publish changes
         for prod_id in products_to_update:
             mark_product_updated(prod_id)
-            access_data = fetch_access_control_data_for_product(prod_id, cursor)
             # Will publish after commit
             
         # If UID changed, update all products associated with either old or new UID
@@ -3489,13 +4915,11 @@ def update_card_package(package_id):
                     products_to_update.add(prod_id)
                     mark_product_updated(prod_id)
         
-        # Commit changes
-        conn.commit()
+        # A package change can move the card in or out of any VIP room
+        mark_snapshots_dirty(cursor, None)
         
-        # Now publish updates for all affected products
-        for prod_id in products_to_update:
-            access_data = fetch_access_control_data_for_product(prod_id)
-            publish_access_control_data(prod_id, access_data)
+        # Commit changes; devices get them from the MQTT change-event publisher
+        conn.commit()
         
         cursor.close()
         conn.close()
@@ -3509,9 +4933,7 @@ def update_card_package(package_id):
         if conn:
             conn.rollback()
         
-        import traceback
-        print("Error in update_card_package API:")
-        print(traceback.format_exc())
+        log.exception("Error in update_card_package API")
         
         return jsonify({
             'error': f"Error updating card package: {str(e)}"
@@ -3552,19 +4974,16 @@ def delete_card_package(package_id):
         # Mark the product as updated
         if product_id:
             mark_product_updated(product_id)
-            
-            # Fetch updated access control data for this product
-            access_data = fetch_access_control_data_for_product(product_id, cursor)
         
-        # Commit changes
+        # A package change can move the card in or out of any VIP room
+        mark_snapshots_dirty(cursor, None)
+        
+        # Commit changes; devices get them from the MQTT change-event publisher
         conn.commit()
+        
         cursor.close()
         conn.close()
         
-        # Publish the updated access control data to MQTT
-        if product_id:
-            publish_access_control_data(product_id, access_data)
-        
         return jsonify({
             'success': "Card package deleted successfully!"
         })
@@ -3574,9 +4993,7 @@ def delete_card_package(package_id):
         if conn:
             conn.rollback()
         
-        import traceback
-        print("Error in delete_card_package API:")
-        print(traceback.format_exc())
+        log.exception("Error in delete_card_package API")
         
         return jsonify({
             'error': f"Error deleting card package: {str(e)}"
@@ -3663,9 +5080,7 @@ def get_access_matrix():
         })
         
     except Exception as e:
-        import traceback
-        print("Error in get_access_matrix API:")
-        print(traceback.format_exc())
+        log.exception("Error in get_access_matrix API")
         
         return jsonify({
             'error': f"Error fetching access matrix: {str(e)}"
@@ -3684,7 +5099,7 @@ def update_access_matrix():
             return jsonify({'error': "No matrix data provided"}), 400
         
         matrix = data['matrix']
-        print(f"Received matrix data: {json.dumps(matrix, indent=2)}")
+        log.debug("Received matrix data: %s", json.dumps(matrix, indent=2))
         
         # Use a simple approach with autocommit enabled
         conn = get_db_connection()
@@ -3709,14 +5124,14 @@ def update_access_matrix():
             
             current_matrix[package_type][facility] = has_access
         
-        print(f"Current matrix in DB: {json.dumps(current_matrix, indent=2)}")
+        log.debug("Current matrix in DB: %s", json.dumps(current_matrix, indent=2))
         
         updated_facilities = set()
         
         # Process each update individually
         for package_type, facilities in matrix.items():
             for facility, has_access in facilities.items():
-                print(f"Processing: {package_type} -> {facility} -> {has_access}")
+                log.debug("Processing: %s -> %s -> %s", package_type, facility, has_access)
                 
                 # Check if record exists
                 cursor.execute("""
@@ -3730,7 +5145,7 @@ def update_access_matrix():
                     # Record exists, update it
                     current_access = result['has_access']
                     if current_access != has_access:
-                        print(f"Updating: {package_type}, {facility}: {current_access} -> {has_access}")
+                        log.debug("Updating: %s, %s: %s -> %s", package_type, facility, current_access, has_access)
                         cursor.execute("""
                             UPDATE access_matrix 
                             SET has_access = %s 
@@ -3738,31 +5153,32 @@ def update_access_matrix():
                         """, (has_access, package_type, facility))
                         updated_facilities.add(facility)
                     else:
-                        print(f"No change needed for: {package_type}, {facility}")
+                        log.debug("No change needed for: %s, %s", package_type, facility)
                 else:
                     # Record doesn't exist, insert it
-                    print(f"Inserting new record: {package_type}, {facility}, {has_access}")
+                    log.debug("Inserting new record: %s, %s, %s", package_type, facility, has_access)
                     cursor.execute("""
                         INSERT INTO access_matrix (package_type, facility, has_access)
                         VALUES (%s, %s, %s)
                     """, (package_type, facility, has_access))
                     updated_facilities.add(facility)
         
-        print("All database changes completed successfully")
+        log.info("All database changes completed successfully")
         
         # Handle MQTT updates
         if updated_facilities:
-            print(f"Updating facilities via MQTT: {updated_facilities}")
+            log.info("Updating facilities via MQTT: %s", updated_facilities)
             for facility in updated_facilities:
                 try:
-                    cursor.execute("SELECT product_id FROM vip_rooms WHERE vip_rooms = %s", (facility,))
-                    result = cursor.fetchone()
-                    if result:
-                        product_id = result['product_id']
+                    product_id = product_registry.vip_product_id(facility)
+                    if product_id:
                         mark_product_updated(product_id)
-                        print(f"Marked product {product_id} as updated for facility {facility}")
+                        log.info("Marked product %s as updated for facility %s", product_id, facility)
                 except Exception as mqtt_error:
-                    print(f"Warning: Could not update MQTT for facility {facility}: {mqtt_error}")
+                    log.warning("Could not update MQTT for facility %s: %s", facility, mqtt_error)
+            
+            # Guest access_rooms in every product depend on the matrix
+            mark_snapshots_dirty(cursor, None)
         
         cursor.close()
         conn.close()
@@ -3770,9 +5186,7 @@ def update_access_matrix():
         return jsonify({'success': "Access matrix updated successfully!"})
         
     except Exception as e:
-        print(f"Error in update_access_matrix: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error in update_access_matrix: %s", e)
         
         # Clean up connections
         try:
@@ -3817,9 +5231,7 @@ def get_vip_rooms():
     
     except Exception as e:
         # Comprehensive error logging
-        import traceback
-        print("Detailed error in get_vip_rooms route:")
-        print(traceback.format_exc())
+        log.exception("Detailed error in get_vip_rooms route")
         
         if conn:
             conn.close()
@@ -3895,6 +5307,8 @@ def add_vip_room():
         
         # Commit changes
         conn.commit()
+        product_registry.invalidate(notify_conn=conn)
+        snapshot_cache.mark_all_dirty()
         
         cursor.close()
         conn.close()
@@ -3912,9 +5326,7 @@ def add_vip_room():
         if conn:
             conn.rollback()
         
-        import traceback
-        print("Error in add_vip_room API:")
-        print(traceback.format_exc())
+        log.exception("Error in add_vip_room API")
         
         return jsonify({
             'error': f"Error adding VIP Room: {str(e)}"
@@ -3952,6 +5364,8 @@ def delete_vip_room(product_id):
         
         # Commit changes
         conn.commit()
+        product_registry.invalidate(notify_conn=conn)
+        snapshot_cache.mark_all_dirty()
         
         cursor.close()
         conn.close()
@@ -3965,9 +5379,7 @@ def delete_vip_room(product_id):
         if conn:
             conn.rollback()
         
-        import traceback
-        print("Error in delete_vip_room API:")
-        print(traceback.format_exc())
+        log.exception("Error in delete_vip_room API")
         
         return jsonify({
             'error': f"Error deleting VIP Room: {str(e)}"
@@ -3999,6 +5411,8 @@ HEALTH_HISTORY_DIR = 'health_history'
 # Store health data per room ID
 latest_health_data = {}
 health_history = {}
+health_data_lock = threading.Lock()
+ota_status = {}  # room_id -> latest OTA progress report from the device
 MAX_HISTORY_ENTRIES = 50 
 
 # Ensure directories exist
@@ -4009,7 +5423,7 @@ def ensure_directories():
         if not os.path.exists(HEALTH_HISTORY_DIR):
             os.makedirs(HEALTH_HISTORY_DIR)
     except Exception as e:
-        print(f"Error creating directories: {e}")
+        log.error("Error creating directories: %s", e)
 
 # Load data from disk at startup
 def load_health_data():
@@ -4025,7 +5439,7 @@ def load_health_data():
                     file_path = os.path.join(HEALTH_DATA_DIR, filename)
                     with open(file_path, 'r') as f:
                         latest_health_data[room_id] = json.load(f)
-                        print(f"Loaded health data for room {room_id}")
+                        log.debug("Loaded health data for room %s", room_id)
 
         # Load history data for each room
         if os.path.exists(HEALTH_HISTORY_DIR):
@@ -4035,10 +5449,10 @@ def load_health_data():
                     file_path = os.path.join(HEALTH_HISTORY_DIR, filename)
                     with open(file_path, 'r') as f:
                         health_history[room_id] = json.load(f)
-                        print(f"Loaded {len(health_history[room_id])} history entries for room {room_id}")
+                        log.debug("Loaded %s history entries for room %s", len(health_history[room_id]), room_id)
 
     except Exception as e:
-        print(f"Error loading health data from disk: {e}")
+        log.error("Error loading health data from disk: %s", e)
 
 # Save data to disk
 def save_health_data(room_id):
@@ -4048,7 +5462,7 @@ def save_health_data(room_id):
         with open(file_path, 'w') as f:
             json.dump(latest_health_data[room_id], f)
     except Exception as e:
-        print(f"Error saving health data for {room_id}: {e}")
+        log.error("Error saving health data for %s: %s", room_id, e)
 
 def save_health_history(room_id):
     try:
@@ -4057,7 +5471,7 @@ def save_health_history(room_id):
         with open(file_path, 'w') as f:
             json.dump(health_history[room_id], f)
     except Exception as e:
-        print(f"Error saving health history for {room_id}: {e}")
+        log.error("Error saving health history for %s: %s", room_id, e)
 
 # Load data at application startup
 load_health_data()
@@ -4068,6 +5482,101 @@ load_health_data()
 
 
 
+def record_health_report(data):
+    """
+    Validate and store a health report from a hardware device.
+
+    Shared by POST /api/system_health and MQTT /RFID/health/{room}.
+
+    Returns:
+        tuple: (response dict, HTTP status code)
+    """
+    global latest_health_data, health_history
+
+    room_id = None
+    
+    # Check if it's a regular room submission
+    if "room_id" in data:
+        room_id = data["room_id"]
+        log.debug("Processing health data for regular room: %s", room_id)
+    
+    # Check if it's a VIP room submission
+    elif "vip_rooms" in data:
+        vip_room_name = data["vip_rooms"]
+        log.debug("Processing health data for VIP room: %s", vip_room_name)
+        
+        # Look up the product_id for this VIP room name
+        try:
+            result = product_registry.vip_product_id(vip_room_name)
+            
+            if result:
+                room_id = result
+                log.debug("Mapped VIP room '%s' to product_id '%s'", vip_room_name, room_id)
+                
+                # Replace vip_rooms with room_id in the data for storage
+                data.pop("vip_rooms")
+                data["room_id"] = room_id
+                data["vip_room_name"] = vip_room_name  # Store the original name for reference
+            else:
+                return {
+                    "error": f"No VIP room found with name '{vip_room_name}'",
+                    "vip_room": vip_room_name
+                }, 404
+        except Exception as e:
+            log.error("Error looking up VIP room: %s", e)
+            return {"error": f"Error looking up VIP room: {e}"}, 500
+    
+    # Validate the incoming data structure and the room_id
+    if room_id and "system_health" in data and all(key in data["system_health"] for key in ["rtc", "wifi", "internet", "ota"]):
+        # Add timestamp for this update
+        timestamp = datetime.now().isoformat()
+        data_with_timestamp = {
+            "timestamp": timestamp,
+            **data  # Include all the original data
+        }
+        
+        # HTTP requests and MQTT handler workers can report concurrently
+        with health_data_lock:
+            # Initialize history for this room if it doesn't exist
+            if room_id not in health_history:
+                health_history[room_id] = []
+            
+            # Store in history
+            health_history[room_id].append(data_with_timestamp)
+            # Keep only the latest MAX_HISTORY_ENTRIES entries
+            health_history[room_id] = health_history[room_id][-MAX_HISTORY_ENTRIES:]
+            # Save history to disk
+            save_health_history(room_id)
+            
+            # Update latest health data
+            latest_health_data[room_id] = data
+            # Save data to disk
+            save_health_data(room_id)
+        
+        log.info("Health data updated successfully for room %s and saved to disk.", room_id)
+        return {"message": "Health data received and updated"}, 200
+    else:
+        log.warning("Received invalid health data format.")
+        return {"error": "Invalid data format. Requires either 'room_id' or 'vip_rooms', and 'system_health' with 'rtc', 'wifi', 'internet', 'ota'."}, 400
+
+
+def handle_mqtt_health_report(room, payload):
+    """MQTT /RFID/health/{room}: the topic level names the room when the payload does not"""
+    if not isinstance(payload, dict):
+        raise ValueError("Health report must be a JSON object")
+    if "room_id" not in payload and "vip_rooms" not in payload:
+        payload["room_id"] = room
+    payload.pop("reply_to", None)
+
+    body, status = record_health_report(payload)
+    if status != 200:
+        raise ValueError(body.get("error"))
+    return body
+
+
+mqtt_router.route("/RFID/health/+", handle_mqtt_health_report)
+
+
 @app.route('/api/system_health', methods=['GET', 'POST'])
 def system_health():
     """
@@ -4075,88 +5584,17 @@ def system_health():
     - GET request: Returns health status for a specific room_id or vip_room
     - POST request: Receives health status data from a hardware device and stores it
     """
-    global latest_health_data, health_history
-
     if request.method == 'POST':
         try:
             # Get the JSON data sent by the hardware device
             data = request.get_json()
-            print(f"Received health update from device: {json.dumps(data, indent=2)}")
+            log.debug("Received health update from device: %s", json.dumps(data, indent=2))
 
-            room_id = None
-            
-            # Check if it's a regular room submission
-            if "room_id" in data:
-                room_id = data["room_id"]
-                print(f"Processing health data for regular room: {room_id}")
-            
-            # Check if it's a VIP room submission
-            elif "vip_rooms" in data:
-                vip_room_name = data["vip_rooms"]
-                print(f"Processing health data for VIP room: {vip_room_name}")
-                
-                # Look up the product_id for this VIP room name
-                try:
-                    conn = get_db_connection()
-                    if not conn:
-                        return jsonify({"error": "Database connection failed"}), 500
-                        
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT product_id FROM vip_rooms WHERE vip_rooms = %s", (vip_room_name,))
-                    result = cursor.fetchone()
-                    cursor.close()
-                    conn.close()
-                    
-                    if result:
-                        room_id = result['product_id']
-                        print(f"Mapped VIP room '{vip_room_name}' to product_id '{room_id}'")
-                        
-                        # Replace vip_rooms with room_id in the data for storage
-                        data.pop("vip_rooms")
-                        data["room_id"] = room_id
-                        data["vip_room_name"] = vip_room_name  # Store the original name for reference
-                    else:
-                        return jsonify({
-                            "error": f"No VIP room found with name '{vip_room_name}'",
-                            "vip_room": vip_room_name
-                        }), 404
-                except Exception as e:
-                    print(f"Error looking up VIP room: {e}")
-                    return jsonify({"error": f"Error looking up VIP room: {e}"}), 500
-            
-            # Validate the incoming data structure and the room_id
-            if room_id and "system_health" in data and all(key in data["system_health"] for key in ["rtc", "wifi", "internet", "ota"]):
-                # Add timestamp for this update
-                timestamp = datetime.now().isoformat()
-                data_with_timestamp = {
-                    "timestamp": timestamp,
-                    **data  # Include all the original data
-                }
-                
-                # Initialize history for this room if it doesn't exist
-                if room_id not in health_history:
-                    health_history[room_id] = []
-                
-                # Store in history
-                health_history[room_id].append(data_with_timestamp)
-                # Keep only the latest MAX_HISTORY_ENTRIES entries
-                health_history[room_id] = health_history[room_id][-MAX_HISTORY_ENTRIES:]
-                # Save history to disk
-                save_health_history(room_id)
-                
-                # Update latest health data
-                latest_health_data[room_id] = data
-                # Save data to disk
-                save_health_data(room_id)
-                
-                print(f"Health data updated successfully for room {room_id} and saved to disk.")
-                return jsonify({"message": "Health data received and updated"}), 200
-            else:
-                print("Received invalid health data format.")
-                return jsonify({"error": "Invalid data format. Requires either 'room_id' or 'vip_rooms', and 'system_health' with 'rtc', 'wifi', 'internet', 'ota'."}), 400
+            body, status = record_health_report(data)
+            return jsonify(body), status
 
         except Exception as e:
-            print(f"Error processing health update from device: {e}")
+            log.error("Error processing health update from device: %s", e)
             return jsonify({"error": f"Internal server error: {e}"}), 500
 
     # GET request handling remains the same - already supports both room_id and vip_room parameters
@@ -4168,29 +5606,21 @@ def system_health():
         # Use product_id from vip_rooms table if vip_room parameter is provided
         if vip_room and not room_id:
             try:
-                conn = get_db_connection()
-                if not conn:
-                    return jsonify({"error": "Database connection failed"}), 500
-                    
-                cursor = conn.cursor()
-                cursor.execute("SELECT product_id FROM vip_rooms WHERE vip_rooms = %s", (vip_room,))
-                result = cursor.fetchone()
-                cursor.close()
-                conn.close()
+                result = product_registry.vip_product_id(vip_room)
                 
                 if result:
-                    room_id = result['product_id']
-                    print(f"Mapped VIP room '{vip_room}' to product_id '{room_id}'")
+                    room_id = result
+                    log.debug("Mapped VIP room '%s' to product_id '%s'", vip_room, room_id)
                 else:
                     return jsonify({
                         "error": f"No VIP room found with name '{vip_room}'",
                         "vip_room": vip_room
                     }), 404
             except Exception as e:
-                print(f"Error looking up VIP room: {e}")
+                log.error("Error looking up VIP room: %s", e)
                 return jsonify({"error": f"Error looking up VIP room: {e}"}), 500
         
-        print(f"GET request for /api/system_health with room_id={room_id}")
+        log.debug("GET request for /api/system_health with room_id=%s", room_id)
         
         if not room_id:
             return jsonify({"error": "Missing room_id or vip_room parameter"}), 400
@@ -4225,19 +5655,11 @@ def system_health_history():
     # Use product_id from vip_rooms table if vip_room parameter is provided
     if vip_room and not room_id:
         try:
-            conn = get_db_connection()
-            if not conn:
-                return jsonify({"error": "Database connection failed"}), 500
-                
-            cursor = conn.cursor()
-            cursor.execute("SELECT product_id FROM vip_rooms WHERE vip_rooms = %s", (vip_room,))
-            result = cursor.fetchone()
-            cursor.close()
-            conn.close()
+            result = product_registry.vip_product_id(vip_room)
             
             if result:
-                room_id = result['product_id']
-                print(f"Mapped VIP room '{vip_room}' to product_id '{room_id}'")
+                room_id = result
+                log.debug("Mapped VIP room '%s' to product_id '%s'", vip_room, room_id)
             else:
                 return jsonify({
                     "error": f"No VIP room found with name '{vip_room}'",
@@ -4245,10 +5667,10 @@ def system_health_history():
                     "history": []
                 }), 404
         except Exception as e:
-            print(f"Error looking up VIP room: {e}")
+            log.error("Error looking up VIP room: %s", e)
             return jsonify({"error": f"Error looking up VIP room: {e}", "history": []}), 500
     
-    print(f"GET request for /api/system_health/history with room_id={room_id}")
+    log.debug("GET request for /api/system_health/history with room_id=%s", room_id)
     
     if not room_id:
         return jsonify({"error": "Missing room_id or vip_room parameter"}), 400
@@ -4281,7 +5703,7 @@ def all_system_health_history():
     """
     API Endpoint to retrieve historical system health data for all rooms.
     """
-    print(f"GET request for /system_health/history/all")
+    log.debug("GET request for /system_health/history/all")
     
     # Optional: Allow limiting the number of entries returned per room
     limit = request.args.get('limit', default=50, type=int)
@@ -4328,7 +5750,7 @@ def get_ota_details():
     Returns product version, firmware version, and update URL in JSON format.
     """
     room_id = request.args.get('room_id') # Expect room_id as a query parameter
-    print(f"Received GET request for /ota with room_id={room_id}")
+    log.debug("Received GET request for /ota with room_id=%s", room_id)
 
     ota_details = {
         "product_version": "Unknown", # This would typically come from the device or a config
@@ -4350,8 +5772,23 @@ def get_ota_details():
         # Otherwise, "v1.0" or similar is a placeholder for a generic product version
         ota_details["product_version"] = health_info.get("product_version", ota_details["product_version"])
 
+    if room_id in ota_status:
+        ota_details["update_status"] = ota_status[room_id]
+
     return jsonify(ota_details)
 
+
+def handle_mqtt_ota_status(room_id, payload):
+    """MQTT /RFID/ota_status/{room_id}: update progress reported by the device"""
+    if not isinstance(payload, dict):
+        payload = {"status": payload}
+    payload.pop("reply_to", None)
+    ota_status[room_id] = dict(payload, timestamp=datetime.now().isoformat())
+    log.info("OTA status for room %s: %s", room_id, payload.get('status'))
+
+
+mqtt_router.route("/RFID/ota_status/+", handle_mqtt_ota_status)
+
 @app.route('/api/initiate_ota_update', methods=['POST'])
 def initiate_ota_update():
     """
@@ -4369,7 +5806,7 @@ def initiate_ota_update():
         # In a real application, you would send a command to the device
         # identified by room_id to initiate the OTA update using update_url.
         # For now, we'll just log it.
-        print(f"Initiating OTA update for room {room_id} with URL: {update_url}")
+        log.info("Initiating OTA update for room %s with URL: %s", room_id, update_url)
 
         # You might want to store this OTA request or push it to a queue
         # for a device management system to pick up.
@@ -4377,293 +5814,98 @@ def initiate_ota_update():
         return jsonify({"message": f"OTA update initiated for room {room_id}"}), 200
 
     except Exception as e:
-        print(f"Error initiating OTA update: {e}")
+        log.error("Error initiating OTA update: %s", e)
         return jsonify({"error": f"Internal server error: {e}"}), 500
 
 
 
 # # # good handling duplicates
 
+def mark_snapshot_served(product_id):
+    """Clear a product's updated flag once its device holds the current version"""
+    conn = get_db_connection()
+    if not conn:
+        raise psycopg2.OperationalError("Unable to connect to database")
+    cursor = conn.cursor()
+    cursor.execute("UPDATE productstable SET updated = FALSE WHERE product_id = %s", (product_id,))
+    cursor.execute("UPDATE vip_rooms SET updated = FALSE WHERE product_id = %s", (product_id,))
+    conn.commit()
+    cursor.close()
+    conn.close()
+    snapshot_cache.mark_served(product_id)
+
+
 @app.route('/api/access_control_data', methods=['GET'])
 def get_access_control_data():
+    """
+    Access control data for one product (or all products).
+
+    With product_id the response carries the snapshot version as its ETag:
+    - If-None-Match with the current version (or since_version equal to it)
+      answers 304 Not Modified
+    - ?since_version=N answers only the cards and guests added or removed
+      since N, or the full document if N is no longer known
+    """
     try:
         requested_product_id = request.args.get('product_id')
-        print(f"Access control data requested, product_id: {requested_product_id}")
-
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': 'Unable to connect to database'}), 500
-
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
-        response_data = {
-            "cards": [],
-            "products": []
-        }
-
-        # 1. Master and Service Cards - ONLY ACTIVE ONES
-        cursor.execute("""
-            SELECT cp.uid, cp.package_type as type
-            FROM card_packages cp
-            JOIN access_requests ar ON cp.uid = ar.uid
-            WHERE cp.package_type IN ('Master Card', 'Service Card')
-            AND ar.active = TRUE
-            GROUP BY cp.uid, cp.package_type
-        """)
-
-        special_cards = cursor.fetchall()
-        for card in special_cards:
-            response_data['cards'].append({
-                "uid": card['uid'],
-                "type": card['type'],
-                "access_rooms": ["all"],
-                "active": True
-            })
-
-        # 2. Access Matrix
-        cursor.execute("SELECT package_type, facility, has_access FROM access_matrix")
-        package_access = {}
-        for row in cursor.fetchall():
-            pkg_type = row['package_type']
-            facility = row['facility']
-            has_access = row['has_access']
-            package_access.setdefault(pkg_type, {})[facility] = has_access
+        since_version = request.args.get('since_version')
+        log.info("Access control data requested, product_id: %s", requested_product_id)
 
-        # 3. VIP Room Mappings
-        cursor.execute("SELECT product_id, vip_rooms FROM vip_rooms")
-        vip_product_to_facility = {}
-        facility_to_product = {}
-        for row in cursor.fetchall():
-            vip_product_to_facility[row['product_id']] = row['vip_rooms']
-            facility_to_product[row['vip_rooms']] = row['product_id']
-
-        # 4. Get all cards data and create unique card details
-        cursor.execute("""
-            SELECT ar.uid, ar.product_id, COALESCE(cp.package_type, 'General') as type, ar.active
-            FROM access_requests ar
-            LEFT JOIN card_packages cp ON ar.uid = cp.uid AND ar.product_id = cp.product_id
-        """)
+        if since_version is not None:
+            try:
+                since_version = int(since_version)
+            except ValueError:
+                return jsonify({'error': 'since_version must be an integer'}), 400
 
-        all_cards_data = cursor.fetchall()
-        card_details = {}  # Map UID to details (avoiding duplicates by UID)
-        product_cards = {}  # Map product_id to set of card UIDs (to avoid duplicates)
-        
-        for card in all_cards_data:
-            uid = card['uid']
-            product_id = card['product_id']
-            card_type = card['type']
-            
-            # Store unique card details by UID
-            if uid not in card_details:
-                card_details[uid] = {
-                    'uid': uid,
-                    'type': card_type,
-                    'active': card['active']
-                }
+        if requested_product_id:
+            # Served from the per-product cache; rebuilt only when the product is dirty
+            entry = get_product_snapshot(requested_product_id)
+            if entry is None:
+                return jsonify({"cards": [], "products": []})
+
+            version = entry['version']
+            if request.if_none_match.contains(str(version)) or since_version == version:
+                if entry['updated']:
+                    mark_snapshot_served(requested_product_id)
+                response = app.response_class(status=304)
+                response.set_etag(str(version))
+                return response
+
+            delta = snapshot_cache.delta(entry, since_version) if since_version is not None else None
+            if delta is not None:
+                response_data = dict(delta, delta=True)
             else:
-                # Update with more specific package type if available
-                if card_type != 'General' and card_details[uid]['type'] == 'General':
-                    card_details[uid]['type'] = card_type
-            
-            # Use set to track unique UIDs per product
-            if product_id not in product_cards:
-                product_cards[product_id] = set()
-            product_cards[product_id].add(uid)
-
-        # 5. Handle VIP room access based on access matrix
-        for facility, vip_product_id in facility_to_product.items():
-            if vip_product_id not in product_cards:
-                product_cards[vip_product_id] = set()
-                
-            # Add Master and Service cards to VIP rooms automatically
-            for uid, card_info in card_details.items():
-                card_type = card_info['type']
-                
-                # Only Master Card and Service Card have universal access
-                if card_type in ['Master Card', 'Service Card']:
-                    product_cards[vip_product_id].add(uid)
-                # Regular package types (including General) - check access matrix
-                else:
-                    if card_type in package_access and facility in package_access[card_type] and package_access[card_type][facility]:
-                        product_cards[vip_product_id].add(uid)
-
-        # 6. Active Guests
-        cursor.execute("""
-            SELECT g.id, g.name, g.card_ui_id as uid, g.room_id,
-                   g.checkin_time as checkin, g.checkout_time as checkout,
-                   p.product_id
-            FROM guest_registrations g
-            JOIN productstable p ON g.room_id = p.room_no
-            WHERE NOW() BETWEEN g.checkin_time AND g.checkout_time
-              AND g.checkout_time > NOW()
-        """)
+                response_data = SnapshotCache.render(entry)
+                response_data['version'] = version
 
-        all_guests = cursor.fetchall()
-        guests_with_packages = []
-        for guest in all_guests:
-            guest_dict = dict(guest)
-            card_uid = guest_dict['uid']
-            cursor.execute("""
-                SELECT cp.package_type 
-                FROM card_packages cp 
-                JOIN access_requests ar ON cp.uid = ar.uid
-                WHERE cp.uid = %s AND ar.active = TRUE
-                LIMIT 1
-            """, (card_uid,))
-            pkg_result = cursor.fetchone()
-            package_type = pkg_result['package_type'] if pkg_result else 'General'
-
-            # Only add active guest cards
-            cursor.execute("""
-                SELECT active FROM access_requests 
-                WHERE uid = %s AND product_id = %s
-            """, (card_uid, guest_dict['product_id']))
-            card_status = cursor.fetchone()
-            if not card_status or not card_status['active']:
-                continue
-
-            access_rooms = [guest_dict['product_id']]
-            if package_type in package_access:
-                for facility, has_access in package_access[package_type].items():
-                    if has_access and facility in facility_to_product:
-                        access_rooms.append(facility_to_product[facility])
-
-            guests_with_packages.append({
-                "name": guest_dict['name'],
-                "uid": card_uid,
-                "checkin": guest_dict['checkin'].strftime('%Y-%m-%d %H:%M:%S'),
-                "checkout": guest_dict['checkout'].strftime('%Y-%m-%d %H:%M:%S'),
-                "package_type": package_type,
-                "access_rooms": access_rooms
-            })
+            if entry['updated']:
+                # The device has now seen this product's data
+                mark_snapshot_served(requested_product_id)
 
-        guests_by_product = {}
-        for guest in guests_with_packages:
-            for pid in guest['access_rooms']:
-                guests_by_product.setdefault(pid, []).append(guest)
-
-        # 7. Add guest cards (only active ones) - avoid duplicates
-        existing_uids = {card['uid'] for card in response_data['cards']}
-        for guest in guests_with_packages:
-            if guest['uid'] not in existing_uids:
-                response_data['cards'].append({
-                    "uid": guest['uid'],
-                    "type": guest['package_type'],
-                    "active": True,
-                    "access_rooms": guest['access_rooms']
-                })
-                existing_uids.add(guest['uid'])  # Track this UID as added
+            response = jsonify(response_data)
+            response.set_etag(str(version))
+            return response
 
-        # 8. Build final response
-        if requested_product_id:
-            # Handle single product request
-            cursor.execute("SELECT product_id, room_no, COALESCE(updated, FALSE) as updated FROM productstable WHERE product_id = %s", (requested_product_id,))
-            result = cursor.fetchone()
-            if result:
-                # Convert set to list of card objects
-                cards_list = []
-                if result['product_id'] in product_cards:
-                    for uid in product_cards[result['product_id']]:
-                        if uid in card_details:
-                            cards_list.append(card_details[uid])
-                
-                product_data = {
-                    "product_id": result['product_id'], 
-                    "updated": result['updated'],
-                    "cards": cards_list
-                }
-                
-                if result['product_id'] in guests_by_product:
-                    product_data['guests'] = guests_by_product[result['product_id']]
-                    
-                response_data['products'].append(product_data)
-                cursor.execute("UPDATE productstable SET updated = FALSE WHERE product_id = %s", (requested_product_id,))
-
-            cursor.execute("SELECT product_id, vip_rooms, COALESCE(updated, FALSE) as updated FROM vip_rooms WHERE product_id = %s", (requested_product_id,))
-            vip_result = cursor.fetchone()
-            if vip_result:
-                # Convert set to list of card objects
-                cards_list = []
-                if vip_result['product_id'] in product_cards:
-                    for uid in product_cards[vip_result['product_id']]:
-                        if uid in card_details:
-                            cards_list.append(card_details[uid])
-                
-                product_data = {
-                    "product_id": vip_result['product_id'],
-                    "updated": vip_result['updated'],
-                    "cards": cards_list
-                }
-                
-                if vip_result['product_id'] in guests_by_product:
-                    product_data['guests'] = guests_by_product[vip_result['product_id']]
-                    
-                response_data['products'].append(product_data)
-                cursor.execute("UPDATE vip_rooms SET updated = FALSE WHERE product_id = %s", (requested_product_id,))
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': 'Unable to connect to database'}), 500
 
-            conn.commit()
-        else:
-            # Handle all products request
-            cursor.execute("SELECT product_id, room_no, COALESCE(updated, FALSE) as updated FROM productstable")
-            for row in cursor.fetchall():
-                pid = row['product_id']
-                # Convert set to list of card objects
-                cards_list = []
-                if pid in product_cards:
-                    for uid in product_cards[pid]:
-                        if uid in card_details:
-                            cards_list.append(card_details[uid])
-                
-                product_data = {
-                    "product_id": pid,
-                    "updated": row['updated'],
-                    "cards": cards_list
-                }
-                
-                if pid in guests_by_product:
-                    product_data['guests'] = guests_by_product[pid]
-                    
-                response_data['products'].append(product_data)
+        cursor = conn.cursor()
 
-            cursor.execute("SELECT product_id, vip_rooms, COALESCE(updated, FALSE) as updated FROM vip_rooms")
-            for row in cursor.fetchall():
-                pid = row['product_id']
-                # Convert set to list of card objects
-                cards_list = []
-                if pid in product_cards:
-                    for uid in product_cards[pid]:
-                        if uid in card_details:
-                            cards_list.append(card_details[uid])
-                
-                product_data = {
-                    "product_id": pid,
-                    "updated": row['updated'],
-                    "cards": cards_list
-                }
-                
-                if pid in guests_by_product:
-                    product_data['guests'] = guests_by_product[pid]
-                    
-                response_data['products'].append(product_data)
+        # Cards, guests and per-product access lists from a fixed set of queries
+        snapshot = build_access_snapshot(cursor)
+        response_data = render_access_snapshot(snapshot)
 
         cursor.close()
         conn.close()
 
-        response_data['products'] = sorted(response_data['products'], key=lambda x: x['product_id'])
-
-        if requested_product_id:
-            publish_access_control_data(requested_product_id, response_data)
-
         return jsonify(response_data)
 
     except Exception as e:
-        print(f"Error getting access control data: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error getting access control data: %s", e)
         return jsonify({'error': f"Error fetching access control data: {str(e)}"}), 500
 
 
-
 @app.route('/api/update_card_status', methods=['POST'])
 def update_card_status():
     """
@@ -4679,19 +5921,23 @@ def update_card_status():
         uid = data['uid']
         active = data['active']
         
+        # A string such as "false" would be truthy
+        if not isinstance(active, bool):
+            return jsonify({'error': 'active must be true or false'}), 400
+        
         # Get database connection
         conn = get_db_connection()
         if not conn:
             return jsonify({'error': 'Unable to connect to database'}), 500
             
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cursor = conn.cursor()
         
-        # Update the active status in the database
-        cursor.execute("""
-            UPDATE access_requests
-            SET active = %s
-            WHERE product_id = %s AND uid = %s
-        """, (active, product_id, uid))
+        # Update the active status of the card pair (the event log is left as written)
+        if not update_card_active(cursor, uid, product_id, active):
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            return jsonify({'error': f"Card {uid} is not assigned to product {product_id}"}), 404
         
         # Set the product as updated to ensure changes are synced to devices
         cursor.execute("""
@@ -4707,11 +5953,11 @@ def update_card_status():
             WHERE product_id = %s
         """, (product_id,))
         
-        # Commit the changes
-        conn.commit()
+        # The card's active flag is shared by every product and VIP room it appears in
+        mark_snapshots_dirty(cursor, None)
         
-        # Trigger an update notification for this product
-        publish_access_control_data(product_id, None)
+        # Commit the changes; devices get them from the MQTT change-event publisher
+        conn.commit()
         
         cursor.close()
         conn.close()
@@ -4722,9 +5968,7 @@ def update_card_status():
         })
         
     except Exception as e:
-        print(f"Error updating card status: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error updating card status: %s", e)
         return jsonify({
             'error': f"Error updating card status: {str(e)}"
         }), 500, 
@@ -4770,32 +6014,10 @@ def get_all_activity_history():
             
         cursor = conn.cursor(cursor_factory=RealDictCursor)  # Use RealDictCursor here
         
-        # Check if user_history table exists
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_schema = 'public' 
-                AND table_name = 'user_history'
-            )
-        """)
-        
-        table_exists = cursor.fetchone()['exists']
-        
-        if not table_exists:
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS user_history (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    change_type VARCHAR(50) NOT NULL,
-                    previous_value TEXT,
-                    new_value TEXT,
-                    changed_by_id INTEGER,
-                    changed_by_email VARCHAR(255),
-                    timestamp TIMESTAMP NOT NULL DEFAULT NOW()
-                )
-            """)
-            conn.commit()
-            # Return empty result since table was just created
+        # user_history comes from schema migration 4; empty until then
+        if not schema_state.has_table('user_history'):
+            cursor.close()
+            conn.close()
             return jsonify({
                 'activity': {
                     'records': [],
@@ -4860,9 +6082,7 @@ def get_all_activity_history():
         }), 200
     
     except Exception as e:
-        print(f"Error fetching activity history: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error fetching activity history: %s", e)
         return jsonify({'error': f"Error fetching activity history: {str(e)}"}), 500
 
 
@@ -4943,9 +6163,7 @@ def register_manager():
         }), 201  # Created
         
     except Exception as e:
-        print(f"Error registering manager: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error registering manager: %s", e)
         return jsonify({
             'error': f"Error registering manager: {str(e)}"
         }), 500
@@ -5026,9 +6244,7 @@ def update_manager_string(manager_id):
         })
         
     except Exception as e:
-        print(f"Error updating manager: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error updating manager: %s", e)
         return jsonify({
             'error': f"Error updating manager: {str(e)}"
         }), 500
@@ -5051,18 +6267,6 @@ def get_managers():
             
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         
-        # Check if managers table exists, create if not
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS managers (
-                manager_id VARCHAR(50) PRIMARY KEY,
-                name VARCHAR(255) NOT NULL,
-                role VARCHAR(50) NOT NULL DEFAULT 'manager',
-                card_ui_id VARCHAR(255) UNIQUE NOT NULL,
-                created_at TIMESTAMP NOT NULL DEFAULT NOW()
-            )
-        """)
-        conn.commit()
-        
         # Get all managers
         cursor.execute("""
             SELECT manager_id, name, role, card_ui_id, created_at
@@ -5092,9 +6296,7 @@ def get_managers():
         })
         
     except Exception as e:
-        print(f"Error getting managers: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error getting managers: %s", e)
         return jsonify({
             'error': f"Error fetching managers: {str(e)}",
             'managers': []
@@ -5135,9 +6337,7 @@ def delete_manager(manager_id):
         })
         
     except Exception as e:
-        print(f"Error deleting manager: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error deleting manager: %s", e)
         return jsonify({
             'error': f"Error deleting manager: {str(e)}"
         }), 500
@@ -5183,7 +6383,7 @@ def assign_card():
             return jsonify({'error': "Unable to connect to database"}), 500
             
         # Log incoming data for debugging
-        print(f"Assigning card - Product ID: {product_id}, UID: {uid}, Package: {package_type}")
+        log.info("Assigning card - Product ID: %s, UID: %s, Package: %s", product_id, uid, package_type)
         
         cursor = conn.cursor()
         
@@ -5195,11 +6395,10 @@ def assign_card():
         cursor.execute("BEGIN")
         try:
 
-            # 1. Insert into access_requests (remove ON CONFLICT)
-            cursor.execute("""
-                INSERT INTO access_requests (uid, product_id, access_status, active, timestamp, created_at)
-                VALUES (%s, %s, 'Assigned', TRUE, %s, %s)
-            """, (uid, product_id, current_time_str, created_at))
+            # 1. Log the assignment in access_requests (counted in the rollup) and activate the card pair
+            insert_access_requests(cursor, ('uid', 'product_id', 'access_status', 'outcome', 'active', 'timestamp', 'created_at'),
+                                   [(uid, product_id, 'Assigned', OUTCOME_OTHER, True, current_time_str, created_at)])
+            set_card_active(cursor, uid, product_id, True, assigned=True)
 
             # 2. Insert into card_packages (remove ON CONFLICT)
             cursor.execute("""
@@ -5207,21 +6406,15 @@ def assign_card():
                 VALUES (%s, %s, %s)
             """, (uid, product_id, package_type))
             
-            # Print debug info
-            cursor.execute("SELECT * FROM card_packages WHERE uid = %s AND product_id = %s", (uid, product_id))
-            pkg_result = cursor.fetchone()
-            print(f"Card package after update: {pkg_result}")
-            
-            cursor.execute("SELECT * FROM access_requests WHERE uid = %s AND product_id = %s", (uid, product_id))
-            access_result = cursor.fetchone()
-            print(f"Access request after update: {access_result}")
+            # New card (and package) for this product and any VIP room it grants
+            mark_snapshots_dirty(cursor, None)
             
             # Commit the transaction
             cursor.execute("COMMIT")
             
         except Exception as e:
             cursor.execute("ROLLBACK")
-            print(f"Transaction error: {str(e)}")
+            log.error("Transaction error: %s", e)
             raise e
         
         cursor.close()
@@ -5234,22 +6427,161 @@ def assign_card():
         })
         
     except Exception as e:
-        print(f"Error assigning card: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error assigning card: %s", e)
         return jsonify({'error': f"Error assigning card: {str(e)}"}), 500
 
 
+# Serving: every process answers HTTP; exactly one also runs MQTT and the background jobs
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 25))  # Seconds a stopping process spends flushing queues
 
+started_at = time.time()
+background_pid = None           # pid of this process if it runs MQTT and the background jobs
+mqtt_thread_instance = None
+draining = threading.Event()    # Set once the process starts stopping; /readyz answers 503 from then on
+shutdown_started = False
+_serving_lock = threading.Lock()
 
-if __name__ == '__main__':
 
+def warm_up():
+    """
+    Load the product / VIP room registry so the first taps don't pay for it.
+
+    Also starts this process's notification listener, so it runs in each
+    worker (gunicorn's post_worker_init, `python app.py`) and never in the
+    gunicorn master, whose threads and LISTEN connection would not survive
+    the fork.
+    """
+    try:
+        product_registry.product_exists(None)
+    except Exception as e:
+        log.error("Error loading product registry: %s", e)
+
+
+def start_background():
+    """
+    Run the MQTT client and the background jobs (snapshot publisher,
+    partition maintainer, session janitor, outcome backfill) in this process.
+
+    Called by `python app.py` and, under gunicorn, by the one worker
+    gunicorn.conf.py designates. Other workers only serve HTTP; their
+    changes reach this process through PostgreSQL NOTIFY.
+    """
+    global background_pid, mqtt_thread_instance
+    with _serving_lock:
+        if background_pid == os.getpid():
+            return
+        background_pid = os.getpid()
+        mqtt_stop.clear()
+        mqtt_thread_instance = threading.Thread(target=mqtt_thread, name="mqtt-client")
+        mqtt_thread_instance.daemon = True
+        mqtt_thread_instance.start()
+        backfill = threading.Thread(target=backfill_access_outcomes, name="access-outcome-backfill")
+        backfill.daemon = True
+        backfill.start()
+    log.info("Background process %s started MQTT and background jobs", background_pid)
+
+
+def is_background_process():
+    return background_pid == os.getpid()
+
+
+def shutdown(timeout=None):
+    """
+    Drain this process before it exits (SIGTERM, gunicorn worker exit, atexit).
+
+    Stops taking MQTT messages and waits for running handlers, flushes the
+    queued taps, then publishes what is left in the outbound MQTT queue and
+    disconnects, all within SHUTDOWN_TIMEOUT. Runs once per process;
+    draining may already be set by the SIGTERM handler (see gunicorn.conf.py).
+    """
+    global shutdown_started
+    with _serving_lock:
+        if shutdown_started:
+            return
+        shutdown_started = True
+        draining.set()
+    deadline = time.monotonic() + (SHUTDOWN_TIMEOUT if timeout is None else timeout)
+    background = is_background_process()
+    if background:
+        mqtt_router.close()
+    access_ingest_queue.drain(max(0.0, deadline - time.monotonic()))
+    if background and mqtt_thread_instance is not None:
+        mqtt_stop.set()
+        mqtt_thread_instance.join(max(0.0, deadline - time.monotonic()))
+
+    unflushed = access_ingest_queue.stats()['queue_depth']
+    unsent = mqtt_publish_queue.depth() if background else 0
+    if unflushed or unsent:
+        log.warning("Shutdown timed out with %s taps unflushed and %s MQTT messages unsent", unflushed, unsent)
+    else:
+        log.info("Process %s drained", os.getpid())
+
+
+atexit.register(shutdown)
+
+metrics_registry.add_collector(lambda: [
+    ('tapntrack_background_process', 'gauge', 'Whether this process runs MQTT and the background jobs',
+     [({}, is_background_process())])
+])
+
+
+@app.route('/healthz', methods=['GET'])
+def liveness_probe():
+    """Liveness: the process answers, and in the background process the MQTT thread is running"""
+    background = is_background_process()
+    alive = not background or draining.is_set() or mqtt_thread_instance.is_alive()
+    return jsonify({
+        'status': 'ok' if alive else 'mqtt thread stopped',
+        'pid': os.getpid(),
+        'background': background,
+        'uptime_s': round(time.time() - started_at, 1)
+    }), 200 if alive else 503
 
-    print("Starting Flask application...")
-    # Start MQTT thread
-    mqtt_thread_instance = threading.Thread(target=mqtt_thread)
-    mqtt_thread_instance.daemon = True
-    mqtt_thread_instance.start()
-    print("MQTT client thread started")
+
+def refresh_schema_state(cursor):
+    """
+    Re-read the schema while migrations are pending, at most every
+    SCHEMA_RECHECK_INTERVAL seconds, so a worker started before a deploy
+    ran `python -m schema` turns ready without a restart.
+    """
+    global schema_state, schema_checked_at
+    if schema_state.is_current() or time.monotonic() - schema_checked_at < SCHEMA_RECHECK_INTERVAL:
+        return
+    schema_checked_at = time.monotonic()
+    schema_state = detect_schema(cursor)
+    if schema_state.is_current():
+        log.info("Schema now at migration version %s", schema_state.version)
+
+
+@app.route('/readyz', methods=['GET'])
+def readiness_probe():
+    """Readiness: not draining, schema migrated (and rollups backfilled) and the database answering"""
+    checks = {'draining': draining.is_set(), 'database': False}
+    try:
+        conn = get_db_connection()
+        if conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            refresh_schema_state(cursor)
+            cursor.close()
+            conn.close()
+            checks['database'] = True
+    except Exception as e:
+        log.warning("Readiness check could not reach the database: %s", e)
+    checks['schema'] = bool(schema_state.columns)
+    checks['migrations'] = schema_state.is_current()
+    if is_background_process():
+        # Reported only: HTTP traffic does not need the broker
+        checks['mqtt_connected'] = mqtt_client.is_connected()
+    ready = not checks['draining'] and checks['schema'] and checks['migrations'] and checks['database']
+    return jsonify({'status': 'ready' if ready else 'not ready', 'checks': checks}), 200 if ready else 503
+
+
+if __name__ == '__main__':
+    # Development server; production runs under gunicorn (see gunicorn.conf.py)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # Exit through atexit, which drains
+    log.info("Starting Flask application...")
+    warm_up()
+    start_background()
     app.config['DEBUG'] = False
     app.run(debug=False, host='0.0.0.0', port=5000)
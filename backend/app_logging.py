@@ -0,0 +1,162 @@
+"""
+Leveled, per-module logging that never blocks the caller on output.
+
+configure() points the root logger at one AsyncLogHandler: the calling
+thread only builds the record (message, request id, formatted traceback)
+and puts it on a bounded queue; a listener thread formats it as a JSON
+line (or plain text) and writes it to stderr. When the queue is full the
+record is dropped and counted rather than waiting for the console.
+
+request_id_var holds the id of the HTTP request or MQTT message being
+handled; every record logged while it is set carries it. Per-tap debug
+lines pass extra=SAMPLED and only a sample_rate fraction of them is kept,
+so DEBUG can stay enabled on a busy reader pipeline.
+
+Levels can be set per logger with "name=LEVEL,name=LEVEL", e.g.
+"app.access=DEBUG,werkzeug=WARNING".
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+SAMPLED = {'sampled': True}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, thread, msg, request_id, exc"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'msg': record.getMessage()
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-7s %(name)s [%(request_id)s] %(message)s')
+
+    def format(self, record):
+        if not getattr(record, 'request_id', None):
+            record.request_id = '-'
+        return super().format(record)
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Only at shutdown: wait for room instead of failing on a full queue
+        self.queue.put(self._sentinel)
+
+
+class AsyncLogHandler(logging.handlers.QueueHandler):
+    """Queues records for a listener thread; drops instead of blocking when the queue is full"""
+
+    def __init__(self, target, queue_size, sample_rate):
+        super().__init__(queue.Queue(queue_size))
+        self.target = target
+        self.queue_size = queue_size
+        self.sample_rate = sample_rate
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {'queued': 0, 'dropped': 0, 'sampled_out': 0}
+
+    def start(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # After a fork the parent's listener thread is gone; start over with a fresh queue
+                if self._pid is not None:
+                    self.queue = queue.Queue(self.queue_size)
+                self._pid = os.getpid()
+                self._listener = _Listener(self.queue, self.target)
+                self._listener.start()
+
+    def stop(self):
+        """Flush queued records (called at exit)"""
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+                self._listener = None
+                self._pid = None
+
+    def filter(self, record):
+        if getattr(record, 'sampled', False) and random.random() >= self.sample_rate:
+            self._stats['sampled_out'] += 1
+            return False
+        return super().filter(record)
+
+    def prepare(self, record):
+        # Everything that needs the caller's context (args, request id, traceback) happens here
+        record = logging.makeLogRecord(record.__dict__)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        record.request_id = request_id_var.get()
+        if record.exc_info:
+            record.exc_text = self.target.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+            self._stats['queued'] += 1
+        except queue.Full:
+            self._stats['dropped'] += 1
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['queue_depth'] = self.queue.qsize()
+        stats['queue_max'] = self.queue_size
+        stats['sample_rate'] = self.sample_rate
+        return stats
+
+
+def parse_levels(text):
+    """'app.access=DEBUG,werkzeug=WARNING' -> {'app.access': 'DEBUG', 'werkzeug': 'WARNING'}"""
+    levels = {}
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        name, _, level = item.partition('=')
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure(level='INFO', fmt='json', queue_size=10000, sample_rate=0.01, levels=None, stream=None):
+    """
+    Route all logging through an AsyncLogHandler writing to stream (stderr).
+
+    Returns:
+        AsyncLogHandler: for stats() and stop()
+    """
+    target = logging.StreamHandler(stream or sys.stderr)
+    target.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+    handler = AsyncLogHandler(target, queue_size, sample_rate)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    for name, name_level in (levels or {}).items():
+        logging.getLogger(name).setLevel(name_level)
+
+    handler.start()
+    return handler
@@ -0,0 +1,17 @@
+"""
+Benchmarks for the TapNTrack backend.
+
+Run modules from the backend directory, e.g.:
+
+    python -m benchmark.snapshot_queries
+    python -m benchmark.access_transports
+    python -m benchmark.checkin_trends
+
+Load scenarios (throughput and p50/p95/p99, comparable across commits):
+
+    python -m benchmark.mqtt_stub &                 # local stand-in broker on MQTT_PORT
+    python -m benchmark.hotel_data --scale small    # fills BENCH_DB_NAME
+    DB_NAME=tapntrack_bench python app.py &
+    python -m benchmark.scenarios --scenario mixed
+    python -m benchmark.report --latest 2
+"""
@@ -0,0 +1,164 @@
+"""
+Sustained tap throughput: HTTP POST /access versus MQTT /RFID/access/{product_id}.
+
+Both transports feed the same ingest_access_event() pipeline, so the
+comparison isolates transport cost. Taps are generated at full speed by
+concurrent senders; throughput is measured on the server side from the
+/api/access_ingest counters (accepted taps), so MQTT publishes that the
+server has not processed yet are not counted.
+
+Needs a running backend (batched ingest mode) and its MQTT broker. The
+counters are per process, so the backend must run a single worker
+(python app.py, or gunicorn with WEB_WORKERS=1); the run stops if the
+counters come from more than one process.
+
+Usage (from the backend directory):
+
+    python -m benchmark.access_transports
+    python -m benchmark.access_transports --taps 20000 --concurrency 16 --products P101 P102
+    python -m benchmark.access_transports --transport mqtt --qos 1
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+
+def get_json(url):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def tap_payload(i, products):
+    return {
+        'uid': f"BENCH{i % 5000:05d}",
+        'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'access': 'Granted' if i % 10 else 'Denied'
+    }, products[i % len(products)]
+
+
+def ingest_stats(base_url, pid=None):
+    """/api/access_ingest, checked to come from the process `pid` (counters are per process)"""
+    stats = get_json(f"{base_url}/api/access_ingest")
+    if pid is not None and stats['pid'] != pid:
+        raise RuntimeError("/api/access_ingest answered from more than one process; "
+                           "run the backend with a single worker (WEB_WORKERS=1)")
+    return stats
+
+
+def wait_for_ingest(base_url, target, timeout, pid):
+    """Poll the server until `target` taps were accepted; returns the finish time"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if ingest_stats(base_url, pid)['accepted'] >= target:
+            return time.perf_counter()
+        time.sleep(0.05)
+    raise TimeoutError(f"Server accepted fewer than {target} taps within {timeout}s")
+
+
+def send_http(base_url, taps, concurrency, products):
+    errors = [0]
+    lock = threading.Lock()
+
+    def send(i):
+        payload, product_id = tap_payload(i, products)
+        payload['product_id'] = product_id
+        request = urllib.request.Request(f"{base_url}/access", data=json.dumps(payload).encode(),
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            urllib.request.urlopen(request, timeout=10).read()
+        except Exception:
+            with lock:
+                errors[0] += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, range(taps)))
+    return errors[0]
+
+
+def send_mqtt(broker, port, transport, qos, taps, concurrency, products):
+    import paho.mqtt.client as mqtt
+
+    clients = []
+    for _ in range(concurrency):
+        client = mqtt.Client(transport=transport)
+        client.max_queued_messages_set(0)
+        client.connect(broker, port, 60)
+        client.loop_start()
+        clients.append(client)
+
+    def send(worker):
+        client = clients[worker]
+        last = None
+        for i in range(worker, taps, concurrency):
+            payload, product_id = tap_payload(i, products)
+            last = client.publish(f"/RFID/access/{product_id}", json.dumps(payload), qos=qos)
+        if last is not None:
+            last.wait_for_publish()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, range(concurrency)))
+
+    for client in clients:
+        client.loop_stop()
+        client.disconnect()
+    return 0
+
+
+def run(name, send, base_url, taps, timeout):
+    before = ingest_stats(base_url)
+    started = time.perf_counter()
+    errors = send()
+    sent = time.perf_counter()
+    finished = wait_for_ingest(base_url, before['accepted'] + taps - errors, timeout, before['pid'])
+
+    elapsed = finished - started
+    return {
+        'transport': name,
+        'taps': taps,
+        'errors': errors,
+        'send_s': sent - started,
+        'total_s': elapsed,
+        'taps_per_s': (taps - errors) / elapsed if elapsed else 0.0
+    }
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://localhost:5000')
+    parser.add_argument('--broker', default=os.getenv("MQTT_BROKER", "127.0.0.1"))
+    parser.add_argument('--port', type=int, default=int(os.getenv("MQTT_PORT", 1883)))
+    parser.add_argument('--mqtt-transport', default='websockets', choices=['websockets', 'tcp'])
+    parser.add_argument('--qos', type=int, default=1, choices=[0, 1, 2])
+    parser.add_argument('--transport', default='both', choices=['both', 'http', 'mqtt'])
+    parser.add_argument('--taps', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--products', nargs='+', default=['BENCH-P1'],
+                        help="Product IDs to tap (unknown IDs are stored as NULL, like real readers)")
+    parser.add_argument('--timeout', type=float, default=120)
+    args = parser.parse_args()
+
+    results = []
+    if args.transport in ('both', 'http'):
+        results.append(run('http', lambda: send_http(args.base_url, args.taps, args.concurrency, args.products),
+                           args.base_url, args.taps, args.timeout))
+    if args.transport in ('both', 'mqtt'):
+        results.append(run('mqtt', lambda: send_mqtt(args.broker, args.port, args.mqtt_transport, args.qos,
+                                                     args.taps, args.concurrency, args.products),
+                           args.base_url, args.taps, args.timeout))
+
+    print(f"{'transport':>10} {'taps':>8} {'errors':>7} {'send s':>8} {'total s':>8} {'taps/s':>10}")
+    for result in results:
+        print(f"{result['transport']:>10} {result['taps']:>8} {result['errors']:>7} "
+              f"{result['send_s']:>8.2f} {result['total_s']:>8.2f} {result['taps_per_s']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
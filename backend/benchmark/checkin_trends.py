@@ -0,0 +1,152 @@
+"""
+Latency of /api/checkin_trends strategies at 1M and 10M access rows.
+
+Builds a scratch schema (bench_trends) in the .env database, fills
+access_requests with synthetic taps spread over a year using
+generate_series, backfills the rollup and then times, per period:
+
+    legacy   fetch (created_at, access_status) rows and loop in Python
+    raw      one GROUPING SETS query over access_requests
+    rollup   access_rollup.trend_histograms() (what the endpoint runs)
+
+The scratch schema is dropped afterwards unless --keep is given.
+
+Usage (from the backend directory):
+
+    python -m benchmark.checkin_trends
+    python -m benchmark.checkin_trends --rows 1000000 --periods 7 30 90 365
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+from access_rollup import create_rollup_tables, backfill_rollup, trend_histograms
+
+SCHEMA = 'bench_trends'
+
+
+def populate(cursor, rows, products):
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+    cursor.execute(f"SET search_path TO {SCHEMA}")
+    cursor.execute("""
+        CREATE TABLE access_requests (
+            id BIGSERIAL PRIMARY KEY,
+            uid VARCHAR(255),
+            timestamp VARCHAR(255),
+            product_id VARCHAR(255),
+            access_status VARCHAR(255),
+            outcome SMALLINT,
+            active BOOLEAN,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO access_requests (uid, timestamp, product_id, access_status, outcome, created_at)
+        SELECT 'C' || (n %% 5000),
+               '',
+               'P' || (n %% %s),
+               CASE WHEN n %% 10 = 0 THEN 'Access Denied' ELSE 'Access Granted' END,
+               CASE WHEN n %% 10 = 0 THEN 2 ELSE 1 END,
+               NOW() - (random() * INTERVAL '365 days')
+        FROM generate_series(1, %s) as n
+    """, (products, rows))
+    cursor.execute("CREATE INDEX ON access_requests (created_at)")
+    cursor.execute("ANALYZE access_requests")
+    create_rollup_tables(cursor)
+
+
+def legacy(cursor, start_day, end_day):
+    cursor.execute("""
+        SELECT created_at, access_status FROM access_requests
+        WHERE created_at >= %s AND created_at < %s
+        ORDER BY created_at
+    """, (start_day, end_day + timedelta(days=1)))
+    daily, hourly, dow, granted, denied = {}, [0] * 24, [0] * 7, 0, 0
+    for record in cursor.fetchall():
+        timestamp = record['created_at']
+        daily[timestamp.date()] = daily.get(timestamp.date(), 0) + 1
+        hourly[timestamp.hour] += 1
+        dow[timestamp.weekday()] += 1
+        if 'granted' in record['access_status'].lower():
+            granted += 1
+        elif 'denied' in record['access_status'].lower():
+            denied += 1
+
+
+def raw(cursor, start_day, end_day):
+    cursor.execute("""
+        SELECT created_at::date as day, EXTRACT(HOUR FROM created_at) as hour,
+               EXTRACT(ISODOW FROM created_at) as dow, outcome,
+               COUNT(*) as count
+        FROM access_requests
+        WHERE created_at >= %s AND created_at < %s
+        GROUP BY GROUPING SETS ((created_at::date), (EXTRACT(HOUR FROM created_at)),
+                                (EXTRACT(ISODOW FROM created_at)), (outcome))
+    """, (start_day, end_day + timedelta(days=1)))
+    cursor.fetchall()
+
+
+def timed(fn, cursor, start_day, end_day, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(cursor, start_day, end_day)
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000, 10000000])
+    parser.add_argument('--periods', type=int, nargs='+', default=[7, 30, 90, 365])
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip-legacy-above', type=int, default=10000000,
+                        help="Skip the Python-loop strategy for larger row counts")
+    parser.add_argument('--keep', action='store_true', help=f"Keep the {SCHEMA} schema")
+    args = parser.parse_args()
+
+    load_dotenv()
+    conn = psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        port=os.getenv("DB_PORT"),
+        cursor_factory=RealDictCursor
+    )
+    conn.autocommit = True
+    cursor = conn.cursor()
+
+    print(f"{'rows':>10} {'period':>7} {'legacy ms':>11} {'raw ms':>9} {'rollup ms':>10}")
+    try:
+        for rows in args.rows:
+            populate(cursor, rows, args.products)
+            started = time.perf_counter()
+            backfill_rollup(cursor)
+            print(f"{rows:>10} rollup backfill {(time.perf_counter() - started):.1f}s")
+
+            end_day = datetime.now().date()
+            for period in args.periods:
+                start_day = end_day - timedelta(days=period - 1)
+                legacy_ms = (timed(legacy, cursor, start_day, end_day, args.repeat)
+                             if rows <= args.skip_legacy_above else None)
+                raw_ms = timed(raw, cursor, start_day, end_day, args.repeat)
+                rollup_ms = timed(trend_histograms, cursor, start_day, end_day, args.repeat)
+                legacy_text = f"{legacy_ms:.1f}" if legacy_ms is not None else 'skipped'
+                print(f"{rows:>10} {period:>7} {legacy_text:>11} {raw_ms:>9.1f} {rollup_ms:>10.1f}")
+    finally:
+        if not args.keep:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+"""
+Synthetic hotel generator for the load-test scenarios.
+
+Creates (or resets) a dedicated benchmark database and fills it with a
+hotel of the requested size:
+
+    productstable        one reader per room
+    vip_rooms            shared facilities (lounge, spa, pool, gym, ...)
+    card_packages        the package of every checked-in guest's card
+    access_matrix        package x facility permissions
+    guest_registrations  current guests (occupancy) plus past stays
+    access_requests      taps spread over --days, mostly daytime, ~8% denied
+
+then builds what the app keeps next to the raw log (schema migrations,
+outcome column, rollup, card_assignments) so every route reads the same
+shape of data it would in production. Everything is derived from --seed
+and --anchor (the "now" of the generated hotel, midnight today by
+default), so two runs with the same arguments produce the same hotel.
+The routes under test work relative to the database's NOW() (current
+guests, trend periods), so generate the hotel on the day you benchmark
+it; results are only comparable between runs with the same anchor.
+
+The database is BENCH_DB_NAME (default tapntrack_bench) on the .env
+server, never the app's own DB_NAME; start the backend under test with
+DB_NAME set to it.
+
+Usage (from the backend directory):
+
+    python -m benchmark.hotel_data --scale small          # 50 rooms, 1M taps
+    python -m benchmark.hotel_data --scale medium         # 500 rooms, 10M taps
+    python -m benchmark.hotel_data --scale large          # 5,000 rooms, 50M taps
+    python -m benchmark.hotel_data --rooms 200 --events 2000000 --seed 7 --reset
+    python -m benchmark.hotel_data --anchor "2026-06-01 09:00:00" --reset
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from psycopg2.extras import execute_values
+
+from access_rollup import backfill_rollup, backfill_card_assignments
+from schema import migrate
+
+SCALES = {
+    'small': (50, 1000000),
+    'medium': (500, 10000000),
+    'large': (5000, 50000000)
+}
+
+PACKAGES = ['Standard', 'Deluxe', 'Suite', 'Executive']
+FACILITIES = ['Lounge Room', 'Spa Room', 'Top Pool', 'Gym', 'Business Center', 'Kids Club', 'Rooftop Bar', 'Sauna']
+
+EVENT_CHUNK = 1000000  # Rows per INSERT ... SELECT; each chunk commits
+
+# "Now" of the generated hotel: stays, check-ins and tap history are placed relative to it.
+# Today, truncated so every run on the same day generates the same hotel
+DEFAULT_ANCHOR = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+# Tables the app expects but does not create itself
+LEGACY_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS productstable (
+        product_id VARCHAR(255) PRIMARY KEY,
+        room_no VARCHAR(255) NOT NULL,
+        updated BOOLEAN DEFAULT FALSE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS vip_rooms (
+        product_id VARCHAR(255) PRIMARY KEY,
+        vip_rooms VARCHAR(255) NOT NULL,
+        updated BOOLEAN DEFAULT FALSE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS card_packages (
+        id SERIAL PRIMARY KEY,
+        uid VARCHAR(255) NOT NULL,
+        product_id VARCHAR(255),
+        package_type VARCHAR(255) NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS access_matrix (
+        id SERIAL PRIMARY KEY,
+        package_type VARCHAR(255) NOT NULL,
+        facility VARCHAR(255) NOT NULL,
+        has_access BOOLEAN NOT NULL DEFAULT FALSE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS access_requests (
+        id BIGSERIAL PRIMARY KEY,
+        uid VARCHAR(255),
+        timestamp VARCHAR(255),
+        product_id VARCHAR(255),
+        access_status VARCHAR(255),
+        active BOOLEAN,
+        created_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+    """
+]
+
+GENERATED_TABLES = ['access_requests', 'access_rollup', 'access_uids', 'card_assignments', 'guest_registrations',
+                    'card_packages', 'access_matrix', 'vip_rooms', 'productstable']
+
+INSERT_EVENTS_SQL = """
+    INSERT INTO access_requests (uid, timestamp, product_id, access_status, outcome, created_at)
+    SELECT uid, to_char(created_at, 'YYYY-MM-DD HH24:MI:SS'), product_id,
+           CASE WHEN denied THEN 'Access Denied' ELSE 'Access Granted' END,
+           CASE WHEN denied THEN 2 ELSE 1 END, created_at
+    FROM (
+        SELECT 'C' || lpad(floor(random() * %(cards)s)::int::text, 6, '0') as uid,
+               (%(products)s::text[])[1 + floor(random() * %(product_count)s)::int] as product_id,
+               random() < %(denied_rate)s as denied,
+               %(first_day)s::timestamp + floor(random() * %(days)s) * INTERVAL '1 day'
+                   + CASE WHEN random() < 0.8 THEN 7 + random() * 16 ELSE random() * 24 END * INTERVAL '1 hour'
+                   as created_at
+        FROM generate_series(1, %(rows)s)
+    ) taps
+"""
+
+
+def connect(database, autocommit=False):
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+
+    conn = psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        database=database,
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        port=os.getenv("DB_PORT"),
+        cursor_factory=RealDictCursor
+    )
+    conn.autocommit = autocommit
+    return conn
+
+
+def ensure_database(name):
+    """Create the benchmark database on the .env server if it does not exist"""
+    conn = connect('postgres', autocommit=True)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (name,))
+        if cursor.fetchone() is None:
+            cursor.execute(f'CREATE DATABASE "{name}"')
+            print(f"Created database {name}")
+    finally:
+        conn.close()
+
+
+def card_uid(number):
+    return f"C{number:06d}"
+
+
+def parse_anchor(value):
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S' if ' ' in value else '%Y-%m-%d')
+
+
+def hotel(rooms, seed, occupancy, past_stays, anchor=DEFAULT_ANCHOR):
+    """Rooms, facilities, matrix, guests and packages as Python rows, all derived from seed and anchor"""
+    rng = random.Random(seed)
+    now = anchor
+    products = [(f"P{i:05d}", str(101 + (i // 40) * 100 + i % 40), False) for i in range(rooms)]
+    facility_count = min(len(FACILITIES), max(4, rooms // 100))
+    vip_rooms = [(f"V{i:03d}", FACILITIES[i], False) for i in range(facility_count)]
+    matrix = [(package, facility, rng.random() < 0.25 + 0.2 * level)
+              for level, package in enumerate(PACKAGES)
+              for _, facility, _ in vip_rooms]
+
+    guests, packages = [], []
+    next_card = 0
+    for product_id, room_no, _ in products:
+        for _ in range(past_stays):
+            checkout = now - timedelta(days=rng.randint(1, 365))
+            guests.append(guest_row(rng, next_card, room_no, checkout - timedelta(days=rng.randint(1, 7)), checkout))
+            next_card += 1
+        if rng.random() < occupancy:
+            checkin = now - timedelta(days=rng.randint(0, 5), hours=rng.randint(0, 12))
+            guests.append(guest_row(rng, next_card, room_no, checkin, now + timedelta(days=rng.randint(1, 7))))
+            packages.append((card_uid(next_card), product_id, rng.choice(PACKAGES)))
+            next_card += 1
+
+    # Staff cards open every door
+    packages.append((card_uid(next_card), None, 'Master Card'))
+    packages.append((card_uid(next_card + 1), None, 'Service Card'))
+    return {
+        'products': products,
+        'vip_rooms': vip_rooms,
+        'matrix': matrix,
+        'guests': guests,
+        'packages': packages,
+        'cards': next_card + 2
+    }
+
+
+def guest_row(rng, card, room_no, checkin, checkout):
+    return (f"G-{card:06d}", f"Guest {card}", 'aadhar', f"{rng.randrange(10 ** 11, 10 ** 12)}",
+            f"{rng.randint(1, 999)} Bench Street", room_no, card_uid(card), checkin, checkout)
+
+
+def reset(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT tablename FROM pg_tables WHERE schemaname = current_schema()")
+    existing = {row['tablename'] for row in cursor.fetchall()}
+    tables = [table for table in GENERATED_TABLES if table in existing]
+    if tables:
+        cursor.execute(f"TRUNCATE {', '.join(tables)} RESTART IDENTITY")
+    conn.commit()
+
+
+def populate_hotel(conn, data):
+    cursor = conn.cursor()
+    execute_values(cursor, "INSERT INTO productstable (product_id, room_no, updated) VALUES %s", data['products'])
+    execute_values(cursor, "INSERT INTO vip_rooms (product_id, vip_rooms, updated) VALUES %s", data['vip_rooms'])
+    execute_values(cursor, "INSERT INTO access_matrix (package_type, facility, has_access) VALUES %s", data['matrix'])
+    execute_values(cursor, "INSERT INTO card_packages (uid, product_id, package_type) VALUES %s", data['packages'])
+    execute_values(cursor, """
+        INSERT INTO guest_registrations (guest_id, name, id_type, id_number, address, room_id, card_ui_id,
+                                         checkin_time, checkout_time)
+        VALUES %s
+    """, data['guests'], page_size=10000)
+    conn.commit()
+
+
+def populate_events(conn, data, events, days, seed, anchor=DEFAULT_ANCHOR, denied_rate=0.08):
+    """Taps by random cards on random readers over the `days` days up to anchor, EVENT_CHUNK rows per commit"""
+    product_ids = [row[0] for row in data['products']] + [row[0] for row in data['vip_rooms']]
+    first_day = (anchor - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    cursor = conn.cursor()
+    # setseed() makes random() repeatable for this session (INSERT ... SELECT never runs in parallel)
+    cursor.execute("SELECT setseed(%s)", (random.Random(seed).random() * 2 - 1,))
+    written = 0
+    started = time.perf_counter()
+    while written < events:
+        rows = min(EVENT_CHUNK, events - written)
+        cursor.execute(INSERT_EVENTS_SQL, {
+            'cards': data['cards'],
+            'products': product_ids,
+            'product_count': len(product_ids),
+            'denied_rate': denied_rate,
+            'first_day': first_day,
+            'days': days,
+            'rows': rows
+        })
+        conn.commit()
+        written += rows
+        print(f"  {written:>12,} taps ({written / (time.perf_counter() - started):,.0f}/s)")
+
+
+def finish(conn, anchor=DEFAULT_ANCHOR):
+    """Rollup, card_assignments (guests' cards active) and planner statistics"""
+    cursor = conn.cursor()
+    started = time.perf_counter()
+    backfill_rollup(cursor)
+    backfill_card_assignments(cursor)
+    cursor.execute("""
+        INSERT INTO card_assignments (uid, product_id, active, assigned_at, updated_at)
+        SELECT uid, product_id, TRUE, %(anchor)s, %(anchor)s FROM card_packages WHERE product_id IS NOT NULL
+        ON CONFLICT (uid, product_id) DO UPDATE SET active = TRUE, assigned_at = %(anchor)s, updated_at = %(anchor)s
+    """, {'anchor': anchor})
+    conn.commit()
+    print(f"Rollup and card assignments built in {time.perf_counter() - started:.1f}s")
+    conn.autocommit = True
+    cursor.execute("ANALYZE")
+    conn.autocommit = False
+
+
+def main():
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--rooms', type=int, help="Overrides the scale's room count")
+    parser.add_argument('--events', type=int, help="Overrides the scale's tap count")
+    parser.add_argument('--days', type=int, default=365, help="Days of tap history")
+    parser.add_argument('--occupancy', type=float, default=0.7, help="Fraction of rooms with a current guest")
+    parser.add_argument('--past-stays', type=int, default=10, help="Past guest stays per room")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--anchor', type=parse_anchor, default=DEFAULT_ANCHOR,
+                        help="The hotel's \"now\", YYYY-MM-DD [HH:MM:SS] (default: %(default)s)")
+    parser.add_argument('--reset', action='store_true', help="Empty the generated tables first")
+    args = parser.parse_args()
+
+    load_dotenv()
+    database = os.getenv("BENCH_DB_NAME", "tapntrack_bench")
+    if database == os.getenv("DB_NAME"):
+        parser.error("BENCH_DB_NAME must differ from DB_NAME; the generator truncates its tables")
+    rooms, events = SCALES[args.scale]
+    rooms = args.rooms or rooms
+    events = args.events if args.events is not None else events
+
+    ensure_database(database)
+    conn = connect(database)
+    try:
+        cursor = conn.cursor()
+        for statement in LEGACY_DDL:
+            cursor.execute(statement)
+        conn.commit()
+        migrate(conn)
+
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM productstable) as populated")
+        if cursor.fetchone()['populated']:
+            if not args.reset:
+                parser.error(f"{database} already holds a hotel; pass --reset to regenerate it")
+            reset(conn)
+
+        data = hotel(rooms, args.seed, args.occupancy, args.past_stays, args.anchor)
+        populate_hotel(conn, data)
+        print(f"{database}: {rooms} rooms, {len(data['vip_rooms'])} facilities, {len(data['guests'])} stays, "
+              f"{len(data['packages'])} active cards (seed {args.seed})")
+        populate_events(conn, data, events, args.days, args.seed, args.anchor)
+        finish(conn, args.anchor)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
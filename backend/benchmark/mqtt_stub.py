@@ -0,0 +1,270 @@
+"""
+Minimal local MQTT 3.1.1 broker standing in for the real one during benchmarks.
+
+Speaks enough of the protocol for the backend and the benchmark clients:
+CONNECT, SUBSCRIBE/UNSUBSCRIBE with + and # wildcards, PUBLISH at QoS 0-2
+(QoS 2 is acknowledged, delivery is capped at QoS 1), retained messages,
+PINGREQ and DISCONNECT. One port serves both plain TCP and WebSocket
+clients (paho's transport="websockets"): a connection that starts with an
+HTTP GET is upgraded, anything else is read as raw MQTT.
+
+No persistence, authentication or sessions; counters for connections and
+messages are printed every --report seconds.
+
+Usage (from the backend directory):
+
+    python -m benchmark.mqtt_stub                  # 127.0.0.1:9001, like .env
+    python -m benchmark.mqtt_stub --port 1883 --report 5
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import re
+import struct
+
+WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+
+def topic_regex(pattern):
+    parts = []
+    for level in pattern.split('/'):
+        if level == '+':
+            parts.append('[^/]*')
+        elif level == '#':
+            parts.append('.*')
+        else:
+            parts.append(re.escape(level))
+    return re.compile('^' + '/'.join(parts) + '$')
+
+
+def encode_length(length):
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(encoded)
+
+
+def packet(packet_type, flags, body):
+    return bytes([(packet_type << 4) | flags]) + encode_length(len(body)) + body
+
+
+def mqtt_string(text):
+    data = text.encode()
+    return struct.pack('!H', len(data)) + data
+
+
+class Stream:
+    """Byte reader/writer over raw TCP or WebSocket binary frames"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.websocket = False
+        self._buffer = bytearray()
+
+    async def handshake(self):
+        first = await self.reader.read(4)
+        if first != b'GET ':
+            self._buffer.extend(first)
+            return
+        request = first + await self.reader.readuntil(b'\r\n\r\n')
+        headers = dict(
+            line.split(': ', 1) for line in request.decode(errors='replace').split('\r\n')[1:] if ': ' in line
+        )
+        headers = {name.lower(): value for name, value in headers.items()}
+        accept = base64.b64encode(hashlib.sha1(headers['sec-websocket-key'].encode() + WS_GUID).digest()).decode()
+        response = ("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                    f"Sec-WebSocket-Accept: {accept}\r\n")
+        if 'mqtt' in headers.get('sec-websocket-protocol', ''):
+            response += "Sec-WebSocket-Protocol: mqtt\r\n"
+        self.writer.write((response + "\r\n").encode())
+        self.websocket = True
+
+    async def _fill(self):
+        if not self.websocket:
+            data = await self.reader.read(65536)
+            if not data:
+                raise ConnectionError("closed")
+            self._buffer.extend(data)
+            return
+        header = await self.reader.readexactly(2)
+        opcode, length = header[0] & 0x0F, header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack('!H', await self.reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', await self.reader.readexactly(8))[0]
+        mask = await self.reader.readexactly(4) if header[1] & 0x80 else None
+        payload = bytearray(await self.reader.readexactly(length))
+        if mask:
+            for i in range(length):
+                payload[i] ^= mask[i % 4]
+        if opcode == 0x8:
+            raise ConnectionError("closed")
+        if opcode == 0x9:
+            self.writer.write(bytes([0x8A]) + self._frame_length(length) + payload)
+        elif opcode in (0x0, 0x1, 0x2):
+            self._buffer.extend(payload)
+
+    @staticmethod
+    def _frame_length(length):
+        if length < 126:
+            return bytes([length])
+        if length < 65536:
+            return bytes([126]) + struct.pack('!H', length)
+        return bytes([127]) + struct.pack('!Q', length)
+
+    async def read_packet(self):
+        """(type, flags, body) of the next MQTT packet"""
+        while True:
+            if len(self._buffer) >= 2:
+                multiplier, length, i = 1, 0, 1
+                while i < len(self._buffer) and i <= 4:
+                    byte = self._buffer[i]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    i += 1
+                    if not byte & 0x80:
+                        if len(self._buffer) >= i + length:
+                            first = self._buffer[0]
+                            body = bytes(self._buffer[i:i + length])
+                            del self._buffer[:i + length]
+                            return first >> 4, first & 0x0F, body
+                        break
+            await self._fill()
+
+    def write(self, data):
+        if self.websocket:
+            data = bytes([0x82]) + self._frame_length(len(data)) + data
+        self.writer.write(data)
+
+
+class Broker:
+    def __init__(self):
+        self.subscriptions = {}   # stream -> {pattern: (regex, qos)}
+        self.retained = {}
+        self.stats = {'connections': 0, 'connected': 0, 'received': 0, 'delivered': 0}
+        self._next_mid = 0
+
+    def deliver(self, topic, payload, retain=False, only=None):
+        targets = [only] if only is not None else list(self.subscriptions)
+        for stream in targets:
+            for regex, qos in self.subscriptions.get(stream, {}).values():
+                if regex.match(topic):
+                    flags = (1 << 1 if qos else 0) | (1 if retain else 0)
+                    body = mqtt_string(topic)
+                    if qos:
+                        self._next_mid = self._next_mid % 65535 + 1
+                        body += struct.pack('!H', self._next_mid)
+                    stream.write(packet(PUBLISH, flags, body + payload))
+                    self.stats['delivered'] += 1
+                    break
+
+    async def handle(self, reader, writer):
+        stream = Stream(reader, writer)
+        self.stats['connections'] += 1
+        try:
+            await stream.handshake()
+            while True:
+                packet_type, flags, body = await stream.read_packet()
+                if packet_type == CONNECT:
+                    self.subscriptions[stream] = {}
+                    self.stats['connected'] += 1
+                    stream.write(packet(CONNACK, 0, b'\x00\x00'))
+                elif packet_type == PUBLISH:
+                    self.on_publish(stream, flags, body)
+                elif packet_type == PUBREL:
+                    stream.write(packet(PUBCOMP, 0, body[:2]))
+                elif packet_type == SUBSCRIBE:
+                    self.on_subscribe(stream, body)
+                elif packet_type == UNSUBSCRIBE:
+                    offset = 2
+                    while offset < len(body):
+                        length = struct.unpack('!H', body[offset:offset + 2])[0]
+                        self.subscriptions.get(stream, {}).pop(body[offset + 2:offset + 2 + length].decode(), None)
+                        offset += 2 + length
+                    stream.write(packet(UNSUBACK, 0, body[:2]))
+                elif packet_type == PINGREQ:
+                    stream.write(packet(PINGRESP, 0, b''))
+                elif packet_type == DISCONNECT:
+                    break
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, KeyError, ValueError):
+            pass
+        finally:
+            if self.subscriptions.pop(stream, None) is not None:
+                self.stats['connected'] -= 1
+            writer.close()
+
+    def on_publish(self, stream, flags, body):
+        qos, retain = (flags >> 1) & 0x03, flags & 0x01
+        length = struct.unpack('!H', body[:2])[0]
+        topic = body[2:2 + length].decode()
+        offset = 2 + length
+        if qos:
+            mid = body[offset:offset + 2]
+            offset += 2
+            stream.write(packet(PUBACK if qos == 1 else PUBREC, 0, mid))
+        payload = body[offset:]
+        self.stats['received'] += 1
+        if retain:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+        self.deliver(topic, payload)
+
+    def on_subscribe(self, stream, body):
+        mid, offset, granted = body[:2], 2, []
+        subscriptions = self.subscriptions.setdefault(stream, {})
+        new_patterns = []
+        while offset < len(body):
+            length = struct.unpack('!H', body[offset:offset + 2])[0]
+            pattern = body[offset + 2:offset + 2 + length].decode()
+            qos = min(body[offset + 2 + length], 1)
+            offset += 3 + length
+            subscriptions[pattern] = (topic_regex(pattern), qos)
+            new_patterns.append(subscriptions[pattern][0])
+            granted.append(qos)
+        stream.write(packet(SUBACK, 0, mid + bytes(granted)))
+        for topic, payload in list(self.retained.items()):
+            if any(regex.match(topic) for regex in new_patterns):
+                self.deliver(topic, payload, retain=True, only=stream)
+
+
+async def report(broker, interval):
+    while True:
+        await asyncio.sleep(interval)
+        print(f"connected {broker.stats['connected']:>4}  received {broker.stats['received']:>10}  "
+              f"delivered {broker.stats['delivered']:>10}  retained {len(broker.retained):>6}")
+
+
+async def serve(host, port, interval):
+    broker = Broker()
+    server = await asyncio.start_server(broker.handle, host, port)
+    print(f"MQTT stand-in listening on {host}:{port} (TCP and WebSocket)")
+    if interval:
+        asyncio.ensure_future(report(broker, interval))
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9001)
+    parser.add_argument('--report', type=float, default=10, help="Seconds between counter lines; 0 disables")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.report))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
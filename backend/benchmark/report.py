@@ -0,0 +1,84 @@
+"""
+Compare benchmark.scenarios result files.
+
+The first file is the baseline; every other run is printed next to it per
+endpoint with the change in throughput and p50/p95/p99, so a commit that
+slows one route shows up even if the totals hold. Runs with different
+scenario, scale, anchor or concurrency are flagged, since their numbers
+are not comparable.
+
+Usage (from the backend directory):
+
+    python -m benchmark.report benchmark/results/mixed-a1b2c3d-*.json benchmark/results/mixed-e4f5a6b-*.json
+    python -m benchmark.report --latest 2          # the two newest files in benchmark/results
+"""
+import argparse
+import glob
+import json
+import os
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+COMPARED_CONFIG = ('scenario', 'scale', 'rooms', 'seed', 'anchor', 'concurrency', 'dashboard_concurrency', 'rate',
+                   'duration')
+COLUMNS = ('rps', 'p50_ms', 'p95_ms', 'p99_ms')
+
+
+def load(path):
+    with open(path) as f:
+        return path, json.load(f)
+
+
+def delta(value, baseline):
+    if not baseline:
+        return ''
+    return f"{(value - baseline) / baseline * 100:+.1f}%"
+
+
+def run_name(path, result):
+    name = result.get('commit', '?')
+    if result.get('label'):
+        name += f" ({result['label']})"
+    return f"{name}  {os.path.basename(path)}"
+
+
+def print_results(runs):
+    """Per-endpoint table for each run, with deltas against the first"""
+    base_path, baseline = runs[0]
+    for path, result in runs:
+        print(f"\n{run_name(path, result)}")
+        if result is not baseline:
+            differing = [key for key in COMPARED_CONFIG
+                         if result['config'].get(key) != baseline['config'].get(key)]
+            if differing:
+                print(f"  not comparable with the baseline: {', '.join(differing)} differ")
+        print(f"  {'endpoint':<22} {'ok':>9} {'errors':>7} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} "
+              f"{'p99 ms':>9}")
+        rows = [('total', result['total'])] + sorted(result['endpoints'].items())
+        for endpoint, stats in rows:
+            print(f"  {endpoint:<22} {stats['ok']:>9} {stats['errors']:>7} {stats['rps']:>9.1f} "
+                  f"{stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f}")
+            if result is baseline:
+                continue
+            base = baseline['total'] if endpoint == 'total' else baseline['endpoints'].get(endpoint)
+            if base:
+                print(f"  {'':<22} {'':>9} {'':>7} " +
+                      ' '.join(f"{delta(stats[column], base[column]):>9}" for column in COLUMNS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help="Result files; the first is the baseline")
+    parser.add_argument('--latest', type=int, help="Use the N newest files in benchmark/results instead")
+    args = parser.parse_args()
+
+    files = args.files
+    if args.latest:
+        files = sorted(glob.glob(os.path.join(RESULTS_DIR, '*.json')), key=os.path.getmtime)[-args.latest:]
+    if not files:
+        parser.error("No result files given (run python -m benchmark.scenarios first)")
+    print_results([load(path) for path in files])
+
+
+if __name__ == '__main__':
+    main()
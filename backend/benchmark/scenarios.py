@@ -0,0 +1,266 @@
+"""
+Load scenarios against a running backend, reported as throughput and p50/p95/p99.
+
+Replays reader taps (POST /access) and dashboard traffic (/api/dashboard,
+/api/checkin_trends, /api/room_frequency, /api/access_control_data) from
+concurrent workers for a fixed duration, after a warm-up that is not
+measured. Cards, rooms and facilities come from benchmark.hotel_data with
+the same --scale/--rooms/--seed/--anchor, and every worker draws its requests from
+its own seeded generator, so two runs send the same mix of requests and
+their numbers can be compared across commits. The dashboard routes read
+relative to the current time, so only compare runs made against hotels
+generated with the same --anchor (recorded in each result).
+
+Scenarios:
+    taps        tap workers only (guests at their room and facilities, plus unknown cards)
+    dashboard   dashboard workers only
+    mixed       both at once (default): --concurrency tap workers, --dashboard-concurrency readers
+
+Each run writes benchmark/results/<scenario>-<commit>-<timestamp>.json;
+compare runs with python -m benchmark.report.
+
+Setup: python -m benchmark.hotel_data, python -m benchmark.mqtt_stub, then
+the backend with DB_NAME=$BENCH_DB_NAME and MQTT_BROKER/MQTT_PORT pointing
+at the stand-in.
+
+Usage (from the backend directory):
+
+    python -m benchmark.scenarios --scale small
+    python -m benchmark.scenarios --scenario taps --concurrency 32 --duration 60
+    python -m benchmark.scenarios --scenario dashboard --rate 50 --label "rollup on"
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+import urllib.parse
+from datetime import datetime
+
+from benchmark.hotel_data import DEFAULT_ANCHOR, SCALES, hotel, parse_anchor
+from benchmark.report import RESULTS_DIR, print_results
+
+# (name, weight, path builder); weights follow a dashboard that polls the summary
+# far more often than someone opens the trend charts
+DASHBOARD_MIX = [
+    ('dashboard', 4, lambda rng, data: '/api/dashboard'),
+    ('checkin_trends', 2, lambda rng, data: f"/api/checkin_trends?period={rng.choice(['7', '30', '90'])}"),
+    ('room_frequency', 2, lambda rng, data: f"/api/room_frequency?period={rng.choice(['30', 'all'])}"),
+    ('access_control_data', 3,
+     lambda rng, data: f"/api/access_control_data?product_id={rng.choice(data['products'])[0]}"),
+]
+
+UNKNOWN_CARD_RATE = 0.05
+FACILITY_TAP_RATE = 0.3
+
+
+class Recorder:
+    """Latencies and status codes per endpoint, only while measuring"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.measuring = False
+        self.latencies = {}
+        self.statuses = {}
+        self.errors = {}
+
+    def add(self, endpoint, elapsed, status):
+        if not self.measuring:
+            return
+        with self._lock:
+            if status is None or status >= 400:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            else:
+                self.latencies.setdefault(endpoint, []).append(elapsed)
+            statuses = self.statuses.setdefault(endpoint, {})
+            key = str(status) if status is not None else 'error'
+            statuses[key] = statuses.get(key, 0) + 1
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def summarize(latencies, errors, duration):
+    ordered = sorted(latencies)
+    return {
+        'ok': len(ordered),
+        'errors': errors,
+        'rps': round(len(ordered) / duration, 2) if duration else 0.0,
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3) if ordered else 0.0
+    }
+
+
+class Client:
+    """One keep-alive HTTP connection per worker, reopened after errors"""
+
+    def __init__(self, base_url, timeout):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.timeout = timeout
+        self._conn = None
+
+    def request(self, method, path, body=None):
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        try:
+            self._conn.request(method, path, body=body, headers=headers)
+            response = self._conn.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.close()
+            return None
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def tap_request(rng, data, facilities):
+    """A tap as a reader would send it: mostly guests at their own room, some at facilities"""
+    if rng.random() < UNKNOWN_CARD_RATE:
+        uid, product_id = f"X{rng.randrange(10 ** 6):06d}", rng.choice(data['products'])[0]
+    else:
+        uid, product_id, _ = rng.choice(data['guest_cards'])
+        if rng.random() < FACILITY_TAP_RATE:
+            product_id = rng.choice(facilities)
+    return json.dumps({
+        'uid': uid,
+        'product_id': product_id,
+        'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'access': 'Granted'
+    })
+
+
+def run_worker(kind, worker, args, data, recorder, stop):
+    rng = random.Random(f"{args.seed}-{kind}-{worker}")
+    client = Client(args.base_url, args.timeout)
+    facilities = [product_id for product_id, _, _ in data['vip_rooms']]
+    mix = [(name, build) for name, weight, build in DASHBOARD_MIX for _ in range(weight)]
+    workers = args.concurrency if kind == 'tap' else args.dashboard_concurrency
+    interval = workers / args.rate if args.rate else 0.0
+    next_send = time.perf_counter()
+    try:
+        while not stop.is_set():
+            if interval:
+                # Open loop: send on schedule even if earlier requests were slow
+                next_send += interval
+                delay = next_send - time.perf_counter()
+                if delay > 0:
+                    stop.wait(delay)
+            if kind == 'tap':
+                endpoint, method, path, body = 'access', 'POST', '/access', tap_request(rng, data, facilities).encode()
+            else:
+                endpoint, build = rng.choice(mix)
+                method, path, body = 'GET', build(rng, data), None
+            started = time.perf_counter()
+            status = client.request(method, path, body)
+            recorder.add(endpoint, time.perf_counter() - started, status)
+    finally:
+        client.close()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://localhost:5000')
+    parser.add_argument('--scenario', choices=['taps', 'dashboard', 'mixed'], default='mixed')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small',
+                        help="Hotel generated by benchmark.hotel_data")
+    parser.add_argument('--rooms', type=int, help="Room count passed to benchmark.hotel_data, if overridden")
+    parser.add_argument('--occupancy', type=float, default=0.7)
+    parser.add_argument('--past-stays', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--anchor', type=parse_anchor, default=DEFAULT_ANCHOR,
+                        help="The --anchor the hotel was generated with (default: %(default)s)")
+    parser.add_argument('--concurrency', type=int, default=8, help="Tap workers")
+    parser.add_argument('--dashboard-concurrency', type=int, default=4, help="Dashboard workers")
+    parser.add_argument('--rate', type=float, help="Requests per second per worker kind (default: as fast as possible)")
+    parser.add_argument('--duration', type=float, default=30, help="Measured seconds")
+    parser.add_argument('--warmup', type=float, default=5, help="Unmeasured seconds before measuring")
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--label', default='', help="Free text stored with the result, e.g. the change under test")
+    parser.add_argument('--output', help="Result file (default: benchmark/results/<scenario>-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    rooms = args.rooms or SCALES[args.scale][0]
+    # Same arguments as the hotel_data run, so the cards match what is in the database
+    data = hotel(rooms, args.seed, args.occupancy, args.past_stays, args.anchor)
+    data['guest_cards'] = [card for card in data['packages'] if card[1] is not None]
+    if not data['guest_cards']:
+        parser.error("The generated hotel has no checked-in guests; raise --occupancy or --rooms")
+
+    kinds = []
+    if args.scenario in ('taps', 'mixed'):
+        kinds += [('tap', worker) for worker in range(args.concurrency)]
+    if args.scenario in ('dashboard', 'mixed'):
+        kinds += [('dashboard', worker) for worker in range(args.dashboard_concurrency)]
+
+    recorder = Recorder()
+    stop = threading.Event()
+    threads = [threading.Thread(target=run_worker, args=(kind, worker, args, data, recorder, stop), daemon=True)
+               for kind, worker in kinds]
+    print(f"{args.scenario}: {len(threads)} workers against {args.base_url}, {rooms} rooms, "
+          f"{args.warmup:.0f}s warm-up, {args.duration:.0f}s measured")
+    for thread in threads:
+        thread.start()
+    time.sleep(args.warmup)
+    recorder.measuring = True
+    started = time.perf_counter()
+    time.sleep(args.duration)
+    recorder.measuring = False
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in threads:
+        thread.join(args.timeout)
+
+    endpoints = sorted(set(recorder.latencies) | set(recorder.errors))
+    all_latencies = [value for values in recorder.latencies.values() for value in values]
+    result = {
+        'commit': git_commit(),
+        'label': args.label,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'config': {key: value.isoformat(sep=' ') if isinstance(value, datetime) else value
+                   for key, value in vars(args).items() if key not in ('output', 'label')},
+        'rooms': rooms,
+        'elapsed_s': round(elapsed, 3),
+        'total': summarize(all_latencies, sum(recorder.errors.values()), elapsed),
+        'endpoints': {
+            endpoint: dict(summarize(recorder.latencies.get(endpoint, []), recorder.errors.get(endpoint, 0), elapsed),
+                           statuses=recorder.statuses.get(endpoint, {}))
+            for endpoint in endpoints
+        }
+    }
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{args.scenario}-{result['commit']}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    print_results([(output, result)])
+    print(f"\nSaved {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+Query-count and compile-time benchmark for the access-control snapshot.
+
+Feeds synthetic hotels of increasing size to access_snapshot and reports how
+many statements the builder issues and how long the in-memory join takes.
+The query count must stay constant as the guest count grows.
+
+Usage (from the backend directory):
+
+    python -m benchmark.snapshot_queries
+    python -m benchmark.snapshot_queries --guests 10 100 1000 5000
+    python -m benchmark.snapshot_queries --live   # count against the .env database
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from access_snapshot import build_access_snapshot
+
+FACILITIES = ['Lounge Room', 'Spa Room', 'Top Pool', 'Gym']
+PACKAGES = ['Standard', 'Deluxe', 'Suite', 'Executive']
+
+
+class RecordingCursor:
+    """Cursor stand-in that serves synthetic rows by table and counts statements"""
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.statements = []
+        self._result = []
+
+    def execute(self, sql, params=None):
+        self.statements.append(sql)
+        normalized = ' '.join(sql.split())
+        if 'FROM access_matrix' in normalized:
+            self._result = self.tables['matrix']
+        elif 'FROM vip_rooms' in normalized:
+            self._result = self.tables['vip_rooms']
+        elif 'FROM productstable' in normalized:
+            self._result = self.tables['products']
+        elif 'FROM card_packages' in normalized:
+            self._result = self.tables['packages']
+        elif 'FROM card_assignments' in normalized:
+            self._result = self.tables['cards']
+        elif 'FROM guest_registrations' in normalized:
+            self._result = self.tables['guests']
+        else:
+            self._result = []
+
+    def fetchall(self):
+        return list(self._result)
+
+    def fetchone(self):
+        return self._result[0] if self._result else None
+
+
+class CountingCursor:
+    """Wraps a real cursor and records every statement"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        self.statements.append(sql)
+        return self.cursor.execute(sql, params)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+def synthetic_hotel(guests):
+    """Rows for a hotel with one occupied room per guest"""
+    now = datetime.now()
+    matrix = [
+        {'package_type': package, 'facility': facility, 'has_access': (i + j) % 2 == 0}
+        for i, package in enumerate(PACKAGES)
+        for j, facility in enumerate(FACILITIES)
+    ]
+    vip_rooms = [
+        {'product_id': f"V{i}", 'vip_rooms': facility, 'updated': False}
+        for i, facility in enumerate(FACILITIES)
+    ]
+    products = [{'product_id': f"P{i}", 'room_no': str(100 + i), 'updated': False} for i in range(guests)]
+
+    packages = [
+        {'uid': f"C{i}", 'product_id': f"P{i}", 'package_type': PACKAGES[i % len(PACKAGES)]}
+        for i in range(guests)
+    ]
+    packages += [
+        {'uid': 'MASTER', 'product_id': None, 'package_type': 'Master Card'},
+        {'uid': 'SERVICE', 'product_id': None, 'package_type': 'Service Card'}
+    ]
+
+    cards = [
+        {'uid': f"C{i}", 'product_id': f"P{i}", 'type': PACKAGES[i % len(PACKAGES)], 'active': True}
+        for i in range(guests)
+    ]
+    cards += [
+        {'uid': 'MASTER', 'product_id': 'P0', 'type': 'General', 'active': True},
+        {'uid': 'SERVICE', 'product_id': 'P0', 'type': 'General', 'active': True}
+    ]
+
+    guest_rows = [
+        {
+            'name': f"Guest {i}",
+            'uid': f"C{i}",
+            'checkin': now - timedelta(days=1),
+            'checkout': now + timedelta(days=1),
+            'product_id': f"P{i}"
+        }
+        for i in range(guests)
+    ]
+
+    return {
+        'matrix': matrix,
+        'vip_rooms': vip_rooms,
+        'products': products,
+        'packages': packages,
+        'cards': cards,
+        'guests': guest_rows
+    }
+
+
+def run_synthetic(guest_counts, repeat):
+    print(f"{'guests':>8} {'queries':>8} {'compile ms (best)':>18}")
+    for guests in guest_counts:
+        tables = synthetic_hotel(guests)
+        best = None
+        queries = None
+        for _ in range(repeat):
+            cursor = RecordingCursor(tables)
+            started = time.perf_counter()
+            build_access_snapshot(cursor)
+            elapsed = (time.perf_counter() - started) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+            queries = len(cursor.statements)
+        print(f"{guests:>8} {queries:>8} {best:>18.2f}")
+
+
+def run_live(repeat):
+    import os
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    conn = psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        port=os.getenv("DB_PORT"),
+        cursor_factory=RealDictCursor
+    )
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COUNT(*) as count FROM guest_registrations
+            WHERE NOW() BETWEEN checkin_time AND checkout_time
+        """)
+        guests = cursor.fetchone()['count']
+
+        best = None
+        queries = None
+        for _ in range(repeat):
+            counting = CountingCursor(conn.cursor())
+            started = time.perf_counter()
+            build_access_snapshot(counting)
+            elapsed = (time.perf_counter() - started) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+            queries = len(counting.statements)
+            conn.rollback()
+
+        print(f"{'guests':>8} {'queries':>8} {'build ms (best)':>18}")
+        print(f"{guests:>8} {queries:>8} {best:>18.2f}")
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--guests', type=int, nargs='+', default=[10, 100, 300, 1000, 5000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--live', action='store_true', help="Measure against the database configured in .env")
+    args = parser.parse_args()
+
+    if args.live:
+        run_live(args.repeat)
+    else:
+        run_synthetic(args.guests, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
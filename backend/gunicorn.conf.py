@@ -0,0 +1,74 @@
+"""
+Production serving: gunicorn with WEB_WORKERS processes of WEB_THREADS threads.
+
+    pip install gunicorn
+    gunicorn -c gunicorn.conf.py app:app        # from the backend directory
+
+The app is imported once in the master (schema migrations and startup
+checks run once) and the workers are forked from it. Exactly one live
+worker, the background worker, also runs the MQTT client and the
+background jobs (see start_background() in app.py); when it exits, the
+worker that replaces it takes over. During a reload (HUP) the old and the
+new background worker overlap until the old one has drained.
+
+SIGTERM to the master stops the workers gracefully: each starts failing
+/readyz at once, finishes its in-flight requests, then drains its tap
+queue (and, in the background worker, the outbound MQTT queue) within
+SHUTDOWN_TIMEOUT. Load balancers and orchestrators should probe /readyz
+(503 while draining, before every schema migration has been applied or
+without a database) and /healthz (liveness).
+
+Threads and the notification listener start in the workers only
+(post_worker_init), never in the master before the fork.
+"""
+import multiprocessing
+import os
+import signal
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+bind = os.getenv("WEB_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_WORKERS", multiprocessing.cpu_count()))
+threads = int(os.getenv("WEB_THREADS", 8))
+worker_class = 'gthread'
+timeout = int(os.getenv("WEB_TIMEOUT", 60))
+keepalive = 5
+preload_app = True
+# Drain time plus a margin before the master kills a stopping worker
+graceful_timeout = float(os.getenv("SHUTDOWN_TIMEOUT", 25)) + 5
+
+
+def when_ready(server):
+    # Workers open their own connections; close the ones the master used during startup
+    from app import close_db_pool
+    close_db_pool()
+
+
+def pre_fork(server, worker):
+    # Workers still running once this one is up; a reload retires the oldest beyond server.num_workers
+    staying = sorted(server.WORKERS.values(), key=lambda other: other.age)
+    staying = staying[max(0, len(staying) - server.num_workers + 1):] if server.num_workers > 1 else []
+    worker.background = not any(getattr(other, 'background', False) for other in staying)
+
+
+def post_worker_init(worker):
+    from app import draining, start_background, warm_up
+
+    handle_exit = worker.handle_exit
+
+    def handle_term(signum, frame):
+        # Fail /readyz while in-flight requests finish; worker_exit only runs once serving has stopped
+        draining.set()
+        handle_exit(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_term)
+    warm_up()
+    if worker.background:
+        start_background()
+
+
+def worker_exit(server, worker):
+    from app import shutdown
+    shutdown()
@@ -0,0 +1,138 @@
+"""
+Per-request SQL statement profiles for development.
+
+With SQL_PROFILE on, every statement a request runs through the pooled
+cursors is added to that request's RequestProfile: its template (the SQL
+with literals replaced by ?), the shape of its parameters, the row count
+and the duration. A template run repeat_threshold times or more in one
+request is reported as an N+1 suspect, which is what a query issued per
+item of a loop looks like.
+
+ProfileStore keeps the recent reports and per-route aggregates served by
+GET /debug/profile, so a change that adds queries to a route shows up as
+a higher query count (and new suspects) for that route.
+"""
+import collections
+import re
+import threading
+
+MAX_STATEMENTS = 500  # Per request; later statements are only counted
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def normalize_sql(query):
+    """SQL text with whitespace collapsed and literals replaced by ?, so loop iterations share a template"""
+    if isinstance(query, bytes):
+        query = query.decode(errors='replace')
+    elif not isinstance(query, str):
+        query = str(query)
+    text = _STRING_LITERAL.sub('?', query)
+    text = _NUMBER_LITERAL.sub('?', text)
+    text = text.replace('%s', '?')
+    text = _VALUE_LIST.sub('(?, ...)', text)
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+def params_shape(params):
+    """Type names of the parameters (values are not kept): ['str', 'int'], {'uid': 'str'} or None"""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [f"{type(value).__name__}[{len(value)}]" if isinstance(value, (list, tuple)) else type(value).__name__
+                for value in params]
+    return type(params).__name__
+
+
+class RequestProfile:
+    """Statements run while handling one request"""
+
+    def __init__(self):
+        self.statements = []
+        self.count = 0
+        self.total_time = 0.0
+        self._templates = collections.Counter()
+        self._template_time = collections.Counter()
+
+    def add(self, query, params, rowcount, elapsed):
+        template = normalize_sql(query)
+        self.count += 1
+        self.total_time += elapsed
+        self._templates[template] += 1
+        self._template_time[template] += elapsed
+        if len(self.statements) < MAX_STATEMENTS:
+            self.statements.append({
+                'sql': template,
+                'params': params_shape(params),
+                'rows': rowcount,
+                'ms': round(elapsed * 1000, 3)
+            })
+
+    def suspects(self, repeat_threshold):
+        """Templates run at least repeat_threshold times, most repeated first"""
+        return [
+            {'sql': template, 'count': count, 'ms': round(self._template_time[template] * 1000, 3)}
+            for template, count in self._templates.most_common()
+            if count >= repeat_threshold
+        ]
+
+    def report(self, repeat_threshold):
+        return {
+            'queries': self.count,
+            'ms': round(self.total_time * 1000, 3),
+            'distinct': len(self._templates),
+            'n_plus_one': self.suspects(repeat_threshold),
+            'statements': self.statements
+        }
+
+
+class ProfileStore:
+    """Recent request reports plus per-route totals, for the /debug/profile page"""
+
+    def __init__(self, history):
+        self._lock = threading.Lock()
+        self._recent = collections.deque(maxlen=history)
+        self._routes = {}
+
+    def record(self, route, method, status, report):
+        entry = dict(report, route=route, method=method, status=status)
+        key = f"{method} {route}"
+        with self._lock:
+            self._recent.append(entry)
+            totals = self._routes.get(key)
+            if totals is None:
+                totals = self._routes[key] = {'requests': 0, 'queries': 0, 'max_queries': 0, 'ms': 0.0,
+                                              'n_plus_one': {}}
+            totals['requests'] += 1
+            totals['queries'] += report['queries']
+            totals['max_queries'] = max(totals['max_queries'], report['queries'])
+            totals['ms'] += report['ms']
+            for suspect in report['n_plus_one']:
+                totals['n_plus_one'][suspect['sql']] = max(totals['n_plus_one'].get(suspect['sql'], 0), suspect['count'])
+
+    def snapshot(self, route=None, recent=20):
+        with self._lock:
+            routes = {
+                key: {
+                    'requests': totals['requests'],
+                    'avg_queries': round(totals['queries'] / totals['requests'], 2),
+                    'max_queries': totals['max_queries'],
+                    'avg_ms': round(totals['ms'] / totals['requests'], 3),
+                    'n_plus_one': [{'sql': sql, 'max_count': count} for sql, count in
+                                   sorted(totals['n_plus_one'].items(), key=lambda item: -item[1])]
+                }
+                for key, totals in self._routes.items()
+                if route is None or key.split(' ', 1)[1] == route
+            }
+            requests = [entry for entry in self._recent if route is None or entry['route'] == route][-recent:]
+        return {'routes': dict(sorted(routes.items(), key=lambda item: -item[1]['avg_queries'])), 'recent': requests}
+
+    def clear(self):
+        with self._lock:
+            self._recent.clear()
+            self._routes.clear()
@@ -0,0 +1,306 @@
+"""
+Versioned schema migrations and the schema layout the app runs against.
+
+MIGRATIONS is an ordered list of (version, name, step); a step is either
+a SQL string, a function taking a cursor, or an OutsideTransaction
+wrapping a function that takes the connection (for CREATE INDEX
+CONCURRENTLY). migrate() applies the ones missing from schema_migrations,
+each in its own transaction and under an advisory lock so several
+processes starting together apply them once.
+The first steps mirror the CREATE TABLE / ALTER TABLE statements routes
+used to run on every call, so on an existing database they are no-ops
+that only get recorded.
+
+detect_schema() reads the tables and columns once; routes that still
+support older layouts (guest_registrations before id_type) pick their
+query from that SchemaState instead of asking information_schema per
+request. It is read at startup, and re-read by the app's readiness probe
+only while migrations are pending; restart the app after other schema
+changes made from another process.
+
+The app migrates at startup (MIGRATE_ON_STARTUP); to migrate at deploy
+time instead, run from the backend directory:
+
+    python -m schema              # apply pending migrations
+    python -m schema status       # applied and pending versions
+"""
+import argparse
+import logging
+import time
+
+from access_rollup import (
+    OUTCOME_COLUMN_DDL, build_access_request_indexes, create_access_rollup, create_card_assignments
+)
+
+log = logging.getLogger(__name__)
+
+MIGRATION_LOCK = 7460115  # pg advisory lock key, one migrator at a time
+LOCK_POLL_INTERVAL = 0.5
+
+SCHEMA_MIGRATIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+"""
+
+USERS_DDL = """
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        email VARCHAR(255) UNIQUE NOT NULL,
+        password VARCHAR(255) NOT NULL,
+        role VARCHAR(50) NOT NULL DEFAULT 'manager',
+        created_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+"""
+
+USERS_ADDED_BY_DDL = "ALTER TABLE users ADD COLUMN IF NOT EXISTS added_by_id INTEGER REFERENCES users(id)"
+
+SESSIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS sessions (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        token VARCHAR(255) NOT NULL UNIQUE,
+        created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        expires_at TIMESTAMP NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+"""
+
+USER_HISTORY_DDL = """
+    CREATE TABLE IF NOT EXISTS user_history (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        change_type VARCHAR(50) NOT NULL,
+        previous_value TEXT,
+        new_value TEXT,
+        changed_by_id INTEGER NOT NULL,
+        changed_by_email VARCHAR(255) NOT NULL,
+        timestamp TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+"""
+
+GUEST_REGISTRATIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS guest_registrations (
+        id SERIAL PRIMARY KEY,
+        guest_id VARCHAR(255),
+        name VARCHAR(255) NOT NULL,
+        id_type VARCHAR(50) NOT NULL DEFAULT 'aadhar',
+        id_number VARCHAR(50) NOT NULL,
+        address TEXT,
+        room_id VARCHAR(255) NOT NULL,
+        card_ui_id VARCHAR(255) NOT NULL,
+        checkin_time TIMESTAMP NOT NULL,
+        checkout_time TIMESTAMP NOT NULL,
+        registered_by INTEGER REFERENCES users(id),
+        created_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+"""
+
+HELP_MESSAGES_DDL = """
+    CREATE TABLE IF NOT EXISTS help_messages (
+        id SERIAL PRIMARY KEY,
+        sender VARCHAR(255) NOT NULL,
+        sender_role VARCHAR(50) NOT NULL,
+        recipient VARCHAR(255) NOT NULL,
+        recipient_role VARCHAR(50) NOT NULL,
+        subject TEXT NOT NULL,
+        message TEXT NOT NULL,
+        priority VARCHAR(50) NOT NULL DEFAULT 'normal',
+        timestamp TIMESTAMP NOT NULL DEFAULT NOW(),
+        is_read BOOLEAN NOT NULL DEFAULT FALSE
+    )
+"""
+
+MANAGERS_DDL = """
+    CREATE TABLE IF NOT EXISTS managers (
+        manager_id VARCHAR(50) PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        role VARCHAR(50) NOT NULL DEFAULT 'manager',
+        card_ui_id VARCHAR(255) UNIQUE NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+"""
+
+# Epoch seconds from the app's clock, the one token iat/exp claims use
+TOKEN_REVOCATIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS token_revocations (
+        key VARCHAR(255) PRIMARY KEY,
+        revoked_at DOUBLE PRECISION NOT NULL,
+        expires_at DOUBLE PRECISION NOT NULL
+    )
+"""
+
+
+class OutsideTransaction:
+    """A migration step that manages its own transactions; called with the connection, not a cursor"""
+
+    def __init__(self, run):
+        self.run = run
+
+
+def upgrade_guest_id_columns(cursor):
+    """Older guest_registrations kept aadhar_number only; add id_type and rename it to id_number"""
+    columns = detect_schema(cursor).columns.get('guest_registrations', frozenset())
+    if 'id_type' not in columns:
+        cursor.execute("ALTER TABLE guest_registrations ADD COLUMN id_type VARCHAR(50) NOT NULL DEFAULT 'aadhar'")
+    if 'aadhar_number' in columns and 'id_number' not in columns:
+        cursor.execute("ALTER TABLE guest_registrations RENAME COLUMN aadhar_number TO id_number")
+
+
+MIGRATIONS = [
+    (1, 'users', USERS_DDL),
+    (2, 'users_added_by', USERS_ADDED_BY_DDL),
+    (3, 'sessions', SESSIONS_DDL),
+    (4, 'user_history', USER_HISTORY_DDL),
+    (5, 'guest_registrations', GUEST_REGISTRATIONS_DDL),
+    (6, 'guest_registrations_id_type', upgrade_guest_id_columns),
+    (7, 'help_messages', HELP_MESSAGES_DDL),
+    (8, 'managers', MANAGERS_DDL),
+    (9, 'token_revocations', TOKEN_REVOCATIONS_DDL),
+    (10, 'access_requests_outcome', OUTCOME_COLUMN_DDL),
+    (11, 'access_requests_indexes', OutsideTransaction(build_access_request_indexes)),
+    (12, 'access_rollup', create_access_rollup),
+    (13, 'card_assignments', create_card_assignments),
+]
+
+
+class SchemaState:
+    """Tables and columns of the current schema plus the migration version, as read at startup"""
+
+    def __init__(self, columns, version):
+        self.columns = columns
+        self.version = version
+
+    def has_table(self, table):
+        return table in self.columns
+
+    def has_column(self, table, column):
+        return column in self.columns.get(table, ())
+
+    def is_current(self):
+        """Every migration applied, including the ones that backfill analytics tables"""
+        return self.version >= MIGRATIONS[-1][0]
+
+    def as_dict(self):
+        return {
+            'version': self.version,
+            'latest': MIGRATIONS[-1][0],
+            'tables': {table: sorted(columns) for table, columns in sorted(self.columns.items())}
+        }
+
+
+def applied_versions(cursor):
+    """Versions recorded in schema_migrations (empty before the first migrate())"""
+    cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL as exists")
+    if not cursor.fetchone()['exists']:
+        return set()
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row['version'] for row in cursor.fetchall()}
+
+
+def detect_schema(cursor):
+    """One information_schema read of every table and column in the current schema"""
+    cursor.execute("""
+        SELECT table_name, column_name FROM information_schema.columns
+        WHERE table_schema = current_schema()
+    """)
+    columns = {}
+    for row in cursor.fetchall():
+        columns.setdefault(row['table_name'], set()).add(row['column_name'])
+    versions = applied_versions(cursor)
+    return SchemaState({table: frozenset(names) for table, names in columns.items()},
+                       max(versions) if versions else 0)
+
+
+def acquire_migration_lock(conn, cursor):
+    """
+    Take MIGRATION_LOCK, polling instead of blocking in pg_advisory_lock:
+    a blocked session holds a snapshot, which an index build running
+    CONCURRENTLY in the migrating session would wait on forever.
+    """
+    while True:
+        cursor.execute("SELECT pg_try_advisory_lock(%s) as locked", (MIGRATION_LOCK,))
+        locked = cursor.fetchone()['locked']
+        conn.commit()
+        if locked:
+            return
+        time.sleep(LOCK_POLL_INTERVAL)
+
+
+def migrate(conn):
+    """
+    Apply pending MIGRATIONS in version order, one transaction each.
+
+    Returns:
+        list: (version, name) of the migrations applied by this call
+    """
+    cursor = conn.cursor()
+    applied = []
+    acquire_migration_lock(conn, cursor)
+    try:
+        cursor.execute(SCHEMA_MIGRATIONS_DDL)
+        conn.commit()
+        done = applied_versions(cursor)
+        for version, name, step in MIGRATIONS:
+            if version in done:
+                continue
+            try:
+                if isinstance(step, OutsideTransaction):
+                    step.run(conn)
+                elif callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            log.info("Applied schema migration %s: %s", version, name)
+            applied.append((version, name))
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK,))
+        conn.commit()
+        cursor.close()
+    return applied
+
+
+def main():
+    import os
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', nargs='?', default='migrate', choices=['migrate', 'status'])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    load_dotenv()
+    conn = psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        port=os.getenv("DB_PORT"),
+        cursor_factory=RealDictCursor
+    )
+    try:
+        if args.command == 'migrate':
+            applied = migrate(conn)
+            print(f"{len(applied)} migrations applied" if applied else "Schema is up to date")
+            return
+
+        cursor = conn.cursor()
+        done = applied_versions(cursor)
+        for version, name, _ in MIGRATIONS:
+            print(f"{version:>4} {name:<32} {'applied' if version in done else 'pending'}")
+        cursor.close()
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
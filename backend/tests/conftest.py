@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The backend modules are imported top-level, as the app runs them from the backend directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,111 @@
+"""SnapshotCache versions, deltas and change events, driven by in-memory snapshot rows"""
+from access_snapshot import SnapshotCache, content_version
+
+
+def snapshot_rows(cards, guests=()):
+    """load_snapshot_rows() output for one room P1 with the given card and guest rows"""
+    return {
+        'matrix': [],
+        'vip_rooms': [],
+        'products': [{'product_id': 'P1', 'room_no': '101', 'updated': False}],
+        'packages': [],
+        'cards': [{'uid': uid, 'product_id': 'P1', 'type': 'General', 'active': active} for uid, active in cards],
+        'guests': [{'name': name, 'uid': uid, 'checkin': '2026-01-01 12:00:00', 'checkout': '2026-01-05 12:00:00',
+                    'product_id': 'P1'} for name, uid in guests]
+    }
+
+
+class Hotel:
+    """Mutable rows behind a SnapshotCache; set() changes them and marks P1 dirty"""
+
+    def __init__(self, history=32, **rows):
+        self.cache = SnapshotCache(ttl=3600, history=history)
+        self.rows = snapshot_rows(**rows)
+
+    def load(self):
+        return self.rows
+
+    def get(self):
+        return self.cache.get('P1', self.load)
+
+    def set(self, **rows):
+        self.rows = snapshot_rows(**rows)
+        self.cache.mark_dirty('P1')
+        return self.get()
+
+
+def test_unchanged_rebuild_keeps_version():
+    hotel = Hotel(cards=[('A', True)])
+    entry = hotel.get()
+    assert entry['version'] == content_version(entry['product'], entry['cards'])
+
+    hotel.cache.mark_all_dirty()
+    rebuilt = hotel.get()
+    assert rebuilt['version'] == entry['version']
+    assert hotel.cache.stats()['rebuilds'] == 2
+    assert hotel.cache.delta(rebuilt, entry['version'])['product_cards'] == {'added': [], 'removed': []}
+
+
+def test_version_matches_across_caches():
+    first, second = Hotel(cards=[('A', True), ('B', False)]), Hotel(cards=[('B', False), ('A', True)])
+    assert first.get()['version'] == second.get()['version']
+
+
+def test_events_for_added_removed_and_activated_cards():
+    hotel = Hotel(cards=[('A', False), ('B', True)])
+    before = hotel.get()
+    after = hotel.set(cards=[('A', True), ('C', True)])
+    assert after['version'] != before['version']
+
+    events = {event['uid']: event for event in hotel.cache.events(after, before['version'])}
+    assert events['A']['event'] == 'card_activated'
+    assert events['A']['card'] == {'uid': 'A', 'type': 'General', 'active': True}
+    assert events['C']['event'] == 'card_added'
+    assert events['B'] == {'event': 'card_revoked', 'uid': 'B'}
+
+    back = {event['uid']: event['event'] for event in hotel.cache.events(before, after['version'])}
+    assert back == {'A': 'card_deactivated', 'B': 'card_added', 'C': 'card_revoked'}
+
+
+def test_delta_lists_changed_and_removed_uids():
+    hotel = Hotel(cards=[('A', True), ('B', True)], guests=[('Guest A', 'A')])
+    before = hotel.get()
+    after = hotel.set(cards=[('A', True), ('C', True)], guests=[('Guest C', 'C')])
+
+    delta = hotel.cache.delta(after, before['version'])
+    assert delta['since_version'] == before['version']
+    assert delta['version'] == after['version']
+    assert delta['product_cards'] == {'added': [{'uid': 'C', 'type': 'General', 'active': True}], 'removed': ['B']}
+    assert [guest['uid'] for guest in delta['guests']['added']] == ['C']
+    assert delta['guests']['removed'] == ['A']
+    assert [card['uid'] for card in delta['cards']['added']] == ['C']
+    assert delta['cards']['removed'] == ['A']
+
+
+def test_evicted_version_returns_none():
+    hotel = Hotel(history=2, cards=[('A', True)])
+    first = hotel.get()
+    second = hotel.set(cards=[('A', False)])
+    third = hotel.set(cards=[('A', False), ('B', True)])
+
+    assert hotel.cache.delta(third, second['version']) is not None
+    assert hotel.cache.delta(third, first['version']) is None
+    assert hotel.cache.events(third, first['version']) is None
+    assert hotel.cache.delta(third, 12345) is None
+
+
+def test_document_returning_to_earlier_state():
+    hotel = Hotel(history=2, cards=[('A', True)])
+    first = hotel.get()
+    second = hotel.set(cards=[('A', False)])
+    returned = hotel.set(cards=[('A', True)])
+    assert returned['version'] == first['version']
+
+    # Nothing changed since the first version, and the second is still held
+    assert hotel.cache.events(returned, first['version']) == []
+    assert [event['event'] for event in hotel.cache.events(returned, second['version'])] == ['card_activated']
+
+    # Returning made the first version the newest, so the next change evicts the second
+    latest = hotel.set(cards=[('A', True), ('B', True)])
+    assert hotel.cache.delta(latest, first['version']) is not None
+    assert hotel.cache.delta(latest, second['version']) is None
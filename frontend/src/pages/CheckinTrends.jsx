@@ -47,6 +47,13 @@ const CheckinTrends = () => {
                          "06:00", "07:00", "08:00", "09:00", "10:00", "11:00", 
                          "12:00", "13:00", "14:00", "15:00", "16:00", "17:00", 
                          "18:00", "19:00", "20:00", "21:00", "22:00", "23:00"];
+  // Long ranges come back summed per week/month/year (the `bucket` field); labels are each bucket's first day
+  const BUCKETS = {
+    day: { name: 'Daily', axis: 'Date' },
+    week: { name: 'Weekly', axis: 'Week starting' },
+    month: { name: 'Monthly', axis: 'Month' },
+    year: { name: 'Yearly', axis: 'Year' }
+  };
   
   // State for form and data
   const [period, setPeriod] = useState('30');
@@ -75,6 +82,7 @@ const CheckinTrends = () => {
     denied_percentage: 0,
     date_labels: [],
     daily_counts: [],
+    bucket: 'day',
     hourly_counts: Array(24).fill(0),
     day_of_week_counts: Array(7).fill(0),
     max_daily: 0,
@@ -217,11 +225,19 @@ const CheckinTrends = () => {
     return labels;
   };
 
+  // Trend bucket of the current response and its labels ("2024-03-01" -> "2024-03" for months)
+  const bucket = BUCKETS[checkinData.bucket] ? checkinData.bucket : 'day';
+  const formatBucketLabel = (label) => {
+    if (bucket === 'month') return label.substring(0, 7);
+    if (bucket === 'year') return label.substring(0, 4);
+    return label;
+  };
+
   // Create chart data and options
   const dailyTrendData = {
-    labels: checkinData.date_labels,
+    labels: checkinData.date_labels.map(formatBucketLabel),
     datasets: [{
-      label: 'Daily Check-ins',
+      label: `${BUCKETS[bucket].name} Check-ins`,
       data: checkinData.daily_counts,
       backgroundColor: ZENV_COLORS.lightBlue,
       borderColor: ZENV_COLORS.primary,
@@ -258,6 +274,11 @@ const CheckinTrends = () => {
           },
           maxTicksLimit: windowWidth < 576 ? 5 : (windowWidth < 992 ? 7 : undefined)
         },
+        title: {
+          display: windowWidth >= 576,
+          text: BUCKETS[bucket].axis,
+          color: ZENV_COLORS.mediumGray
+        },
         grid: {
           display: windowWidth >= 576
         }
@@ -275,6 +296,9 @@ const CheckinTrends = () => {
         }
       },
       tooltip: {
+        callbacks: {
+          title: (items) => (bucket === 'week' ? `Week of ${items[0].label}` : items[0].label)
+        },
         titleFont: {
           size: windowWidth < 768 ? 12 : 14
         },
@@ -654,7 +678,7 @@ const CheckinTrends = () => {
             <Card.Header className="bg-white py-3 border-0">
               <h6 className="m-0 fw-bold" style={{ color: ZENV_COLORS.primary }}>
                 <FontAwesomeIcon icon={faChartLine} className="me-2" />
-                Daily Check-in Trend
+                {BUCKETS[bucket].name} Check-in Trend
               </h6>
             </Card.Header>
             <Card.Body className="p-4">
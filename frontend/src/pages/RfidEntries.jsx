@@ -9,11 +9,11 @@ import {
   Pagination, 
   Modal,
   Dropdown,
+  Form,
   Container,
   Row,
   Col
 } from 'react-bootstrap';
-import { useNavigate, useLocation } from 'react-router-dom';
 import axios from 'axios';
 import { FontAwesomeIcon } from '@fortawesome/react-fontawesome';
 import { 
@@ -46,6 +46,9 @@ const ZENV_COLORS = {
   lightOrange: 'rgba(255, 208, 0, 0.1)',
 };
 
+// Entries per page requested from the server
+const PAGE_SIZE = 10;
+
 const RfidEntries = () => {
   // State for entries data
   const [entries, setEntries] = useState([]);
@@ -53,6 +56,8 @@ const RfidEntries = () => {
   const [error, setError] = useState(null);
   const [page, setPage] = useState(1);
   const [totalPages, setTotalPages] = useState(1);
+  const [totalEntries, setTotalEntries] = useState(0);
+  const [totalEstimated, setTotalEstimated] = useState(false);
   const [searchTerm, setSearchTerm] = useState('');
   const [filteredEntries, setFilteredEntries] = useState([]);
   const [showModal, setShowModal] = useState(false);
@@ -60,23 +65,23 @@ const RfidEntries = () => {
   const [windowWidth, setWindowWidth] = useState(window.innerWidth);
   const [roomMapping, setRoomMapping] = useState({});
 
+  // Keyset pagination: the cursor of the page being shown and the server's
+  // cursors for the neighbouring pages
+  const [pageCursor, setPageCursor] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [prevCursor, setPrevCursor] = useState(null);
+
+  // Server-side filters: the ones applied and the ones being edited
+  const emptyFilters = { uid: '', room: '', outcome: '', start_date: '', end_date: '' };
+  const [filters, setFilters] = useState(emptyFilters);
+  const [filterDraft, setFilterDraft] = useState(emptyFilters);
+
   // const [socket, setSocket] = useState(null);
   
-  // Summary statistics
-  const [stats, setStats] = useState({
-    totalEntries: 0,
-    accessGranted: 0,
-    accessDenied: 0,
-    todayEntries: 0
-  });
-  
   // Sorting state
   const [sortField, setSortField] = useState(null);
   const [sortDirection, setSortDirection] = useState('asc');
   
-  // Navigation and query params
-  const navigate = useNavigate();
-  const location = useLocation();
   const searchInputRef = useRef(null);
 
 
@@ -91,50 +96,34 @@ const RfidEntries = () => {
     return () => window.removeEventListener('resize', handleResize);
   }, []);
   
-  // Get page from URL params on initial load
-  useEffect(() => {
-    const params = new URLSearchParams(location.search);
-    const pageParam = parseInt(params.get('page'), 10);
-    if (pageParam && !isNaN(pageParam)) {
-      setPage(pageParam);
-    }
-  }, [location.search]);
-  
-
-  
 
-// Add this function to your component (outside of any useEffect)
 const fetchEntries = async () => {
   try {
     setLoading(true);
-    // Fetch entries from API with pagination
+    // Only send the filters that are set
+    const params = { limit: PAGE_SIZE };
+    Object.entries(filters).forEach(([key, value]) => {
+      if (value) params[key] = value;
+    });
+    if (pageCursor) {
+      params.cursor = pageCursor.cursor;
+      params.direction = pageCursor.direction;
+    }
+
     const response = await axios.get(`http://localhost:5000/api/rfid_entries`, {
-      params: { page },
+      params,
       headers: {
         'Authorization': `Bearer ${localStorage.getItem('token')}`
       }
     });
     
-    // Update entries state
     setEntries(response.data.entries);
     setFilteredEntries(response.data.entries);
     setTotalPages(response.data.total_pages);
-    
-    // Calculate summary statistics
-    const today = new Date();
-    const todayString = today.toISOString().split('T')[0];
-    const allEntries = response.data.entries || [];
-    
-    const granted = allEntries.filter(e => e.access_status.includes('Granted')).length;
-    const denied = allEntries.length - granted;
-    const todayCount = allEntries.filter(e => e.timestamp?.startsWith(todayString)).length;
-    
-    setStats({
-      totalEntries: allEntries.length,
-      accessGranted: granted,
-      accessDenied: denied,
-      todayEntries: todayCount
-    });
+    setTotalEntries(response.data.total_entries);
+    setTotalEstimated(response.data.total_estimated);
+    setNextCursor(response.data.next_cursor);
+    setPrevCursor(response.data.prev_cursor);
     
     setLoading(false);
   } catch (err) {
@@ -143,49 +132,6 @@ const fetchEntries = async () => {
     setLoading(false);
   }
 };
-useEffect(() => {
-  const fetchEntries = async () => {
-    try {
-      setLoading(true);
-      // Fetch entries from API with pagination
-      const response = await axios.get(`http://localhost:5000/api/rfid_entries`, {
-        params: { page },
-        headers: {
-          'Authorization': `Bearer ${localStorage.getItem('token')}`
-        }
-      });
-      
-      // No longer filtering out entries with "deleted" status
-      setEntries(response.data.entries);
-      setFilteredEntries(response.data.entries);
-      setTotalPages(response.data.total_pages);
-      
-      // Calculate summary statistics
-      const today = new Date();
-      const todayString = today.toISOString().split('T')[0];
-      const allEntries = response.data.entries || [];
-      
-      const granted = allEntries.filter(e => e.access_status.includes('Granted')).length;
-      const denied = allEntries.length - granted;
-      const todayCount = allEntries.filter(e => e.timestamp?.startsWith(todayString)).length;
-      
-      setStats({
-        totalEntries: allEntries.length,
-        accessGranted: granted,
-        accessDenied: denied,
-        todayEntries: todayCount
-      });
-      
-      setLoading(false);
-    } catch (err) {
-      console.error('Error fetching RFID entries:', err);
-      setError('Failed to load RFID entries: ' + (err.response?.data?.error || err.message));
-      setLoading(false);
-    }
-  };
-  
-  fetchEntries();
-}, [page]);
   
 
   useEffect(() => {
@@ -226,18 +172,25 @@ useEffect(() => {
     fetchRoomData();
   }, []);
   
-  // Handle pagination
-  const handlePageChange = (newPage) => {
-    if (newPage >= 1 && newPage <= totalPages) {
-      // Update URL with page number
-      navigate(`/rfid_entries?page=${newPage}`);
-      setPage(newPage);
-    }
+  // Handle pagination: step to the older (next) or newer (prev) page
+  const handlePageChange = (direction) => {
+    const cursor = direction === 'next' ? nextCursor : prevCursor;
+    if (!cursor) return;
+    setPageCursor({ cursor, direction });
+    setPage(direction === 'next' ? page + 1 : Math.max(page - 1, 1));
+  };
+
+  // Apply or clear the server-side filters, starting again from the newest entries
+  const applyFilters = (newFilters) => {
+    setFilterDraft(newFilters);
+    setFilters(newFilters);
+    setPageCursor(null);
+    setPage(1);
   };
   
   useEffect(() => {
   fetchEntries();
-}, [page]); // Only dependency is page
+}, [pageCursor, filters]);
 
 
 
@@ -380,77 +333,6 @@ const handleSearch = () => {
     setShowModal(true);
   };
   
-  // Render pagination items
-  const renderPaginationItems = () => {
-    const items = [];
-    const maxVisiblePages = windowWidth < 576 ? 3 : (windowWidth < 768 ? 5 : 7);
-    
-    // Always show first page
-    if (totalPages > 1) {
-      items.push(
-        <Pagination.Item 
-          key={1} 
-          active={1 === page}
-          onClick={() => handlePageChange(1)}
-        >
-          {1}
-        </Pagination.Item>
-      );
-    }
-    
-    // Show ellipsis if needed
-    if (page > 3) {
-      items.push(<Pagination.Ellipsis key="ellipsis-start" disabled />);
-    }
-    
-    // Calculate range of pages to show
-    let startPage = Math.max(2, page - Math.floor((maxVisiblePages - 2) / 2));
-    let endPage = Math.min(totalPages - 1, startPage + maxVisiblePages - 3);
-    
-    // Adjust if we're at the ends
-    if (endPage <= startPage) {
-      // Very few pages
-      startPage = 2;
-      endPage = Math.min(totalPages - 1, startPage);
-    } else if (endPage === totalPages - 1) {
-      // Near the end
-      startPage = Math.max(2, totalPages - maxVisiblePages + 2);
-    }
-    
-    // Add the range of pages
-    for (let i = startPage; i <= endPage; i++) {
-      items.push(
-        <Pagination.Item 
-          key={i} 
-          active={i === page}
-          onClick={() => handlePageChange(i)}
-        >
-          {i}
-        </Pagination.Item>
-      );
-    }
-    
-    // Add ellipsis before last page if needed
-    if (endPage < totalPages - 1) {
-      items.push(<Pagination.Ellipsis key="ellipsis-end" disabled />);
-    }
-    
-    // Always show last page if more than one page
-    if (totalPages > 1) {
-      items.push(
-        <Pagination.Item 
-          key={totalPages} 
-          active={totalPages === page}
-          onClick={() => handlePageChange(totalPages)}
-        >
-          {totalPages}
-        </Pagination.Item>
-      );
-    }
-    
-    return items;
-  };
-  
   // Column header component with sort dropdown
   const SortableColumnHeader = ({ field, label }) => (
     <div className="d-flex align-items-center">
@@ -611,6 +493,66 @@ const handleSearch = () => {
             </Button>
           </div>
         </Card.Header>
+        {/* Server-side filters (the search box above only searches the current page) */}
+        <div className="px-3 pb-3 bg-white">
+          <Row className="g-2 align-items-end">
+            <Col xs={12} sm={6} lg={2}>
+              <Form.Label className="small text-muted mb-1">UID</Form.Label>
+              <Form.Control
+                size="sm"
+                value={filterDraft.uid}
+                onChange={(e) => setFilterDraft({ ...filterDraft, uid: e.target.value })}
+              />
+            </Col>
+            <Col xs={12} sm={6} lg={2}>
+              <Form.Label className="small text-muted mb-1">Room</Form.Label>
+              <Form.Control
+                size="sm"
+                value={filterDraft.room}
+                onChange={(e) => setFilterDraft({ ...filterDraft, room: e.target.value })}
+              />
+            </Col>
+            <Col xs={12} sm={4} lg={2}>
+              <Form.Label className="small text-muted mb-1">Status</Form.Label>
+              <Form.Select
+                size="sm"
+                value={filterDraft.outcome}
+                onChange={(e) => setFilterDraft({ ...filterDraft, outcome: e.target.value })}
+              >
+                <option value="">All</option>
+                <option value="granted">Granted</option>
+                <option value="denied">Denied</option>
+                <option value="other">Other</option>
+              </Form.Select>
+            </Col>
+            <Col xs={6} sm={4} lg={2}>
+              <Form.Label className="small text-muted mb-1">From</Form.Label>
+              <Form.Control
+                size="sm"
+                type="date"
+                value={filterDraft.start_date}
+                onChange={(e) => setFilterDraft({ ...filterDraft, start_date: e.target.value })}
+              />
+            </Col>
+            <Col xs={6} sm={4} lg={2}>
+              <Form.Label className="small text-muted mb-1">To</Form.Label>
+              <Form.Control
+                size="sm"
+                type="date"
+                value={filterDraft.end_date}
+                onChange={(e) => setFilterDraft({ ...filterDraft, end_date: e.target.value })}
+              />
+            </Col>
+            <Col xs={12} lg={2} className="d-flex gap-2">
+              <Button size="sm" variant="primary" className="rounded-pill flex-grow-1" onClick={() => applyFilters(filterDraft)}>
+                Apply
+              </Button>
+              <Button size="sm" variant="outline-secondary" className="rounded-pill flex-grow-1" onClick={() => applyFilters(emptyFilters)}>
+                Clear
+              </Button>
+            </Col>
+          </Row>
+        </div>
         <Card.Body className="p-0">
           <div className="table-responsive">
             <Table hover id="dataTable" className="mb-0 align-middle">
@@ -718,20 +660,23 @@ const handleSearch = () => {
         <Card.Footer className="py-2 bg-white border-0">
           <div className="d-flex justify-content-between align-items-center">
             <div className="small text-muted">
-              Showing {filteredEntries.length} of {entries.length} entries
+              Showing {filteredEntries.length} of {entries.length} entries on this page
+              {' '}({totalEstimated ? 'about ' : ''}{totalEntries} matching)
             </div>
             
             {/* Pagination */}
-            {totalPages > 1 && (
-              <Pagination size={windowWidth < 768 ? "sm" : ""} className="mb-0">
+            {(prevCursor || nextCursor) && (
+              <Pagination size={windowWidth < 768 ? "sm" : ""} className="mb-0 align-items-center">
                 <Pagination.Prev 
-                  onClick={() => handlePageChange(page - 1)}
-                  disabled={page === 1}
+                  onClick={() => handlePageChange('prev')}
+                  disabled={!prevCursor}
                 />
-                {renderPaginationItems()}
+                <Pagination.Item active>
+                  {page} / {totalEstimated ? '~' : ''}{totalPages}
+                </Pagination.Item>
                 <Pagination.Next 
-                  onClick={() => handlePageChange(page + 1)}
-                  disabled={page === totalPages}
+                  onClick={() => handlePageChange('next')}
+                  disabled={!nextCursor}
                 />
               </Pagination>
             )}